@@ -5,17 +5,15 @@ import asyncio
 import json
 import operator
 import uuid
+from http import HTTPStatus
 from bson import ObjectId
 from textwrap import dedent
 from datetime import datetime
 from typing import Optional, Union, List, Dict, Type, TypedDict, Annotated, Sequence, Tuple
 
-import faiss
 import websockets
 from colorama import Fore, Style
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores.faiss import FAISS
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
 from langchain_core.messages import HumanMessage, SystemMessage, BaseMessage, FunctionMessage, AIMessage
 # from langchain_core.pydantic_v1 import BaseModel, Field
 from pydantic import BaseModel, Field
@@ -23,19 +21,27 @@ from langchain_core.tools import BaseTool
 from langchain_core.utils.function_calling import convert_to_openai_function
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_ollama import ChatOllama, OllamaLLM, OllamaEmbeddings
-from langchain.memory import VectorStoreRetrieverMemory
 from langgraph.graph import StateGraph, END, START
 from langgraph.prebuilt import ToolNode, ToolInvocation, ToolExecutor
 
 from tools import summarize, web_search
 from rag.knowledge_graph import retrieve
 from memory import explicit_memory, implicit_memory, memory_retrieve
+from memory.extraction_queue import MemoryExtractionQueue
+from memory.unified_memory_system import UnifiedMemorySystem
 from prompts import guided_conversation, main_system
 
-from load_config import CHAT_MODEL, API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSION
+from load_config import CHAT_MODEL, API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSION, WEB_SOCKET_PORT, MEMORY_QUEUE_EXTRACTOR, MEMORY_CACHE_CHANGE_STREAM, MEMORY_STORE_LAYOUT, PATIENT_CONTEXT_ENABLED
 from logging_config import setup_logging, disable_logging
 import logging
 from business.diagnose import MedicalDiagnosisProcessor
+from utils.embedding_cache import cached_embeddings
+from utils.session_manager import Session, SessionManager, current_session_id, current_user_input
+from utils.mongo_pool import mongo_pool_stats
+from utils.memory_cache import memory_cache_stats, start_change_stream_invalidation
+from utils.mongodb_patient_info_system import memory_write_stats
+from memory.semantic_memory_index import get_semantic_index
+from memory.patient_context_pack import attach_context_pack, get_context_pack_store
 from flask import Flask,request
 
 logger = logging.getLogger(__name__)
@@ -56,17 +62,21 @@ else:
 
 # 上下文记忆设置
 # embedding_fn = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=HOST)
-embedding_fn = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=API_KEY)
+embedding_fn = cached_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=API_KEY))
 sample_embedding = embedding_fn.embed_query("Sample text")
 actual_dimension = len(sample_embedding)
 
-index = faiss.IndexFlatL2(actual_dimension)
-vectorstore = FAISS(embedding_function=embedding_fn.embed_query, index=index, docstore=InMemoryDocstore({}), index_to_docstore_id={})
-retriever = vectorstore.as_retriever(search_kwargs=dict(k=3))
-memory = VectorStoreRetrieverMemory(retriever=retriever)
+# 每个会话拥有独立的对话状态和短期向量记忆
+session_manager = SessionManager(embedding_fn, actual_dimension)
 
-implicit_memory_knowledge_base = implicit_memory.ImplicitMemorySystem()
-explicit_memory_knowledge_base = explicit_memory.ExplicitMemorySystem()
+# 记忆抽取在后台队列中批量执行，不占用回复路径
+if MEMORY_QUEUE_EXTRACTOR == "unified":
+    memory_systems = [UnifiedMemorySystem()]
+else:
+    implicit_memory_knowledge_base = implicit_memory.ImplicitMemorySystem()
+    explicit_memory_knowledge_base = explicit_memory.ExplicitMemorySystem()
+    memory_systems = [explicit_memory_knowledge_base, implicit_memory_knowledge_base]
+memory_extraction_queue = MemoryExtractionQueue(memory_systems)
 
 
 def generate_session_id():
@@ -92,6 +102,9 @@ class Graph_Knowledge_Retrieve(BaseTool):
             "tool_output": result
         })
 
+    async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        return await asyncio.to_thread(self._run, query)
+
 class Web_Search(BaseTool):
     name: str = "web_search"
     description: str = f"此工具用于获取最新新闻和信息，帮助用户获取最新信息，你的知识最新到2023年11月，而今天是{datetime.now().strftime('%Y-%m-%d')}。当用户的请求明显要求需要最新的信息支撑时，可以尝试调用该工具。否则，请忽略。"
@@ -107,6 +120,14 @@ class Web_Search(BaseTool):
             "tool_output": result
         })
 
+    async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> Union[List[Dict], str]:
+        result = await web_search.run(query)
+        return json.dumps({
+            "tool_name": self.name,
+            "tool_input": query,
+            "tool_output": result
+        })
+
 class Memory_Retrieve(BaseTool):
     name: str = "memory_retrieve"
     description: str = """此工具用于从记忆系统中检索用户相关记忆。你需要根据查询内容，从以下类别中选择最相关的类别进行检索：
@@ -128,11 +149,20 @@ class Memory_Retrieve(BaseTool):
 
     class ArgsSchema(BaseModel):
         categories: List[str] = Field(description="根据查询内容选择的记忆类别列表")
+        query: Optional[str] = Field(default=None, description="需要从记忆中查找的内容（可选，默认使用用户当前的话）")
     args_schema: Type[BaseModel] = ArgsSchema
 
-    def _run(self, categories: List[str], run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+    def _run(self, categories: List[str], query: Optional[str] = None, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        session = session_manager.current()
+        if session is None:
+            return json.dumps({
+                "tool_name": self.name,
+                "tool_input": {"categories": categories},
+                "tool_output": "当前会话不存在或已过期"
+            }, ensure_ascii=False)
+        user_id = session.user_id
         memory_system = memory_retrieve.MemoryRetrievalSystem()
-        raw_memories = memory_system.retrieve_memories_by_categories(user_id=user_id, categories=categories)
+        raw_memories = memory_system.retrieve_memories(user_id, categories, query or current_user_input.get())
         memories = memory_system.parse_memory_result(raw_memories)
         return json.dumps({
             "tool_name": self.name,
@@ -143,6 +173,10 @@ class Memory_Retrieve(BaseTool):
             "tool_output": memories
         }, ensure_ascii=False)
 
+    async def _arun(self, categories: List[str], query: Optional[str] = None, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        # to_thread 会复制当前上下文，current_session_id / current_user_input 在线程中仍可读取
+        return await asyncio.to_thread(self._run, categories, query)
+
 tools = [Graph_Knowledge_Retrieve(), Web_Search(), Memory_Retrieve()]
 tool_executor = ToolExecutor(tools=tools)
 
@@ -155,7 +189,11 @@ class AgentState(TypedDict):
     user_id: str
     start_time: datetime
 
-def initialize_state(system_message: SystemMessage, user_id: str) -> AgentState:
+async def initialize_state(system_message: SystemMessage, user_id: str, context_pack: bool = PATIENT_CONTEXT_ENABLED) -> AgentState:
+    # 会话开始时把患者档案写入系统提示，大多数轮次无需再调用 memory_retrieve；会话重建时替换为最新档案
+    # 档案未命中缓存时会读 MongoDB，放到线程中执行，避免阻塞事件循环上的其他会话
+    fragment = await asyncio.to_thread(get_context_pack_store().fragment, user_id) if context_pack else ""
+    system_message = SystemMessage(content=attach_context_pack(system_message.content, fragment))
     return {
         "messages": [system_message],
         "session_id": generate_session_id(),
@@ -163,27 +201,61 @@ def initialize_state(system_message: SystemMessage, user_id: str) -> AgentState:
         "start_time": datetime.now()
     }
 
+async def ensure_session(state: AgentState) -> Tuple[AgentState, Session]:
+    """取出本轮对话的会话；会话因空闲过期或被淘汰回收后，以原有系统提示重新建立"""
+    session = session_manager.get(state["session_id"])
+    if session is None:
+        state = await initialize_state(state["messages"][0], state["user_id"])
+        session = session_manager.create(state)
+    return state, session
+
+# 客户端在消息中携带 protocol_version >= 2 时使用流式响应
+STREAM_PROTOCOL_VERSION = 2
+TOOL_NAMES = ["graph_knowledge_retrieve", "web_search", "memory_retrieve"]
+
+def requested_protocol_version(json_data: Dict) -> int:
+    """客户端声明的协议版本；缺失或无法转为整数（如 null、"abc"）时按旧协议 1 处理"""
+    try:
+        return int(json_data.get('protocol_version', 1))
+    except (TypeError, ValueError):
+        return 1
+
+def parse_tool_message(name: str, content: str) -> Dict:
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        print(f"Warning: Unable to parse FunctionMessage content as JSON: {content}")
+        return {
+            "tool_name": name,
+            "tool_output": content
+        }
+
+def tool_followup_input(tool_data: Dict) -> str:
+    return f"以下是{tool_data['tool_name']}工具返回的结果: </START>{tool_data['tool_output']}</END>\n，请重新组织后继续与用户进行对话，记住，你不需要说明这些信息是来自于哪的，你可以作为自己的知识来运用。"
+
 def should_continue(state):
     messages = state["messages"]
     last_message = messages[-1]
     function_call = last_message.additional_kwargs.get("function_call")
     if not function_call:
         return "end"
-    elif function_call["name"] in ["graph_knowledge_retrieve", "web_search", "memory_retrieve"]:
+    elif function_call["name"] in TOOL_NAMES:
         return "continue"
     else:
         return "end"
 
-def call_model(state):
+async def call_model(state):
     messages = state["messages"]
     last_message = messages[-1]
-    history = memory.load_memory_variables({"prompt": last_message.content})["history"]
+    session = session_manager.get(state["session_id"])
+    history = (await session.memory.aload_memory_variables({"prompt": last_message.content}))["history"]
     input_text = f"{messages[0].content}\n{history}\n人类: {last_message.content}\n助手: "
-    response = model.invoke(input_text)
-    memory.save_context({"input": last_message.content}, {"output": response.content})
+    response = await model.ainvoke(input_text)
+    await session.memory.asave_context({"input": last_message.content}, {"output": response.content})
+    session_manager.prune_memory(session)
     return {"messages": [response]}
 
-def call_tool(state):
+async def call_tool(state):
     messages = state["messages"]
     last_message = messages[-1]
     action = ToolInvocation(
@@ -192,17 +264,21 @@ def call_tool(state):
             last_message.additional_kwargs["function_call"]["arguments"]
         ),
     )
-    response = tool_executor.invoke(action)
+    current_session_id.set(state["session_id"])
+    human_messages = [message for message in messages if isinstance(message, HumanMessage)]
+    current_user_input.set(human_messages[-1].content if human_messages else None)
+    response = await tool_executor.ainvoke(action)
     function_message = FunctionMessage(content=response, name=action.tool)
     return {"messages": [function_message]}
 
 async def handle_conversation(user_input: str, state: AgentState) -> Tuple[AgentState, str, Optional[Dict]]:
     response_messages = []
     tool_data = None
+    session = session_manager.get(state["session_id"])
     human_message = HumanMessage(content=user_input)
     state["messages"].append(human_message)
-    memory.save_context({"input": user_input}, {"output": ""})
-    for output in app.stream(state):
+    await session.memory.asave_context({"input": user_input}, {"output": ""})
+    async for output in chat_app.astream(state):
         for key, value in output.items():
             if key == "__end__":
                 continue
@@ -210,23 +286,59 @@ async def handle_conversation(user_input: str, state: AgentState) -> Tuple[Agent
                 messages_list = value["messages"]
                 for message in messages_list:
                     if isinstance(message, FunctionMessage):
-                        try:
-                            tool_data = json.loads(message.content)
-                        except json.JSONDecodeError:
-                            print(f"Warning: Unable to parse FunctionMessage content as JSON: {message.content}")
-                            tool_data = {
-                                "tool_name": message.name,
-                                "tool_output": message.content
-                            }
-
-                        ai_input = f"以下是{tool_data['tool_name']}工具返回的结果: </START>{tool_data['tool_output']}</END>\n，请重新组织后继续与用户进行对话，记住，你不需要说明这些信息是来自于哪的，你可以作为自己的知识来运用。"
-                        ai_response = await model.ainvoke(ai_input)
+                        tool_data = parse_tool_message(message.name, message.content)
+                        ai_response = await model.ainvoke(tool_followup_input(tool_data))
                         response_messages.append(ai_response.content)
                     if isinstance(message, AIMessage):
                         response_messages.append(message.content)
     state["messages"] = state["messages"][:1]
     return state, "\n".join(response_messages), tool_data
 
+async def stream_model(input_text: str, send_frame) -> Optional[AIMessage]:
+    """流式调用模型，逐块发送文本增量，返回合并后的完整消息（含 function_call）"""
+    response = None
+    async for chunk in model.astream(input_text):
+        response = chunk if response is None else response + chunk
+        if chunk.content:
+            await send_frame({"event": "token", "delta": chunk.content})
+    return response
+
+async def handle_conversation_stream(user_input: str, state: AgentState, send_frame) -> Tuple[AgentState, str, Optional[Dict]]:
+    """
+    流式版本的 handle_conversation：模型输出按 token 帧发送，
+    工具调用结果就绪后立即以 tool_data 帧发送，再流式生成工具结果之后的回复
+    """
+    response_messages = []
+    tool_data = None
+    session = session_manager.get(state["session_id"])
+    await session.memory.asave_context({"input": user_input}, {"output": ""})
+    history = (await session.memory.aload_memory_variables({"prompt": user_input}))["history"]
+    input_text = f"{state['messages'][0].content}\n{history}\n人类: {user_input}\n助手: "
+
+    response = await stream_model(input_text, send_frame)
+    if response is None:
+        return state, "", None
+    await session.memory.asave_context({"input": user_input}, {"output": response.content})
+    session_manager.prune_memory(session)
+    if response.content:
+        response_messages.append(response.content)
+
+    function_call = response.additional_kwargs.get("function_call")
+    if function_call and function_call.get("name") in TOOL_NAMES:
+        current_session_id.set(state["session_id"])
+        current_user_input.set(user_input)
+        action = ToolInvocation(tool=function_call["name"], tool_input=json.loads(function_call["arguments"] or "{}"))
+        tool_output = await tool_executor.ainvoke(action)
+        tool_data = parse_tool_message(action.tool, tool_output)
+        await send_frame({"event": "tool_data", "tool_data": tool_data})
+
+        if response_messages:
+            await send_frame({"event": "token", "delta": "\n"})
+        ai_response = await stream_model(tool_followup_input(tool_data), send_frame)
+        if ai_response is not None:
+            response_messages.append(ai_response.content)
+    return state, "\n".join(response_messages), tool_data
+
 workflow = StateGraph(AgentState)
 workflow.add_node("agent", call_model)
 workflow.add_node("action", call_tool)
@@ -240,17 +352,14 @@ workflow.add_conditional_edges(
     },
 )
 workflow.add_edge("action", END)
-app = workflow.compile()
+chat_app = workflow.compile()
 
-async def run_psy_predict(user_id, user_input):
-    psy_pred = implicit_memory_knowledge_base.process_user_input(user_id, [user_input])
-    print(Fore.BLUE + f"——————————————————————————————————————————————> ||| 隐式记忆推断: {psy_pred}" + Style.RESET_ALL)
-    return psy_pred
-
-async def run_memory_read(user_id, user_input):
-    exp_pred = explicit_memory_knowledge_base.process_user_input(user_id, [user_input])
-    print(Fore.BLUE + f"——————————————————————————————————————————————> ||| 显式记忆推断: {exp_pred}" + Style.RESET_ALL)
-    return exp_pred
+async def enqueue_memory_extraction(user_id, user_input) -> Dict:
+    """回复路径只把本轮对话加入后台记忆抽取队列，抽取和写库由队列 worker 完成"""
+    queued = await memory_extraction_queue.enqueue(user_id, user_input)
+    memory_data = {"queued": queued, "queue_depth": await memory_extraction_queue.backend.depth()}
+    print(Fore.BLUE + f"——————————————————————————————————————————————> ||| 记忆抽取入队: {memory_data}" + Style.RESET_ALL)
+    return memory_data
 
 async def run_handle_conversation(user_input: str, state: AgentState) -> Tuple[AgentState, str, Optional[Dict]]:
     new_state, response, tool_data = await handle_conversation(user_input, state)
@@ -262,8 +371,30 @@ async def websocket_echo(websocket, path):
         await websocket.send(message)
         print(f"Sent: {message}")
 
+async def handle_stream_turn(websocket, user_id: str, user_input: str, state: AgentState):
+    """
+    流式协议下的一轮对话，依次发送以下帧（均带 protocol_version 和 session_id）:
+        {"event": "memory_data", "memory_data": ...} 记忆抽取入队状态
+        {"event": "token", "delta": ...}            模型输出增量，可能多帧
+        {"event": "tool_data", "tool_data": ...}    工具调用结果（如有）
+        {"event": "done", "message": ...}           本轮结束，附完整回复
+    """
+    send_lock = asyncio.Lock()
+
+    async def send_frame(frame: Dict):
+        frame = {"protocol_version": STREAM_PROTOCOL_VERSION, "session_id": state["session_id"], **frame}
+        async with send_lock:
+            await websocket.send(json.dumps(frame, cls=JSONEncoder, ensure_ascii=False))
+
+    memory_data = await enqueue_memory_extraction(user_id, user_input)
+    await send_frame({"event": "memory_data", "memory_data": memory_data})
+
+    _, response, tool_data = await handle_conversation_stream(user_input, state, send_frame)
+    await send_frame({"event": "done", "message": response})
+    logger.info(f"AI流式响应 - 内容长度: {len(response)}, 用户ID: {user_id}, 会话ID: {state['session_id']}")
+
 async def handle_websocket(websocket, path):
-        global user_id
+        user_id = None
         state = None
         print("WebSocket连接已建立，等待用户数据...")
         def choose_consultation_type(type_value):
@@ -312,22 +443,23 @@ async def handle_websocket(websocket, path):
                     if state is None:
                         system_prompt = get_system_prompt(json_data)
                         system_message = SystemMessage(content=dedent(system_prompt))
-                        state = initialize_state(system_message, user_id)
+                        state = await initialize_state(system_message, user_id)
+                        session_manager.create(state)
+                    state, session = await ensure_session(state)
 
-                    psy_pred, exp_pred = await asyncio.gather(
-                        run_psy_predict(user_id, user_input),
-                        run_memory_read(user_id, user_input)
-                    )
+                    # 持有会话锁直到本轮结束：同一会话的轮次按顺序处理，且轮次进行中不会被 sweep 回收
+                    async with session.lock:
+                        if requested_protocol_version(json_data) >= STREAM_PROTOCOL_VERSION:
+                            await handle_stream_turn(websocket, user_id, user_input, state)
+                            continue
 
-                    state, response, tool_data = await run_handle_conversation(user_input, state)
+                        memory_data = await enqueue_memory_extraction(user_id, user_input)
+                        state, response, tool_data = await run_handle_conversation(user_input, state)
 
                     response_data = {
                         "message": response,
                         "tool_data": tool_data,
-                        "memory_data": {
-                            "implicit_memory": psy_pred,
-                            "explicit_memory": exp_pred
-                        }
+                        "memory_data": memory_data
                     }
 
                     await websocket.send(json.dumps(response_data, cls=JSONEncoder))
@@ -350,20 +482,37 @@ async def handle_websocket(websocket, path):
             import traceback
             print(traceback.format_exc())
         finally:
+            if state is not None:
+                session_manager.close(state["session_id"])
             print(f"WebSocket connection closed for user: {user_id}")
             logger.info(f"WebSocket连接已关闭 - 用户ID: {user_id}")
 
+async def serve_metrics(path, request_headers):
+    """在 WebSocket 端口上以普通 HTTP GET /metrics 返回记忆抽取队列、会话、记忆缓存、记忆写入、患者档案、知识图谱快照与本地抽取和 MongoDB 连接池指标"""
+    if path.split("?")[0].rstrip("/") != "/metrics":
+        return None
+    body = json.dumps({
+        "memory_extraction_queue": await memory_extraction_queue.metrics(),
+        "sessions": session_manager.metrics(),
+        "memory_cache": memory_cache_stats(),
+        "memory_writes": memory_write_stats(),
+        "semantic_memory_index": get_semantic_index().stats(),
+        "patient_context": get_context_pack_store().stats(),
+        "knowledge_graph": retrieve.get_graph_qa().stats(),
+        "mongodb_pools": mongo_pool_stats()
+    }, ensure_ascii=False, indent=2).encode("utf-8")
+    return HTTPStatus.OK, [("Content-Type", "application/json; charset=utf-8")], body
+
 async def start_websocket_server():
-    print("Starting WebSocket server on ws://localhost:8763")
+    print(f"Starting WebSocket server on ws://localhost:{WEB_SOCKET_PORT}")
     try:
-        server = await websockets.serve(handle_websocket, "0.0.0.0", 8763)
-        print("WebSocket server started on ws://localhost:8765")
+        server = await websockets.serve(handle_websocket, "0.0.0.0", WEB_SOCKET_PORT, process_request=serve_metrics)
+        print(f"WebSocket server started on ws://localhost:{WEB_SOCKET_PORT}")
         await server.wait_closed()
     except Exception as e:
         print(f"Error starting WebSocket server: {str(e)}")
 
 async def handle_console_interaction():
-    global user_id
     print("\n\n请输入您的用户名或I1D: ")
     user_id = await asyncio.get_event_loop().run_in_executor(None, input)
 
@@ -376,7 +525,8 @@ async def handle_console_interaction():
         system_prompt = main_system.main_prompt()
 
     system_message = SystemMessage(content=dedent(system_prompt))
-    state = initialize_state(system_message, user_id)
+    state = await initialize_state(system_message, user_id)
+    session_manager.create(state)
 
     logger.info(f"新对话开始 - 用户ID: {user_id}, 会话ID: {state['session_id']}")
 
@@ -388,16 +538,15 @@ async def handle_console_interaction():
         if user_input.lower() == "\\exit" or user_input == "\\结束":
             logger.info(f"对话结束 - 用户ID: {user_id}, 会话ID: {state['session_id']}")
             print(f"再见👋 {user_id}, 期待我们的下次见面!🥳")
+            session_manager.close(state['session_id'])
             break
 
         logger.info(f"用户输入 - 内容: {user_input}, 用户ID: {user_id}, 会话ID: {state['session_id']}")
 
-        psy_pred, exp_pred = await asyncio.gather(
-            run_psy_predict(user_id, user_input),
-            run_memory_read(user_id, user_input)
-        )
-
-        state, response, tool_data = await run_handle_conversation(user_input, state)
+        state, session = await ensure_session(state)
+        async with session.lock:
+            memory_data = await enqueue_memory_extraction(user_id, user_input)
+            state, response, tool_data = await run_handle_conversation(user_input, state)
         print("\nEi: ", response)
 
         if tool_data:
@@ -407,8 +556,7 @@ async def handle_console_interaction():
             print(f"工具输出: {tool_data['tool_output']}")
 
         print("\n记忆数据:")
-        print(f"隐式记忆: {psy_pred}")
-        print(f"显式记忆: {exp_pred}")
+        print(f"记忆抽取入队: {memory_data}")
 
         logger.info(f"AI响应 - 内容长度: {len(response)}, 用户ID: {user_id}, 会话ID: {state['session_id']}")
         print("——————————————————————————————————————————————>")
@@ -427,7 +575,13 @@ async def main_loop():
         print("程序开始2")
         websocket_server = asyncio.create_task(start_websocket_server())
         console_interaction = asyncio.create_task(handle_console_interaction())
-        await asyncio.gather(websocket_server,console_interaction)
+        session_sweeper = asyncio.create_task(session_manager.run_sweeper())
+        memory_extraction_queue.start()
+        # 启动时创建常驻的知识图谱服务，驱动连接池在后台预热
+        retrieve.get_graph_qa()
+        if MEMORY_CACHE_CHANGE_STREAM and MEMORY_STORE_LAYOUT == "collection":
+            start_change_stream_invalidation()
+        await asyncio.gather(websocket_server,console_interaction,session_sweeper)
     except Exception as e:
         print(f"主循环错误: {str(e)}")
         # logger.error(f"主循环错误: {str(e)}")
@@ -480,6 +634,12 @@ if __name__ == "__main__":
     # except Exception as e:
     #     print(f"Error starting WebSocket server: {str(e)}")
     #     logger.error(f"Error starting WebSocket server: {str(e)}")
-       # asyncio.run(main_loop())
-        # asyncio.run(processor_main())
+    import argparse
+    parser = argparse.ArgumentParser(description="心理咨询服务")
+    parser.add_argument("--mode", choices=["http", "websocket"], default="http",
+                        help="http: 启动诊断接口; websocket: 启动异步对话服务（WebSocket + 控制台）")
+    args = parser.parse_args()
+    if args.mode == "websocket":
+        asyncio.run(main_loop())
+    else:
         app.run(debug=False, host='0.0.0.0', port=8763)
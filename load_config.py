@@ -70,6 +70,114 @@ except (KeyError, ValueError) as e:
     logging.warning(f"WebSocket端口配置缺失或无效: {e}")
     WEB_SOCKET_PORT = 8763
 
+# 记忆存储配置（LAYOUT: collection 所有用户共用一个集合 / per_user 旧的每用户一个数据库）
+MEMORY_STORE_LAYOUT = config.get('MEMORY_STORE', 'LAYOUT', fallback='collection')
+MEMORY_STORE_DB_NAME = config.get('MEMORY_STORE', 'DB_NAME', fallback='memory_store')
+MEMORY_STORE_COLLECTION = config.get('MEMORY_STORE', 'COLLECTION', fallback='memories')
+
+# 用户最新记忆缓存配置（CHANGE_STREAM: 监听记忆集合变更，使其他进程的写入在本进程失效）
+MEMORY_CACHE_ENABLED = config.getboolean('MEMORY_CACHE', 'ENABLED', fallback=True)
+MEMORY_CACHE_MAX_ENTRIES = config.getint('MEMORY_CACHE', 'MAX_ENTRIES', fallback=20000)
+MEMORY_CACHE_TTL_SECONDS = config.getfloat('MEMORY_CACHE', 'TTL_SECONDS', fallback=300)
+MEMORY_CACHE_CHANGE_STREAM = config.getboolean('MEMORY_CACHE', 'CHANGE_STREAM', fallback=False)
+
+# 记忆更新定位配置（内容哈希未命中时按嵌入相似度匹配 knowledge_old）
+MEMORY_UPDATE_EMBEDDING_FALLBACK = config.getboolean('MEMORY_UPDATE', 'EMBEDDING_FALLBACK', fallback=True)
+MEMORY_UPDATE_MATCH_THRESHOLD = config.getfloat('MEMORY_UPDATE', 'MATCH_THRESHOLD', fallback=0.85)
+
+# 记忆批量写入配置（TRANSACTION: 整批写入在事务中执行，需要 MongoDB 副本集）
+MEMORY_WRITE_TRANSACTION = config.getboolean('MEMORY_WRITE', 'TRANSACTION', fallback=False)
+
+# 记忆检索配置（MODE: all 返回所选类别的全部最新记忆 / semantic 按当前用户输入取最相关的 top-k 条）
+MEMORY_RETRIEVAL_MODE = config.get('MEMORY_RETRIEVAL', 'MODE', fallback='all')
+MEMORY_RETRIEVAL_TOP_K = config.getint('MEMORY_RETRIEVAL', 'TOP_K', fallback=8)
+MEMORY_RETRIEVAL_TOKEN_BUDGET = config.getint('MEMORY_RETRIEVAL', 'TOKEN_BUDGET', fallback=600)
+MEMORY_EMBED_ON_WRITE = config.getboolean('MEMORY_RETRIEVAL', 'EMBED_ON_WRITE', fallback=True)
+MEMORY_INDEX_MAX_USERS = config.getint('MEMORY_RETRIEVAL', 'INDEX_MAX_USERS', fallback=1000)
+MEMORY_INDEX_TTL_SECONDS = config.getfloat('MEMORY_RETRIEVAL', 'INDEX_TTL_SECONDS', fallback=600)
+
+# 记忆压缩任务配置（合并近似重复记忆、归档旧版本、把过旧或低置信度的记忆汇总为摘要）
+MEMORY_ARCHIVE_COLLECTION = config.get('MEMORY_COMPACTION', 'ARCHIVE_COLLECTION', fallback='memories_archive')
+MEMORY_COMPACTION_ARCHIVE_AFTER_DAYS = config.getint('MEMORY_COMPACTION', 'ARCHIVE_AFTER_DAYS', fallback=30)
+MEMORY_COMPACTION_DEDUP_THRESHOLD = config.getfloat('MEMORY_COMPACTION', 'DEDUP_THRESHOLD', fallback=0.95)
+MEMORY_COMPACTION_LOW_CONFIDENCE = config.getfloat('MEMORY_COMPACTION', 'LOW_CONFIDENCE', fallback=0.5)
+MEMORY_COMPACTION_SUMMARY_AFTER_DAYS = config.getint('MEMORY_COMPACTION', 'SUMMARY_AFTER_DAYS', fallback=180)
+MEMORY_COMPACTION_MIN_SUMMARY_ITEMS = config.getint('MEMORY_COMPACTION', 'MIN_SUMMARY_ITEMS', fallback=3)
+
+# 患者档案（context pack）配置：按用户物化最新记忆，会话开始时以限定 token 数的片段写入系统提示
+PATIENT_CONTEXT_ENABLED = config.getboolean('PATIENT_CONTEXT', 'ENABLED', fallback=True)
+PATIENT_CONTEXT_COLLECTION = config.get('PATIENT_CONTEXT', 'COLLECTION', fallback='patient_context_packs')
+PATIENT_CONTEXT_TOKEN_BUDGET = config.getint('PATIENT_CONTEXT', 'TOKEN_BUDGET', fallback=500)
+PATIENT_CONTEXT_MIN_CONFIDENCE = config.getfloat('PATIENT_CONTEXT', 'MIN_CONFIDENCE', fallback=0.5)
+PATIENT_CONTEXT_MAX_PER_CATEGORY = config.getint('PATIENT_CONTEXT', 'MAX_PER_CATEGORY', fallback=5)
+
+# Neo4j 驱动连接池配置（GraphQA 在进程内常驻，所有知识图谱检索共用一个驱动）
+NEO4J_DATABASE = config.get('NEO4J_POOL', 'DATABASE', fallback=None) or None
+NEO4J_MAX_POOL_SIZE = config.getint('NEO4J_POOL', 'MAX_POOL_SIZE', fallback=50)
+NEO4J_ACQUISITION_TIMEOUT = config.getfloat('NEO4J_POOL', 'ACQUISITION_TIMEOUT', fallback=10.0)
+NEO4J_MAX_CONNECTION_LIFETIME = config.getfloat('NEO4J_POOL', 'MAX_CONNECTION_LIFETIME', fallback=3600)
+NEO4J_POOL_PREWARM = config.getboolean('NEO4J_POOL', 'PREWARM', fallback=True)
+NEO4J_RESULT_LIMIT = config.getint('NEO4J_POOL', 'RESULT_LIMIT', fallback=10)
+
+# 知识图谱内存快照配置（图版本变化时重新加载，快照无法回答的查询回退到 Neo4j）
+KG_SNAPSHOT_ENABLED = config.getboolean('KG_SNAPSHOT', 'ENABLED', fallback=True)
+KG_SNAPSHOT_REFRESH_INTERVAL = config.getfloat('KG_SNAPSHOT', 'REFRESH_INTERVAL', fallback=60)
+KG_SNAPSHOT_MAX_NODES = config.getint('KG_SNAPSHOT', 'MAX_NODES', fallback=1000000)
+
+# 知识图谱检索本地抽取配置（基于快照的节点名称词典匹配，明确时跳过 LLM 抽取查询元素）
+KG_FAST_PATH_ENABLED = config.getboolean('KG_FAST_PATH', 'ENABLED', fallback=True)
+KG_FAST_PATH_MIN_NAME_LENGTH = config.getint('KG_FAST_PATH', 'MIN_NAME_LENGTH', fallback=2)
+KG_FAST_PATH_MAX_NAME_LENGTH = config.getint('KG_FAST_PATH', 'MAX_NAME_LENGTH', fallback=32)
+KG_FAST_PATH_MAX_QUERY_ELEMENTS = config.getint('KG_FAST_PATH', 'MAX_QUERY_ELEMENTS', fallback=4)
+
+# 知识图谱批量写入配置（实体按稳定 id MERGE，每条 UNWIND 语句最多 BATCH_SIZE 行）
+KG_INGEST_BATCH_SIZE = config.getint('KG_INGEST', 'BATCH_SIZE', fallback=1000)
+
+# 知识图谱构建配置（长文档切块并行抽取，按内容哈希清单增量跳过未变化的文件）
+KG_BUILD_ROOT = config.get('KG_BUILD', 'ROOT', fallback='./data/raw_knowledge')
+KG_BUILD_MANIFEST = config.get('KG_BUILD', 'MANIFEST', fallback='./data/kg_build_manifest.json')
+KG_BUILD_WORKERS = config.getint('KG_BUILD', 'WORKERS', fallback=8)
+KG_BUILD_CHUNK_SIZE = config.getint('KG_BUILD', 'CHUNK_SIZE', fallback=2000)
+KG_BUILD_CHUNK_OVERLAP = config.getint('KG_BUILD', 'CHUNK_OVERLAP', fallback=200)
+KG_BUILD_MAX_RETRIES = config.getint('KG_BUILD', 'MAX_RETRIES', fallback=3)
+KG_BUILD_BASE_BACKOFF = config.getfloat('KG_BUILD', 'BASE_BACKOFF', fallback=1.0)
+
+# MongoDB 连接池配置（进程内按 URI 共享客户端）
+MONGODB_MAX_POOL_SIZE = config.getint('MONGODB_POOL', 'MAX_POOL_SIZE', fallback=100)
+MONGODB_MIN_POOL_SIZE = config.getint('MONGODB_POOL', 'MIN_POOL_SIZE', fallback=5)
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = config.getint('MONGODB_POOL', 'WAIT_QUEUE_TIMEOUT_MS', fallback=5000)
+MONGODB_POOL_PREWARM = config.getboolean('MONGODB_POOL', 'PREWARM', fallback=True)
+
+# 嵌入缓存配置
+EMBEDDING_CACHE_ENABLED = config.getboolean('EMBEDDING_CACHE', 'ENABLED', fallback=True)
+EMBEDDING_CACHE_PATH = config.get('EMBEDDING_CACHE', 'PATH', fallback='./database/embedding_cache.sqlite')
+EMBEDDING_CACHE_MEMORY_SIZE = config.getint('EMBEDDING_CACHE', 'MEMORY_SIZE', fallback=10000)
+
+# 向量化并发写入配置
+EMBEDDING_INGEST_CONCURRENCY = config.getint('EMBEDDING_INGEST', 'CONCURRENCY', fallback=8)
+EMBEDDING_INGEST_REQUESTS_PER_MINUTE = config.getfloat('EMBEDDING_INGEST', 'REQUESTS_PER_MINUTE', fallback=3000)
+EMBEDDING_INGEST_TOKENS_PER_MINUTE = config.getfloat('EMBEDDING_INGEST', 'TOKENS_PER_MINUTE', fallback=1000000)
+EMBEDDING_INGEST_MAX_BATCH_SIZE = config.getint('EMBEDDING_INGEST', 'MAX_BATCH_SIZE', fallback=512)
+
+# 会话管理配置
+SESSION_TTL_SECONDS = config.getint('SESSION', 'TTL_SECONDS', fallback=1800)
+SESSION_MAX_SESSIONS = config.getint('SESSION', 'MAX_SESSIONS', fallback=1000)
+SESSION_MAX_BYTES = config.getint('SESSION', 'MAX_BYTES', fallback=512 * 1024 * 1024)
+SESSION_MAX_MEMORY_ENTRIES = config.getint('SESSION', 'MAX_MEMORY_ENTRIES', fallback=200)
+SESSION_SWEEP_INTERVAL = config.getint('SESSION', 'SWEEP_INTERVAL', fallback=60)
+
+# 后台记忆抽取队列配置（BACKEND: memory 进程内队列 / mongodb 持久化队列）
+MEMORY_QUEUE_BACKEND = config.get('MEMORY_QUEUE', 'BACKEND', fallback='memory')
+MEMORY_QUEUE_COLLECTION = config.get('MEMORY_QUEUE', 'COLLECTION', fallback='memory_extraction_queue')
+MEMORY_QUEUE_WORKERS = config.getint('MEMORY_QUEUE', 'WORKERS', fallback=2)
+MEMORY_QUEUE_MAX_BATCH = config.getint('MEMORY_QUEUE', 'MAX_BATCH', fallback=8)
+MEMORY_QUEUE_BATCH_WINDOW = config.getfloat('MEMORY_QUEUE', 'BATCH_WINDOW', fallback=2.0)
+MEMORY_QUEUE_MAX_ATTEMPTS = config.getint('MEMORY_QUEUE', 'MAX_ATTEMPTS', fallback=3)
+# MongoDB 队列后端的认领租约：超过该时长仍未确认的任务视为持有进程已退出，重新排队（需大于单批抽取的最长耗时）
+MEMORY_QUEUE_LEASE_SECONDS = config.getfloat('MEMORY_QUEUE', 'LEASE_SECONDS', fallback=300)
+# EXTRACTOR: unified 单次调用分类器 / sentinel 显式、隐式各自的 sentinel + knowledge master
+MEMORY_QUEUE_EXTRACTOR = config.get('MEMORY_QUEUE', 'EXTRACTOR', fallback='unified')
+
 # 其他可能需要的配置
 try:
     # 阿里云配置
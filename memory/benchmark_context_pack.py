@@ -0,0 +1,123 @@
+"""
+患者档案离线基准测试：会话开始时注入档案 vs 只靠 memory_retrieve 工具
+
+对指定用户（默认取记忆库中的前若干个用户）分别以两种方式建立会话，逐条发送同一组问题，
+走与线上相同的 handle_conversation 流程，统计：
+    - memory_retrieve 工具调用率、任意工具调用率
+    - 每轮延迟（p50/p95/平均，包含工具调用和工具结果之后的再次生成）
+    - 系统提示的估计 token 数
+需要可用的模型 API 和记忆库；问题可通过 --questions-file（每行一个问题）替换。
+
+用法:
+    python memory/benchmark_context_pack.py --num-users 20 --output context_pack_bench.json
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from textwrap import dedent
+from typing import Dict, List
+
+from langchain_core.messages import SystemMessage
+
+import app
+from prompts import main_system
+from utils.token_estimate import estimate_tokens
+from utils.mongodb_patient_info_system import get_patient_info_system
+
+DEFAULT_QUESTIONS = [
+    "我最近又开始睡不好了。",
+    "你还记得我之前说的工作压力吗？现在好像更严重了。",
+    "我之前吃的药是不是会让人犯困？",
+    "今天心情还可以，想和你聊聊。",
+    "你觉得按我的情况应该怎么调整作息？",
+    "我家里人最近也不太理解我。",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def run_user(user_id: str, questions: List[str], context_pack: bool) -> Dict:
+    state = await app.initialize_state(SystemMessage(content=dedent(main_system.main_prompt())), user_id, context_pack=context_pack)
+    app.session_manager.create(state)
+    turns = []
+    try:
+        for question in questions:
+            start = time.perf_counter()
+            state, _, tool_data = await app.handle_conversation(question, state)
+            turns.append({
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "tool": tool_data["tool_name"] if tool_data else None,
+            })
+    finally:
+        app.session_manager.close(state["session_id"])
+    return {"system_prompt_tokens": estimate_tokens(state["messages"][0].content), "turns": turns}
+
+
+def summarize(mode: str, results: List[Dict]) -> Dict:
+    turns = [turn for result in results for turn in result["turns"]]
+    latencies = [turn["latency_ms"] for turn in turns]
+    return {
+        "mode": mode,
+        "users": len(results),
+        "turns": len(turns),
+        "memory_tool_rate": sum(turn["tool"] == "memory_retrieve" for turn in turns) / len(turns) if turns else 0.0,
+        "any_tool_rate": sum(turn["tool"] is not None for turn in turns) / len(turns) if turns else 0.0,
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p95_ms": percentile(latencies, 0.95),
+        "latency_mean_ms": statistics.mean(latencies) if latencies else 0.0,
+        "system_prompt_tokens": statistics.mean(r["system_prompt_tokens"] for r in results) if results else 0.0,
+    }
+
+
+async def bench(users: List[str], questions: List[str]) -> List[Dict]:
+    summaries = []
+    for mode, context_pack in (("memory_tool", False), ("context_pack", True)):
+        results = [await run_user(user_id, questions, context_pack) for user_id in users]
+        summary = summarize(mode, results)
+        summaries.append(summary)
+        print(json.dumps(summary, ensure_ascii=False))
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="患者档案注入基准测试")
+    parser.add_argument("--users", nargs="+", default=None, help="参与测试的用户（默认从单集合记忆库中选取）")
+    parser.add_argument("--num-users", type=int, default=10, help="未指定 --users 时选取的用户数")
+    parser.add_argument("--questions-file", default=None, help="问题文件，每行一个问题")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    args = parser.parse_args()
+
+    users = args.users
+    if not users:
+        db_system = get_patient_info_system()
+        users = sorted(db_system.collection.distinct("user_id"))[:args.num_users]
+    questions = DEFAULT_QUESTIONS
+    if args.questions_file:
+        with open(args.questions_file, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    summaries = asyncio.run(bench(users, questions))
+
+    print(f"\n{'方式':<14}{'记忆工具调用率':>14}{'工具调用率':>12}{'p50 ms':>10}{'p95 ms':>10}{'系统提示 tokens':>16}")
+    for s in summaries:
+        print(f"{s['mode']:<14}{s['memory_tool_rate']:>14.1%}{s['any_tool_rate']:>12.1%}{s['latency_p50_ms']:>10.0f}"
+              f"{s['latency_p95_ms']:>10.0f}{s['system_prompt_tokens']:>16.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+knowledge master 提示词基准测试：全部类别 JSON vs 当前类别紧凑渲染
+
+对每个用户、每个有记忆的类别，分别用两种方式构造 knowledge master 的“已有记忆”：
+    - all_categories_json：该记忆类型全部类别的记忆，JSON 序列化（原方式）
+    - category_compact：只取 sentinel 判定的类别，每行 [记忆ID] 时间 内容
+统计完整提示词的估计 token 数；指定 --invoke 时实际调用 knowledge master，记录延迟和模型返回的输入 token 数。
+
+用法:
+    python memory/benchmark_knowledge_master_prompt.py --num-users 20
+    python memory/benchmark_knowledge_master_prompt.py --users test --invoke --output km_prompt_bench.json
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import argparse
+import statistics
+from typing import Dict, List
+
+from langchain_core.messages import HumanMessage
+
+from memory.memory_retrieve import MemoryRetrievalSystem
+from utils.token_estimate import estimate_tokens
+from memory.unified_memory_system import BaseMemorySystem, MemoryType, get_category_enum
+
+DEFAULT_MESSAGE = "我最近换了工作，睡眠比以前更差了，医生让我把舍曲林加到了 100mg。"
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def build_variants(retrieval: MemoryRetrievalSystem, user_id: str, memory_type: MemoryType) -> Dict[str, Dict[str, str]]:
+    """返回 {类别: {方式: 已有记忆文本}}，只包含该用户有记忆的类别"""
+    categories = list(get_category_enum(memory_type)._value2member_map_.keys())
+    all_memories = retrieval.retrieve_memories_by_categories(user_id, categories)
+    all_json = json.dumps(all_memories, ensure_ascii=False, default=str)
+    return {
+        category: {
+            "all_categories_json": all_json,
+            "category_compact": retrieval.format_memories_compact({category: memories}),
+        }
+        for category, memories in all_memories.items()
+    }
+
+
+def prompt_tokens(runnable, messages, memories: str) -> int:
+    prompt = runnable.first.format_messages(messages=messages, memories=memories)
+    return sum(estimate_tokens(message.content) for message in prompt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="knowledge master 提示词大小和延迟对比")
+    parser.add_argument("--users", nargs="+", default=None, help="参与测试的用户（默认从单集合记忆库中选取）")
+    parser.add_argument("--num-users", type=int, default=10, help="未指定 --users 时选取的用户数")
+    parser.add_argument("--message", default=DEFAULT_MESSAGE, help="送入 knowledge master 的用户消息")
+    parser.add_argument("--invoke", action="store_true", help="实际调用模型测量延迟（会产生 API 费用）")
+    parser.add_argument("--max-cases", type=int, default=50, help="--invoke 时最多调用的 (用户, 类别) 组合数")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    args = parser.parse_args()
+
+    retrieval = MemoryRetrievalSystem()
+    users = args.users or sorted(retrieval.db_system.collection.distinct("user_id"))[:args.num_users]
+    systems = {memory_type: BaseMemorySystem(memory_type) for memory_type in MemoryType}
+    messages = [HumanMessage(content=args.message)]
+
+    cases = []
+    for user_id in users:
+        for memory_type, system in systems.items():
+            for category, variants in build_variants(retrieval, user_id, memory_type).items():
+                runnable = system._knowledge_master_runnable(category)
+                case = {"user_id": user_id, "category": category}
+                for mode, memories in variants.items():
+                    case[mode] = {"prompt_tokens": prompt_tokens(runnable, messages, memories)}
+                    if args.invoke and len(cases) < args.max_cases:
+                        start = time.perf_counter()
+                        response = runnable.invoke({"messages": messages, "memories": memories})
+                        case[mode]["latency_ms"] = (time.perf_counter() - start) * 1000
+                        usage = getattr(response, "usage_metadata", None) or {}
+                        case[mode]["api_input_tokens"] = usage.get("input_tokens")
+                cases.append(case)
+
+    summary = {"cases": len(cases)}
+    for mode in ("all_categories_json", "category_compact"):
+        tokens = [case[mode]["prompt_tokens"] for case in cases]
+        latencies = [case[mode]["latency_ms"] for case in cases if "latency_ms" in case[mode]]
+        summary[mode] = {
+            "prompt_tokens_mean": statistics.mean(tokens) if tokens else 0.0,
+            "prompt_tokens_p95": percentile(tokens, 0.95),
+            "latency_p50_ms": percentile(latencies, 0.5),
+            "latency_p95_ms": percentile(latencies, 0.95),
+        }
+
+    print(f"{'方式':<22}{'平均 tokens':>12}{'p95 tokens':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for mode in ("all_categories_json", "category_compact"):
+        s = summary[mode]
+        print(f"{mode:<22}{s['prompt_tokens_mean']:>12.0f}{s['prompt_tokens_p95']:>12.0f}"
+              f"{s['latency_p50_ms']:>10.0f}{s['latency_p95_ms']:>10.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "cases": cases}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
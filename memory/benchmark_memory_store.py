@@ -0,0 +1,194 @@
+"""
+记忆存储布局基准测试：单集合多租户 vs 每用户一个数据库
+
+为合成用户写入记忆（每个用户若干类别、每个类别若干条），然后统计：
+    - 写入吞吐（docs/s）
+    - 多类别最新记忆读取延迟（p50/p95）
+    - 集合数、索引数以及数据/索引占用
+
+单集合布局在所有用户规模下都会测试；旧布局每个用户会创建一个数据库和多个集合，
+用户数较大时很容易耗尽 MongoDB 的文件句柄，因此通过 --max-legacy-users 限制其规模。
+
+用法:
+    python memory/benchmark_memory_store.py --users 10000 100000 --drop
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime
+from typing import Dict, List
+
+from memory.unified_memory_system import ExplicitCategory, ImplicitCategory
+from utils.mongo_pool import get_mongo_client
+from utils.mongodb_patient_info_system import MongoDBPatientInfoSystem, PerUserPatientInfoSystem, TIMESTAMP_FORMAT
+
+BENCH_DB_NAME = "memory_bench_store"
+BENCH_LEGACY_PREFIX = "memory_bench_"
+CATEGORIES = [c.value for c in ExplicitCategory] + [c.value for c in ImplicitCategory]
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def synthetic_memories(user_index: int, categories_per_user: int, memories_per_category: int):
+    rng = random.Random(user_index)
+    for category in rng.sample(CATEGORIES, categories_per_user):
+        for i in range(memories_per_category):
+            yield category, {"knowledge": f"{category} 合成记忆 {user_index}-{i}", "action": "创建", "confidence": rng.random()}
+
+
+def bench_shared(num_users: int, args) -> Dict:
+    client = get_mongo_client()
+    client.drop_database(BENCH_DB_NAME)
+    MongoDBPatientInfoSystem._indexed_collections.discard((BENCH_DB_NAME, "memories"))
+    store = MongoDBPatientInfoSystem(db_name=BENCH_DB_NAME, collection_name="memories")
+
+    start = time.perf_counter()
+    batch = []
+    inserted = 0
+    for user_index in range(num_users):
+        for category, memory in synthetic_memories(user_index, args.categories_per_user, args.memories_per_category):
+            batch.append({**memory, "user_id": f"user_{user_index}", "category": category, "is_latest": True,
+                          "timestamp": datetime.now()})
+            if len(batch) >= 5000:
+                store.collection.insert_many(batch, ordered=False)
+                inserted += len(batch)
+                batch = []
+    if batch:
+        store.collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    insert_seconds = time.perf_counter() - start
+
+    latencies = []
+    rng = random.Random(0)
+    for _ in range(args.queries):
+        user_id = f"user_{rng.randrange(num_users)}"
+        categories = rng.sample(CATEGORIES, args.query_categories)
+        start = time.perf_counter()
+        store.get_latest_memories(user_id, categories)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    stats = client[BENCH_DB_NAME].command("collStats", "memories")
+    return {
+        "layout": "collection",
+        "users": num_users,
+        "documents": inserted,
+        "insert_docs_per_sec": inserted / insert_seconds if insert_seconds else 0.0,
+        "fetch_p50_ms": percentile(latencies, 0.5),
+        "fetch_p95_ms": percentile(latencies, 0.95),
+        "fetch_mean_ms": statistics.mean(latencies) if latencies else 0.0,
+        "collections": 1,
+        "indexes": stats.get("nindexes", 0),
+        "data_bytes": stats.get("size", 0),
+        "index_bytes": stats.get("totalIndexSize", 0),
+    }
+
+
+def bench_per_user(num_users: int, args) -> Dict:
+    client = get_mongo_client()
+    drop_legacy_databases(client)
+    store = PerUserPatientInfoSystem(None)
+
+    start = time.perf_counter()
+    inserted = 0
+    for user_index in range(num_users):
+        user_id = f"{BENCH_LEGACY_PREFIX}{user_index}"
+        grouped = {}
+        for category, memory in synthetic_memories(user_index, args.categories_per_user, args.memories_per_category):
+            grouped.setdefault(category, []).append({**memory, "is_latest": True, "timestamp": datetime.now().strftime(TIMESTAMP_FORMAT)})
+        for category, docs in grouped.items():
+            store.get_category_collection(user_id, category).insert_many(docs, ordered=False)
+            inserted += len(docs)
+    insert_seconds = time.perf_counter() - start
+
+    latencies = []
+    rng = random.Random(0)
+    for _ in range(args.queries):
+        user_id = f"{BENCH_LEGACY_PREFIX}{rng.randrange(num_users)}"
+        categories = rng.sample(CATEGORIES, args.query_categories)
+        start = time.perf_counter()
+        store.get_latest_memories(user_id, categories)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    collections = indexes = data_bytes = index_bytes = 0
+    for user_index in range(num_users):
+        db = client[f"{BENCH_LEGACY_PREFIX}{user_index}"]
+        db_stats = db.command("dbStats")
+        collections += db_stats.get("collections", 0)
+        indexes += db_stats.get("indexes", 0)
+        data_bytes += db_stats.get("dataSize", 0)
+        index_bytes += db_stats.get("indexSize", 0)
+
+    return {
+        "layout": "per_user",
+        "users": num_users,
+        "documents": inserted,
+        "insert_docs_per_sec": inserted / insert_seconds if insert_seconds else 0.0,
+        "fetch_p50_ms": percentile(latencies, 0.5),
+        "fetch_p95_ms": percentile(latencies, 0.95),
+        "fetch_mean_ms": statistics.mean(latencies) if latencies else 0.0,
+        "collections": collections,
+        "indexes": indexes,
+        "data_bytes": data_bytes,
+        "index_bytes": index_bytes,
+    }
+
+
+def drop_legacy_databases(client):
+    for db_name in client.list_database_names():
+        if db_name.startswith(BENCH_LEGACY_PREFIX) and db_name != BENCH_DB_NAME:
+            client.drop_database(db_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆存储布局基准测试")
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000], help="合成用户数（可多个）")
+    parser.add_argument("--categories-per-user", type=int, default=4)
+    parser.add_argument("--memories-per-category", type=int, default=3)
+    parser.add_argument("--query-categories", type=int, default=4, help="每次读取的类别数")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--max-legacy-users", type=int, default=2000, help="旧布局最多测试的用户数（0 表示跳过）")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    parser.add_argument("--drop", action="store_true", help="结束后删除基准测试数据库")
+    args = parser.parse_args()
+
+    results = []
+    for num_users in args.users:
+        result = bench_shared(num_users, args)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+        if args.max_legacy_users:
+            legacy_users = min(num_users, args.max_legacy_users)
+            result = bench_per_user(legacy_users, args)
+            result["requested_users"] = num_users
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False))
+
+    print(f"\n{'布局':<12}{'用户数':>10}{'写入 docs/s':>14}{'p50 ms':>10}{'p95 ms':>10}{'集合':>10}{'索引':>10}{'索引 MB':>10}")
+    for r in results:
+        print(f"{r['layout']:<12}{r['users']:>10}{r['insert_docs_per_sec']:>14.0f}{r['fetch_p50_ms']:>10.2f}"
+              f"{r['fetch_p95_ms']:>10.2f}{r['collections']:>10}{r['indexes']:>10}{r['index_bytes'] / 1e6:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.drop:
+        client = get_mongo_client()
+        client.drop_database(BENCH_DB_NAME)
+        drop_legacy_databases(client)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+记忆更新定位基准测试：线性扫描 vs 内容哈希索引查询
+
+为一个合成用户的某个类别写入不同数量的记忆，分别测量：
+    - 原方式：get_memories 取回该类别全部记忆，在 Python 中逐条比较 knowledge
+    - 新方式：find_latest_by_knowledge 按 knowledge_hash 一次索引查询
+预期新方式的延迟不随记忆数量增长。
+
+用法:
+    python memory/benchmark_memory_update.py --sizes 10 100 1000 10000 --drop
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+from typing import Dict, List
+
+from utils.mongo_pool import get_mongo_client
+from utils.mongodb_patient_info_system import MongoDBPatientInfoSystem, knowledge_hash
+
+BENCH_DB_NAME = "memory_bench_update"
+BENCH_USER = "bench_user"
+BENCH_CATEGORY = "主诉"
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def linear_scan(store: MongoDBPatientInfoSystem, knowledge_old: str):
+    for memory in store.get_memories(BENCH_USER, BENCH_CATEGORY):
+        if memory['knowledge'] == knowledge_old:
+            return memory
+    return None
+
+
+def bench_size(store: MongoDBPatientInfoSystem, size: int, lookups: int) -> Dict:
+    store.collection.delete_many({"user_id": BENCH_USER})
+    docs = []
+    for i in range(size):
+        knowledge = f"合成记忆 {i}：患者自述症状描述 {i}"
+        docs.append({
+            "user_id": BENCH_USER,
+            "category": BENCH_CATEGORY,
+            "knowledge": knowledge,
+            "knowledge_hash": knowledge_hash(knowledge),
+            "action": "创建",
+            "is_latest": True,
+            "timestamp": datetime.now(),
+        })
+    for start in range(0, len(docs), 5000):
+        store.collection.insert_many(docs[start:start + 5000], ordered=False)
+
+    rng = random.Random(size)
+    targets = [docs[rng.randrange(size)]["knowledge"] for _ in range(lookups)]
+
+    results = {"memories": size}
+    for name, lookup in (
+        ("linear_scan", lambda knowledge: linear_scan(store, knowledge)),
+        ("hash_index", lambda knowledge: store.find_latest_by_knowledge(BENCH_USER, BENCH_CATEGORY, knowledge)),
+    ):
+        latencies = []
+        for knowledge in targets:
+            start = time.perf_counter()
+            found = lookup(knowledge)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert found is not None and found["knowledge"] == knowledge
+        results[name] = {"p50_ms": percentile(latencies, 0.5), "p95_ms": percentile(latencies, 0.95)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆更新定位基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="该类别下的记忆条数")
+    parser.add_argument("--lookups", type=int, default=200, help="每个规模下的查找次数")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    parser.add_argument("--drop", action="store_true", help="结束后删除基准测试数据库")
+    args = parser.parse_args()
+
+    client = get_mongo_client()
+    client.drop_database(BENCH_DB_NAME)
+    MongoDBPatientInfoSystem._indexed_collections.discard((BENCH_DB_NAME, "memories"))
+    store = MongoDBPatientInfoSystem(db_name=BENCH_DB_NAME, collection_name="memories")
+
+    results = [bench_size(store, size, args.lookups) for size in args.sizes]
+
+    print(f"{'记忆条数':>10}{'扫描 p50':>12}{'扫描 p95':>12}{'哈希 p50':>12}{'哈希 p95':>12}")
+    for r in results:
+        print(f"{r['memories']:>10}{r['linear_scan']['p50_ms']:>12.2f}{r['linear_scan']['p95_ms']:>12.2f}"
+              f"{r['hash_index']['p50_ms']:>12.2f}{r['hash_index']['p95_ms']:>12.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.drop:
+        client.drop_database(BENCH_DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+记忆压缩任务：限制每个用户记忆的存储量和写入提示词的长度
+
+对单集合记忆存储中的每个用户依次执行：
+    1. 合并近似重复：同一类别的最新记忆按嵌入余弦相似度（>= DEDUP_THRESHOLD）分组，
+       保留每组最新的一条，其余标记为非最新并记录 merged_into
+    2. 汇总摘要：同一类别中置信度低于 LOW_CONFIDENCE 或早于 SUMMARY_AFTER_DAYS 天的最新记忆
+       达到 MIN_SUMMARY_ITEMS 条时，由 LLM 合并为一条摘要记忆（summary_of 记录来源），原记忆标记 summarized_into
+    3. 归档旧版本：早于 ARCHIVE_AFTER_DAYS 天的非最新版本移入冷集合（不保存向量），
+       历史版本查询可通过 include_archived 一并返回
+每个用户压缩前后统计热集合占用字节数和最新记忆写入提示词的估计 token 数，输出回收量报告。
+
+旧的每用户一个数据库的布局不支持压缩，请先运行 memory/migrate_memory_store.py 迁移。
+
+用法:
+    python memory/compact_memory_store.py --dry-run
+    python memory/compact_memory_store.py --users user_a user_b --output compaction_report.json
+    python memory/compact_memory_store.py --loop-interval 86400
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+from langchain_openai import ChatOpenAI
+
+from prompts.memory_prompt import memory_summary_prompt
+from memory.memory_matcher import get_memory_embeddings
+from memory.memory_retrieve import MemoryRetrievalSystem
+from utils.token_estimate import estimate_tokens
+from memory.semantic_memory_index import embed_memory_writes, normalize_vectors
+from memory.patient_context_pack import get_context_pack_store
+from utils.memory_cache import invalidate_memory_cache
+from utils.mongodb_patient_info_system import MemoryWrite, MongoDBPatientInfoSystem, format_timestamp
+from load_config import (
+    API_KEY,
+    CHAT_MODEL,
+    MEMORY_STORE_LAYOUT,
+    MEMORY_COMPACTION_ARCHIVE_AFTER_DAYS,
+    MEMORY_COMPACTION_DEDUP_THRESHOLD,
+    MEMORY_COMPACTION_LOW_CONFIDENCE,
+    MEMORY_COMPACTION_SUMMARY_AFTER_DAYS,
+    MEMORY_COMPACTION_MIN_SUMMARY_ITEMS
+)
+
+
+class MemoryCompactor:
+    def __init__(
+        self,
+        store: MongoDBPatientInfoSystem,
+        dry_run: bool = False,
+        summarize: bool = True,
+        dedup_threshold: float = MEMORY_COMPACTION_DEDUP_THRESHOLD,
+        low_confidence: float = MEMORY_COMPACTION_LOW_CONFIDENCE,
+        summary_after_days: int = MEMORY_COMPACTION_SUMMARY_AFTER_DAYS,
+        archive_after_days: int = MEMORY_COMPACTION_ARCHIVE_AFTER_DAYS,
+        min_summary_items: int = MEMORY_COMPACTION_MIN_SUMMARY_ITEMS,
+        batch_size: int = 500
+    ):
+        self.store = store
+        self.dry_run = dry_run
+        self.summarize = summarize
+        self.dedup_threshold = dedup_threshold
+        self.low_confidence = low_confidence
+        self.summary_after_days = summary_after_days
+        self.archive_after_days = archive_after_days
+        self.min_summary_items = min_summary_items
+        self.batch_size = batch_size
+        self._llm = None
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = ChatOpenAI(temperature=0, model=CHAT_MODEL, api_key=API_KEY)
+        return self._llm
+
+    def measure(self, user_id: str) -> Dict[str, int]:
+        """热集合中该用户的文档数、BSON 字节数，以及最新记忆写入提示词的估计 token 数"""
+        result = next(self.store.collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": None, "documents": {"$sum": 1}, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}}
+        ]), {"documents": 0, "bytes": 0})
+        latest = self.store.get_latest_memories(user_id)
+        serialized = {
+            category: [MemoryRetrievalSystem._serialize_memory(memory) for memory in memories]
+            for category, memories in latest.items()
+        }
+        return {
+            "documents": result["documents"],
+            "bytes": result["bytes"],
+            "latest_memories": sum(len(memories) for memories in latest.values()),
+            "prompt_tokens": estimate_tokens(json.dumps(serialized, ensure_ascii=False)),
+        }
+
+    def merge_duplicates(self, user_id: str) -> int:
+        """同一类别中与更新的记忆近似重复的最新记忆标记为非最新，返回合并条数"""
+        latest = self.store.get_latest_memories(user_id, include_embeddings=True)
+        memories = [memory for items in latest.values() for memory in items if memory.get("knowledge")]
+        if not memories:
+            return 0
+
+        missing = [memory for memory in memories if not memory.get("embedding")]
+        if missing:
+            vectors = get_memory_embeddings().embed_documents([memory["knowledge"] for memory in missing])
+            for memory, vector in zip(missing, vectors):
+                memory["embedding"] = list(vector)
+            if not self.dry_run:
+                self.store.set_memory_embeddings(
+                    user_id, [(memory["category"], memory["_id"], memory["embedding"]) for memory in missing]
+                )
+
+        duplicates = {}
+        for category, items in latest.items():
+            items = [memory for memory in items if memory.get("knowledge")]
+            if len(items) < 2:
+                continue
+            # 新的在前：每组近似重复中保留最新的一条
+            items.sort(key=lambda memory: memory["timestamp"], reverse=True)
+            vectors = normalize_vectors([memory["embedding"] for memory in items])
+            scores = vectors @ vectors.T
+            kept = []
+            for i, memory in enumerate(items):
+                match = next((j for j in kept if scores[i, j] >= self.dedup_threshold), None)
+                if match is None:
+                    kept.append(i)
+                else:
+                    duplicates[memory["_id"]] = items[match]["_id"]
+
+        if duplicates and not self.dry_run:
+            self.store.collection.bulk_write([
+                _mark_superseded(memory_id, "merged_into", kept_id)
+                for memory_id, kept_id in duplicates.items()
+            ], ordered=False)
+        return len(duplicates)
+
+    def summarized_sources(self, user_id: str) -> Dict[Any, Any]:
+        """已被某条摘要记忆的 summary_of 引用的来源记忆 ID -> 摘要记忆 ID"""
+        sources = {}
+        for summary in self.store.collection.find(
+            {"user_id": user_id, "summary_of.0": {"$exists": True}}, {"summary_of": 1}
+        ):
+            for memory_id in summary["summary_of"]:
+                sources[memory_id] = summary["_id"]
+        return sources
+
+    def stale_memories(self, user_id: str, summarized: Optional[Dict[Any, Any]] = None) -> Dict[str, List[dict]]:
+        """
+        按类别返回置信度低或早于 summary_after_days 天的最新记忆
+
+        摘要记忆本身、以及已被某条摘要引用的来源记忆不再参与汇总。
+        """
+        cutoff = datetime.now() - timedelta(days=self.summary_after_days)
+        if summarized is None:
+            summarized = self.summarized_sources(user_id)
+        stale = {}
+        for category, items in self.store.get_latest_memories(user_id).items():
+            selected = [
+                memory for memory in items
+                if memory.get("knowledge") and not memory.get("summary_of") and memory["_id"] not in summarized and (
+                    memory.get("confidence", 1.0) < self.low_confidence or memory["timestamp"] < cutoff
+                )
+            ]
+            if len(selected) >= self.min_summary_items:
+                stale[category] = selected
+        return stale
+
+    def summarize_stale(self, user_id: str) -> int:
+        """
+        把每个类别的低置信度或过旧记忆汇总为一条摘要记忆，返回被汇总的记忆条数
+
+        摘要插入和来源标记是两次写入：中途失败时来源仍是最新记忆，但已被摘要的 summary_of 引用，
+        重跑时只补做标记，不会再生成一条重复的摘要。
+        """
+        summarized = self.summarized_sources(user_id)
+        stale = self.stale_memories(user_id, summarized)
+        if self.dry_run or not self.summarize:
+            return sum(len(items) for items in stale.values()) if self.summarize else 0
+
+        # 上次运行插入摘要后未完成标记的来源记忆
+        unmarked = self.store.collection.find(
+            {"user_id": user_id, "_id": {"$in": list(summarized)}, "is_latest": True}, {"_id": 1}
+        ) if summarized else []
+        repairs = [_mark_superseded(memory["_id"], "summarized_into", summarized[memory["_id"]]) for memory in unmarked]
+        if repairs:
+            self.store.collection.bulk_write(repairs, ordered=False)
+        if not stale:
+            return len(repairs)
+
+        writes = []
+        for category, items in stale.items():
+            lines = "\n".join(
+                f"{format_timestamp(memory['timestamp'])} | {memory.get('confidence', '-')} | {memory['knowledge']}"
+                for memory in items
+            )
+            try:
+                summary = self.llm.invoke(memory_summary_prompt().format(category=category, memories=lines)).content.strip()
+            except Exception as e:
+                print(f"用户 {user_id} 类别 {category} 摘要生成失败，跳过: {str(e)}")
+                continue
+            if not summary:
+                continue
+            writes.append(MemoryWrite(category, {
+                "knowledge": summary,
+                "action": "创建",
+                "confidence": max(memory.get("confidence", 0.0) for memory in items),
+                "summary_of": [memory["_id"] for memory in items],
+            }))
+        if not writes:
+            return len(repairs)
+
+        embed_memory_writes(writes)
+        result = self.store.write_memories(user_id, writes)
+        operations = [
+            _mark_superseded(memory_id, "summarized_into", summary_id)
+            for write, summary_id in zip(writes, result.inserted_ids)
+            for memory_id in write.memory["summary_of"]
+        ]
+        self.store.collection.bulk_write(operations, ordered=False)
+        return len(repairs) + len(operations)
+
+    def archive_superseded(self, user_id: str) -> int:
+        """
+        把早于 archive_after_days 天的非最新版本移入归档集合，返回归档条数
+
+        先按 _id upsert 到归档集合再从热集合删除，中途失败后重跑不会丢失或重复。
+        """
+        cutoff = datetime.now() - timedelta(days=self.archive_after_days)
+        query = {"user_id": user_id, "is_latest": False, "timestamp": {"$lt": cutoff}}
+        if self.dry_run:
+            return self.store.collection.count_documents(query)
+
+        archived = 0
+        batch = []
+        for document in self.store.collection.find(query, {"embedding": 0}):
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                archived += self._move_to_archive(batch)
+                batch = []
+        if batch:
+            archived += self._move_to_archive(batch)
+        return archived
+
+    def _move_to_archive(self, documents: List[dict]) -> int:
+        self.store.archive.bulk_write(
+            [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in documents],
+            ordered=False
+        )
+        return self.store.collection.delete_many({"_id": {"$in": [document["_id"] for document in documents]}}).deleted_count
+
+    def compact_user(self, user_id: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        before = self.measure(user_id)
+        merged = self.merge_duplicates(user_id)
+        summarized = self.summarize_stale(user_id)
+        archived = self.archive_superseded(user_id)
+        if not self.dry_run:
+            invalidate_memory_cache(user_id)
+            get_context_pack_store().rebuild(user_id, self.store)
+        after = before if self.dry_run else self.measure(user_id)
+        return {
+            "user_id": user_id,
+            "merged": merged,
+            "summarized": summarized,
+            "archived": archived,
+            "before": before,
+            "after": after,
+            "bytes_reclaimed": before["bytes"] - after["bytes"],
+            "tokens_reclaimed": before["prompt_tokens"] - after["prompt_tokens"],
+            "seconds": time.perf_counter() - start,
+        }
+
+    def run(self, users: Optional[List[str]] = None) -> Dict[str, Any]:
+        users = users or sorted(self.store.collection.distinct("user_id"))
+        reports = []
+        for user_id in users:
+            try:
+                report = self.compact_user(user_id)
+            except Exception as e:
+                print(f"用户 {user_id} 压缩失败: {str(e)}")
+                continue
+            reports.append(report)
+            print(f"{user_id}: 合并 {report['merged']} 汇总 {report['summarized']} 归档 {report['archived']}，"
+                  f"回收 {report['bytes_reclaimed']} 字节 / {report['tokens_reclaimed']} tokens")
+
+        totals = {
+            key: sum(report[key] for report in reports)
+            for key in ("merged", "summarized", "archived", "bytes_reclaimed", "tokens_reclaimed")
+        }
+        totals["users"] = len(reports)
+        totals["bytes_before"] = sum(report["before"]["bytes"] for report in reports)
+        totals["tokens_before"] = sum(report["before"]["prompt_tokens"] for report in reports)
+        return {"dry_run": self.dry_run, "totals": totals, "users": reports}
+
+
+def _mark_superseded(memory_id: Any, field: str, target_id: Any) -> UpdateOne:
+    """把记忆标记为非最新，并记录它被合并或汇总到的记忆 ID"""
+    return UpdateOne({"_id": memory_id}, {"$set": {"is_latest": False, field: target_id}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆压缩：合并近似重复、汇总旧记忆、归档旧版本")
+    parser.add_argument("--users", nargs="+", default=None, help="只压缩指定用户（默认全部用户）")
+    parser.add_argument("--dry-run", action="store_true", help="只统计可压缩的条数，不修改数据")
+    parser.add_argument("--no-summarize", action="store_true", help="跳过 LLM 摘要步骤")
+    parser.add_argument("--output", default=None, help="保存报告的 JSON 文件")
+    parser.add_argument("--loop-interval", type=float, default=0, help="大于 0 时按该间隔（秒）循环执行")
+    args = parser.parse_args()
+
+    if MEMORY_STORE_LAYOUT == "per_user":
+        raise SystemExit("记忆压缩只支持单集合存储布局，请先运行 memory/migrate_memory_store.py 迁移")
+
+    compactor = MemoryCompactor(MongoDBPatientInfoSystem(), dry_run=args.dry_run, summarize=not args.no_summarize)
+    while True:
+        report = compactor.run(args.users)
+        totals = report["totals"]
+        print(f"\n共 {totals['users']} 个用户：合并 {totals['merged']}，汇总 {totals['summarized']}，归档 {totals['archived']}，"
+              f"回收 {totals['bytes_reclaimed']}/{totals['bytes_before']} 字节，"
+              f"{totals['tokens_reclaimed']}/{totals['tokens_before']} tokens")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            print(f"报告已保存到 {args.output}")
+        if args.loop_interval <= 0:
+            break
+        time.sleep(args.loop_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+单次调用记忆分类器的离线评估
+
+在录制的对话轮次上分别运行：
+    - 现有流程：显式、隐式两个 sentinel 并发，判定有信息时各自再调用一次 knowledge master
+    - 合并流程：UnifiedMemorySystem 一次结构化输出调用
+统计每轮 LLM 调用次数、延迟（mean/p50/p95），以及合并分类器与两个 sentinel 判定的一致率。
+评估过程不读写记忆库，已有记忆统一按"暂无记忆"处理。
+
+录制文件为 JSONL，每行 {"text": "..."}（也接受每行一段纯文本）。
+
+用法:
+    python memory/evaluate_unified_classifier.py --turns data/recorded_turns.jsonl --output unified_eval.json
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from memory import explicit_memory, implicit_memory
+from memory.unified_memory_system import UnifiedMemorySystem
+
+
+def load_turns(path: str, limit: Optional[int] = None) -> List[str]:
+    turns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                text = record.get("text") if isinstance(record, dict) else str(record)
+            except json.JSONDecodeError:
+                text = line
+            if text:
+                turns.append(text)
+            if limit and len(turns) >= limit:
+                break
+    return turns
+
+
+def describe(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0}
+    return {
+        "mean": statistics.mean(ordered),
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+async def run_sentinel_chain(system, parse, messages: List[HumanMessage], with_knowledge_master: bool):
+    """单个记忆系统的 sentinel（+ knowledge master），返回 (类别, LLM 调用次数)"""
+    response = await system.sentinel_runnable.ainvoke({"messages": messages})
+    category = parse(response.content)
+    calls = 1
+    if category and with_knowledge_master:
+        await system._knowledge_master_runnable(category).ainvoke({
+            "messages": messages,
+            "memories": "（该类别暂无记忆）"
+        })
+        calls += 1
+    return category, calls
+
+
+async def evaluate_turn(text: str, explicit_system, implicit_system, unified_system, with_knowledge_master: bool) -> Dict:
+    messages = [HumanMessage(content=text)]
+
+    start = time.perf_counter()
+    (explicit_category, explicit_calls), (implicit_category, implicit_calls) = await asyncio.gather(
+        run_sentinel_chain(explicit_system, explicit_memory.parse_sentinel_response, messages, with_knowledge_master),
+        run_sentinel_chain(implicit_system, implicit_memory.parse_sentinel_response, messages, with_knowledge_master),
+    )
+    baseline_latency = time.perf_counter() - start
+
+    start = time.perf_counter()
+    classification = await unified_system.classifier_runnable.ainvoke({
+        "messages": messages,
+        "memories": "（暂无记忆）"
+    })
+    unified_latency = time.perf_counter() - start
+
+    unified_explicit = [category.value for category in classification.explicit_categories]
+    unified_implicit = [category.value for category in classification.implicit_categories]
+    return {
+        "text": text,
+        "baseline": {
+            "explicit_category": explicit_category,
+            "implicit_category": implicit_category,
+            "llm_calls": explicit_calls + implicit_calls,
+            "latency": baseline_latency,
+        },
+        "unified": {
+            "explicit_categories": unified_explicit,
+            "implicit_categories": unified_implicit,
+            "items": [item.model_dump(mode="json") for item in classification.valid_items()],
+            "llm_calls": 1,
+            "latency": unified_latency,
+        },
+        "explicit_detect_agree": (explicit_category is not None) == bool(unified_explicit),
+        "implicit_detect_agree": (implicit_category is not None) == bool(unified_implicit),
+        "explicit_category_agree": explicit_category in unified_explicit if explicit_category else None,
+        "implicit_category_agree": implicit_category in unified_implicit if implicit_category else None,
+    }
+
+
+def summarize(results: List[Dict]) -> Dict:
+    def rate(key: str) -> Optional[float]:
+        values = [r[key] for r in results if r[key] is not None]
+        return sum(values) / len(values) if values else None
+
+    return {
+        "turns": len(results),
+        "baseline": {
+            "llm_calls_per_turn": statistics.mean(r["baseline"]["llm_calls"] for r in results),
+            "latency": describe([r["baseline"]["latency"] for r in results]),
+        },
+        "unified": {
+            "llm_calls_per_turn": 1.0,
+            "latency": describe([r["unified"]["latency"] for r in results]),
+        },
+        "agreement": {
+            "explicit_detect": rate("explicit_detect_agree"),
+            "implicit_detect": rate("implicit_detect_agree"),
+            "explicit_category": rate("explicit_category_agree"),
+            "implicit_category": rate("implicit_category_agree"),
+        },
+    }
+
+
+async def main(args):
+    turns = load_turns(args.turns, args.limit)
+    print(f"载入 {len(turns)} 个对话轮次")
+
+    explicit_system = explicit_memory.ExplicitMemorySystem()
+    implicit_system = implicit_memory.ImplicitMemorySystem()
+    unified_system = UnifiedMemorySystem()
+
+    results = []
+    for i, text in enumerate(turns, 1):
+        result = await evaluate_turn(text, explicit_system, implicit_system, unified_system, not args.sentinel_only)
+        results.append(result)
+        print(f"[{i}/{len(turns)}] 两 sentinel: {result['baseline']['explicit_category']}/{result['baseline']['implicit_category']} "
+              f"({result['baseline']['latency']:.2f}s)  合并: {result['unified']['explicit_categories']}/"
+              f"{result['unified']['implicit_categories']} ({result['unified']['latency']:.2f}s)")
+
+    summary = summarize(results)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"评估结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="单次调用记忆分类器离线评估")
+    parser.add_argument("--turns", required=True, help="录制的对话轮次（JSONL）")
+    parser.add_argument("--limit", type=int, default=None, help="最多评估的轮次数")
+    parser.add_argument("--sentinel-only", action="store_true", help="现有流程只运行 sentinel，不调用 knowledge master")
+    parser.add_argument("--output", default=None, help="保存逐轮结果和汇总的 JSON 文件")
+    asyncio.run(main(parser.parse_args()))
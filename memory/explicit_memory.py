@@ -4,99 +4,14 @@ rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 import json
 from enum import Enum
 from datetime import datetime
-from typing import Dict, List, TypedDict, Sequence, Optional, Any
-from langchain_core.messages import HumanMessage, BaseMessage
+from typing import Dict, List, TypedDict, Sequence, Optional
+from langchain_core.messages import BaseMessage
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolInvocation
-from langchain_core.utils.function_calling import convert_to_openai_function
-from langgraph.prebuilt import ToolExecutor
 from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    MessagesPlaceholder,
-)
-
-from prompts import memory_prompt
-from memory.memory_retrieve import MemoryRetrievalSystem
-from utils.mongodb_patient_info_system import MongoDBPatientInfoSystem
-from load_config import CHAT_MODEL, API_KEY, MONGODB_HOST, MONGODB_PORT
-
-from pymongo import MongoClient
-from typing import Dict, List, Any
-
-class MongoDBPatientInfoSystem:
-    def __init__(self, connection_string: str):
-        self.client = MongoClient(connection_string)
-
-    def get_user_db(self, user_id: str):
-        return self.client[user_id]
-
-    def get_category_collection(self, user_id: str, category: str):
-        db = self.get_user_db(user_id)
-        return db[category]
 
-    def add_memory(self, user_id: str, category: str, memory: Dict[str, Any]):
-        collection = self.get_category_collection(user_id, category)
-        memory['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        memory['is_latest'] = True
-        result = collection.insert_one(memory)
-        return result.inserted_id
-
-    def update_memory(self, user_id: str, category: str, memory_id: str, updated_memory: Dict[str, Any]):
-        collection = self.get_category_collection(user_id, category)
-        
-        # 先找到原来的记忆
-        original_memory = collection.find_one({"_id": memory_id})
-        if not original_memory:
-            return None
-            
-        # 将原记忆标记为非最新版本
-        collection.update_one(
-            {"_id": memory_id},
-            {"$set": {"is_latest": False}}
-        )
-
-        # 创建新记忆，继承原记忆的某些字段，并添加新的字段
-        updated_memory['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        updated_memory['previous_version_id'] = str(memory_id)
-        updated_memory['is_latest'] = True
-        
-        # 插入新记忆
-        result = collection.insert_one(updated_memory)
-        return result.inserted_id
-
-    def get_memories(self, user_id: str, category: str, include_history: bool = False):
-        collection = self.get_category_collection(user_id, category)
-        if include_history:
-            return list(collection.find().sort("timestamp", -1))
-        else:
-            # 返回所有创建的记忆和最新版本的更新记忆
-            query = {
-                "$or": [
-                    {"action": "创建"},
-                    {"$and": [{"action": "更新"}, {"is_latest": True}]}
-                ]
-            }
-            return list(collection.find(query))
-    
-    def get_memory_history(self, user_id: str, category: str, memory_id: str) -> List[Dict[str, Any]]:
-        """获取某条记忆的所有历史版本"""
-        collection = self.get_category_collection(user_id, category)
-        history = []
-        current_id = memory_id
-        
-        while current_id:
-            memory = collection.find_one({"_id": current_id})
-            if memory:
-                history.append(memory)
-                current_id = memory.get('previous_version_id')
-            else:
-                break
-                
-        return history
+from memory.unified_memory_system import BaseMemorySystem, MemoryType
 
 class Category(str, Enum):
     DEMOGRAPHIC_INFO = "人口学信息"
@@ -235,135 +150,12 @@ def call_tool(state):
 
     return {"messages": messages, "memories": new_memories}
 
-class ExplicitMemorySystem:
-    def __init__(self):
-        self.db_system = MongoDBPatientInfoSystem(f"mongodb://{MONGODB_HOST}:{MONGODB_PORT}/")
-        self.agent_tools = [tool_modify_patient_knowledge]
-        self.tool_executor = ToolExecutor(self.agent_tools)
-
-        sentinel_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(memory_prompt.explicit_initial_sentinel_prompt()),
-            MessagesPlaceholder(variable_name="messages"),
-        ])
-        knowledge_master_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(memory_prompt.explicit_initial_knowledge_master_prompt()),
-            MessagesPlaceholder(variable_name="messages"),
-            SystemMessagePromptTemplate.from_template("现有的记忆：{memories}"),
-        ])
-
-        tools = [convert_to_openai_function(t) for t in self.agent_tools]
-
-        self.sentinel_runnable = sentinel_prompt | ChatOpenAI(
-            temperature=0,
-            model=CHAT_MODEL,
-            api_key=API_KEY,
-            # base_url=HOST + "/v1"
-        )
-        self.knowledge_master_runnable = knowledge_master_prompt | ChatOpenAI(
-            temperature=0.5,
-            model=CHAT_MODEL,
-            api_key=API_KEY,
-            # base_url=HOST + "/v1"
-        ).bind_tools(tools)
-
-    def process_user_input(self, user_id: str, conversation_history: List[str]):
-        messages = [HumanMessage(content=msg) for msg in conversation_history]
-        
-        response = self.sentinel_runnable.invoke({"messages": messages})
-        contains_information = parse_sentinel_response(response.content)
+class ExplicitMemorySystem(BaseMemorySystem):
+    """显式记忆系统：记录患者明确陈述的事实，工具参数中的类别限定为显式记忆类别"""
 
-        if contains_information:
-            retrieval_system = MemoryRetrievalSystem()
-            categories = list(Category._value2member_map_.keys())
-            memories = retrieval_system.retrieve_memories_by_categories(user_id=user_id, categories=categories)
-            memories = json.dumps(memories, ensure_ascii=False, default=str)
-            knowledge_master_prompt = ChatPromptTemplate.from_messages([
-                SystemMessagePromptTemplate.from_template(
-                    memory_prompt.implicit_initial_knowledge_master_prompt() + "\n" +
-                    f"当前类别：{contains_information}\n" +
-                    "已有记忆：{memories}"  # 使用变量占位符
-                ),
-                MessagesPlaceholder(variable_name="messages")
-            ])
-            
-            # 创建新的 runnable
-            self.knowledge_master_runnable = knowledge_master_prompt | ChatOpenAI(
-                temperature=0.5,
-                model=CHAT_MODEL,
-                api_key=API_KEY,
-            ).bind_tools([convert_to_openai_function(t) for t in self.agent_tools])
-            
-            response = self.knowledge_master_runnable.invoke({
-                "messages": messages,
-                "memories": memories if memories else "（该类别暂无记忆）"
-            })
-            messages.append(response)
-            last_message = messages[-1]
-
-            if "tool_calls" in last_message.additional_kwargs:
-                new_memories = self.process_tool_calls(
-                    user_id, 
-                    contains_information,  # 使用标准化后的类别
-                    last_message.additional_kwargs["tool_calls"]
-                )
-                return new_memories if new_memories else "无隐式记忆记录"
-            else:
-                return "无隐式记忆记录"
-        return "无隐式记忆记录"
-    
-    def process_tool_calls(self, user_id: str, category: str, tool_calls):
-        new_memories = []
-        for tool_call in tool_calls:
-            action = ToolInvocation(
-                tool=tool_call["function"]["name"],
-                tool_input=json.loads(tool_call["function"]["arguments"]),
-                id=tool_call["id"],
-            )
-            response_dict = self.tool_executor.invoke(action)
-            
-            if isinstance(action.tool_input, dict):
-                new_memories.append(action.tool_input)
-                self.handle_tool_response(user_id, response_dict, action.tool_input)
-        return new_memories
-
-    def handle_tool_response(self, user_id: str, response_dict, tool_input):
-        if response_dict["status"] == "Success":
-            action = tool_input.get('action')
-            category = tool_input.get('category')
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            tool_input['timestamp'] = current_time  # 确保工具输入中也包含时间戳
-            
-            if action == Action.Create:
-                self.db_system.add_memory(user_id, category, tool_input)
-                print(f"[{current_time}] 成功创建新知识: {tool_input['knowledge']}")
-            elif action == Action.Update:
-                if 'knowledge_old' in tool_input:
-                    self.update_existing_memory(user_id, category, tool_input)
-                else:
-                    print(f"[{current_time}] 警告: 尝试更新不存在的知识。将其作为新知识添加。")
-                    self.db_system.add_memory(user_id, category, tool_input)
-        else:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 处理知识时出错: {response_dict['message']}")
-
-    def update_existing_memory(self, user_id: str, category: str, memory: Dict[str, Any]):
-        memories = self.db_system.get_memories(user_id, category)
-        for existing_memory in memories:
-            if existing_memory['knowledge'] == memory.get('knowledge_old'):
-                # 创建新版本的记忆
-                new_memory_id = self.db_system.update_memory(
-                    user_id, 
-                    category, 
-                    existing_memory['_id'], 
-                    memory
-                )
-                if new_memory_id:
-                    print(f"[{memory.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}] "
-                        f"成功更新知识: {memory['knowledge']} (版本ID: {new_memory_id})")
-                    return
+    def __init__(self):
+        super().__init__(MemoryType.EXPLICIT, agent_tools=[tool_modify_patient_knowledge])
 
-        print(f"警告: 未找到要更新的知识。将其作为新知识添加。")
-        self.db_system.add_memory(user_id, category, memory)
-        
 
 if __name__ == "__main__":
     user_id = "test"
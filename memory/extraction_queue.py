@@ -0,0 +1,419 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from pymongo import ASCENDING
+
+from utils.mongo_pool import get_mongo_client
+from load_config import (
+    MONGODB_DB_NAME,
+    MEMORY_QUEUE_BACKEND,
+    MEMORY_QUEUE_COLLECTION,
+    MEMORY_QUEUE_WORKERS,
+    MEMORY_QUEUE_MAX_BATCH,
+    MEMORY_QUEUE_BATCH_WINDOW,
+    MEMORY_QUEUE_MAX_ATTEMPTS,
+    MEMORY_QUEUE_LEASE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+
+def turn_hash(user_id: str, text: str) -> str:
+    normalized = " ".join((text or "").split())
+    return hashlib.sha256(f"{user_id}\x00{normalized}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ExtractionJob:
+    user_id: str
+    text: str
+    turn_hash: str
+    enqueued_at: float = field(default_factory=time.time)
+    attempts: int = 0
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # 已成功处理该轮次的记忆系统，重试时跳过，避免重复写入记忆
+    done_systems: List[str] = field(default_factory=list)
+
+
+class InProcessQueueBackend:
+    """
+    默认后端：进程内 asyncio 队列
+
+    按用户分组保存待处理的对话轮次，同一用户尚未处理的相同内容只保留一份。
+    进程退出时未处理的任务会丢失。
+    """
+
+    def __init__(self):
+        self._pending: "OrderedDict[str, List[ExtractionJob]]" = OrderedDict()
+        self._keys: Set[str] = set()
+        self._event = asyncio.Event()
+
+    async def put(self, job: ExtractionJob) -> bool:
+        if job.turn_hash in self._keys:
+            return False
+        self._keys.add(job.turn_hash)
+        self._pending.setdefault(job.user_id, []).append(job)
+        self._event.set()
+        return True
+
+    async def take(self, max_batch: int, exclude_users: Set[str], timeout: float) -> List[ExtractionJob]:
+        """取出最早等待的一个用户的至多 max_batch 个轮次，exclude_users 中的用户正在被其他 worker 处理"""
+        deadline = time.monotonic() + timeout
+        while True:
+            for user_id, jobs in self._pending.items():
+                if user_id in exclude_users:
+                    continue
+                batch, rest = jobs[:max_batch], jobs[max_batch:]
+                if rest:
+                    self._pending[user_id] = rest
+                else:
+                    del self._pending[user_id]
+                return batch
+            self._event.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+
+    async def ack(self, jobs: List[ExtractionJob]):
+        for job in jobs:
+            self._keys.discard(job.turn_hash)
+
+    async def retry(self, jobs: List[ExtractionJob]):
+        if not jobs:
+            return
+        self._pending.setdefault(jobs[0].user_id, [])[:0] = jobs
+        self._event.set()
+
+    async def depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    async def oldest_enqueued_at(self, user_id: Optional[str] = None) -> Optional[float]:
+        if user_id is not None:
+            jobs = self._pending.get(user_id)
+            return jobs[0].enqueued_at if jobs else None
+        times = [jobs[0].enqueued_at for jobs in self._pending.values() if jobs]
+        return min(times) if times else None
+
+
+class MongoQueueBackend:
+    """
+    可选后端：MongoDB 持久化队列
+
+    任务以文档形式保存（status: pending / processing），多个进程可以共享同一队列；
+    取出任务时记录 claimed_at 作为租约，只有超过 lease_seconds 仍未确认的 processing 任务
+    （持有进程已退出或卡住）才会被重新置为 pending，其他进程正在处理的任务不受影响。
+    同一用户有未过期的 processing 任务时，其他进程不会取出该用户的任务，保证跨进程的处理顺序。
+    """
+
+    def __init__(self, collection=None, lease_seconds: float = MEMORY_QUEUE_LEASE_SECONDS):
+        if collection is None:
+            client = get_mongo_client()
+            collection = client[MONGODB_DB_NAME][MEMORY_QUEUE_COLLECTION]
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.collection.create_index([("status", ASCENDING), ("enqueued_at", ASCENDING)])
+        self.collection.create_index([("turn_hash", ASCENDING), ("status", ASCENDING)])
+        self.collection.create_index([("status", ASCENDING), ("user_id", ASCENDING), ("claimed_at", ASCENDING)])
+        self._last_requeue = 0.0
+        self._requeue_expired()
+
+    def _lease_cutoff(self) -> datetime:
+        return datetime.now() - timedelta(seconds=self.lease_seconds)
+
+    def _requeue_expired(self):
+        """把租约已过期的 processing 任务重新置为 pending"""
+        self._last_requeue = time.monotonic()
+        result = self.collection.update_many(
+            {"status": "processing", "claimed_at": {"$lt": self._lease_cutoff()}},
+            {"$set": {"status": "pending"}, "$unset": {"claim": "", "claimed_at": ""}},
+        )
+        if result.modified_count:
+            logger.warning(f"重新排队 {result.modified_count} 个租约过期的记忆抽取任务")
+
+    def _busy_users(self) -> List[str]:
+        """有未过期 processing 任务的用户（可能由其他进程处理）"""
+        return self.collection.distinct(
+            "user_id", {"status": "processing", "claimed_at": {"$gte": self._lease_cutoff()}}
+        )
+
+    @staticmethod
+    def _to_job(doc: Dict) -> ExtractionJob:
+        return ExtractionJob(
+            user_id=doc["user_id"],
+            text=doc["text"],
+            turn_hash=doc["turn_hash"],
+            enqueued_at=doc["enqueued_at"],
+            attempts=doc.get("attempts", 0),
+            job_id=doc["_id"],
+            done_systems=doc.get("done_systems", []),
+        )
+
+    def _put(self, job: ExtractionJob) -> bool:
+        result = self.collection.update_one(
+            {"turn_hash": job.turn_hash, "status": {"$in": ["pending", "processing"]}},
+            {"$setOnInsert": {
+                "_id": job.job_id,
+                "user_id": job.user_id,
+                "text": job.text,
+                "enqueued_at": job.enqueued_at,
+                "attempts": 0,
+                "status": "pending",
+            }},
+            upsert=True,
+        )
+        return result.upserted_id is not None
+
+    def _take(self, max_batch: int, exclude_users: Set[str]) -> List[ExtractionJob]:
+        if time.monotonic() - self._last_requeue > self.lease_seconds / 4:
+            self._requeue_expired()
+        claim = uuid.uuid4().hex
+        busy = set(exclude_users) | set(self._busy_users())
+        first = self.collection.find_one_and_update(
+            {"status": "pending", "user_id": {"$nin": list(busy)}},
+            {"$set": {"status": "processing", "claim": claim, "claimed_at": datetime.now()}},
+            sort=[("enqueued_at", ASCENDING)],
+        )
+        if first is None:
+            return []
+        # 两个进程可能同时认为该用户空闲；发现该用户已有其他未过期的认领时放回，下次再取
+        if self.collection.count_documents({
+            "user_id": first["user_id"],
+            "status": "processing",
+            "claim": {"$ne": claim},
+            "claimed_at": {"$gte": self._lease_cutoff()},
+        }):
+            self.collection.update_one(
+                {"_id": first["_id"], "claim": claim},
+                {"$set": {"status": "pending"}, "$unset": {"claim": "", "claimed_at": ""}},
+            )
+            return []
+        if max_batch > 1:
+            ids = [doc["_id"] for doc in self.collection.find(
+                {"status": "pending", "user_id": first["user_id"]}, {"_id": 1}
+            ).sort("enqueued_at", ASCENDING).limit(max_batch - 1)]
+            if ids:
+                self.collection.update_many(
+                    {"_id": {"$in": ids}, "status": "pending"},
+                    {"$set": {"status": "processing", "claim": claim, "claimed_at": datetime.now()}},
+                )
+        docs = self.collection.find({"claim": claim}).sort("enqueued_at", ASCENDING)
+        return [self._to_job(doc) for doc in docs]
+
+    def _ack(self, jobs: List[ExtractionJob]):
+        self.collection.delete_many({"_id": {"$in": [job.job_id for job in jobs]}})
+
+    def _retry(self, jobs: List[ExtractionJob]):
+        for job in jobs:
+            self.collection.update_one(
+                {"_id": job.job_id},
+                {"$set": {"status": "pending", "attempts": job.attempts, "done_systems": job.done_systems},
+                 "$unset": {"claim": "", "claimed_at": ""}},
+            )
+
+    def _oldest_enqueued_at(self, user_id: Optional[str] = None) -> Optional[float]:
+        query = {"status": "pending"}
+        if user_id is not None:
+            query["user_id"] = user_id
+        doc = self.collection.find_one(query, {"enqueued_at": 1}, sort=[("enqueued_at", ASCENDING)])
+        return doc["enqueued_at"] if doc else None
+
+    async def put(self, job: ExtractionJob) -> bool:
+        return await asyncio.to_thread(self._put, job)
+
+    async def take(self, max_batch: int, exclude_users: Set[str], timeout: float) -> List[ExtractionJob]:
+        jobs = await asyncio.to_thread(self._take, max_batch, set(exclude_users))
+        if not jobs:
+            await asyncio.sleep(timeout)
+        return jobs
+
+    async def ack(self, jobs: List[ExtractionJob]):
+        await asyncio.to_thread(self._ack, jobs)
+
+    async def retry(self, jobs: List[ExtractionJob]):
+        await asyncio.to_thread(self._retry, jobs)
+
+    async def depth(self) -> int:
+        return await asyncio.to_thread(self.collection.count_documents, {"status": "pending"})
+
+    async def oldest_enqueued_at(self, user_id: Optional[str] = None) -> Optional[float]:
+        return await asyncio.to_thread(self._oldest_enqueued_at, user_id)
+
+
+def system_name(system) -> str:
+    memory_type = getattr(system, "memory_type", None)
+    return f"{type(system).__name__}:{memory_type.value}" if memory_type is not None else type(system).__name__
+
+
+def batch_message(texts: List[str]) -> str:
+    """
+    把同一用户的多个待处理轮次合成一条消息：knowledge master 和分类器的提示词只关注最近一条消息，
+    多轮分别作为多条消息传入时只有最后一轮会被抽取
+    """
+    if len(texts) == 1:
+        return texts[0]
+    return "\n".join(texts)
+
+
+def create_queue_backend(name: str = MEMORY_QUEUE_BACKEND):
+    if name == "mongodb":
+        return MongoQueueBackend()
+    if name == "memory":
+        return InProcessQueueBackend()
+    raise ValueError(f"不支持的记忆抽取队列后端: {name}")
+
+
+class MemoryExtractionQueue:
+    """
+    后台记忆抽取队列
+
+    回复路径只负责 enqueue 当前轮次；后台 worker 每次取出同一用户的多个待处理轮次，
+    去重后合成一条消息交给记忆系统（合并分类器或显式/隐式记忆系统）抽取一次，并由记忆系统写入 MongoDB。
+    同一用户同一时刻只由一个 worker 处理，保证记忆更新的先后顺序。
+    """
+
+    def __init__(
+        self,
+        memory_systems: List,
+        backend=None,
+        workers: int = MEMORY_QUEUE_WORKERS,
+        max_batch: int = MEMORY_QUEUE_MAX_BATCH,
+        batch_window: float = MEMORY_QUEUE_BATCH_WINDOW,
+        max_attempts: int = MEMORY_QUEUE_MAX_ATTEMPTS,
+    ):
+        self.memory_systems = memory_systems
+        self.backend = backend or create_queue_backend()
+        self.workers = workers
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self._in_flight: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {
+            "enqueued": 0,
+            "deduplicated": 0,
+            "processed_turns": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dropped_turns": 0,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0,
+        }
+
+    async def enqueue(self, user_id: str, text: str) -> bool:
+        """加入一轮对话，返回 False 表示该用户已有相同内容在等待处理"""
+        accepted = await self.backend.put(ExtractionJob(user_id=user_id, text=text, turn_hash=turn_hash(user_id, text)))
+        self.stats["enqueued" if accepted else "deduplicated"] += 1
+        return accepted
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+            logger.info(f"记忆抽取队列已启动 - 后端: {type(self.backend).__name__}, worker 数: {self.workers}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait_for_batch_window(self):
+        """队首任务等待不足 batch_window 时稍作等待，让同一用户的后续轮次合并进同一批次"""
+        oldest = await self.backend.oldest_enqueued_at()
+        if oldest is not None:
+            age = time.time() - oldest
+            if age < self.batch_window:
+                await asyncio.sleep(self.batch_window - age)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                await self._wait_for_batch_window()
+                jobs = await self.backend.take(self.max_batch, self._in_flight, timeout=1.0)
+                if not jobs:
+                    continue
+                user_id = jobs[0].user_id
+                self._in_flight.add(user_id)
+                try:
+                    await self._process(user_id, jobs)
+                finally:
+                    self._in_flight.discard(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"记忆抽取 worker {index} 出错: {str(e)}", exc_info=True)
+                await asyncio.sleep(1.0)
+
+    async def _process(self, user_id: str, jobs: List[ExtractionJob]):
+        """
+        每个记忆系统只处理它尚未成功处理过的轮次；某个系统失败时只为该系统重试，
+        已成功的系统记录在 job.done_systems 中，重试时不会再次写入同样的记忆
+        """
+        names, calls = [], []
+        for system in self.memory_systems:
+            name = system_name(system)
+            texts = list(dict.fromkeys(job.text for job in jobs if name not in job.done_systems))
+            if texts:
+                names.append(name)
+                calls.append(system.aprocess_user_input(user_id, [batch_message(texts)]))
+        outcomes = await asyncio.gather(*calls, return_exceptions=True)
+
+        results, errors = {}, {}
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, Exception):
+                errors[name] = outcome
+                continue
+            results[name] = outcome
+            for job in jobs:
+                if name not in job.done_systems:
+                    job.done_systems.append(name)
+
+        if errors:
+            logger.error(f"记忆抽取失败 - 用户ID: {user_id}, 轮次: {len(jobs)}, 错误: {errors}")
+            self.stats["failed_batches"] += 1
+            retry = []
+            for job in jobs:
+                job.attempts += 1
+                if job.attempts < self.max_attempts:
+                    retry.append(job)
+                else:
+                    self.stats["dropped_turns"] += 1
+            await self.backend.retry(retry)
+            if len(retry) < len(jobs):
+                await self.backend.ack([job for job in jobs if job not in retry])
+            return
+
+        await self.backend.ack(jobs)
+        lag = time.time() - min(job.enqueued_at for job in jobs)
+        self.stats["processed_turns"] += len(jobs)
+        self.stats["batches"] += 1
+        self.stats["last_lag_seconds"] = lag
+        self.stats["max_lag_seconds"] = max(self.stats["max_lag_seconds"], lag)
+        logger.info(f"记忆抽取完成 - 用户ID: {user_id}, 轮次: {len(jobs)}, 延迟: {lag:.2f}s, 结果: {results}")
+
+    async def metrics(self) -> Dict[str, float]:
+        depth = await self.backend.depth()
+        oldest = await self.backend.oldest_enqueued_at()
+        batches = self.stats["batches"]
+        return {
+            "backend": type(self.backend).__name__,
+            "workers": len(self._tasks),
+            "queue_depth": depth,
+            "in_flight_users": len(self._in_flight),
+            "oldest_pending_seconds": time.time() - oldest if oldest is not None else 0.0,
+            "avg_batch_size": self.stats["processed_turns"] / batches if batches else 0.0,
+            **self.stats,
+        }
@@ -0,0 +1,105 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+
+from utils.embedding_cache import cached_embeddings
+from load_config import API_KEY, EMBEDDING_MODEL, MEMORY_UPDATE_EMBEDDING_FALLBACK, MEMORY_UPDATE_MATCH_THRESHOLD
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_memory_embeddings():
+    """懒加载带缓存的嵌入模型，供记忆更新匹配和语义检索共用"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            _embeddings = cached_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=API_KEY))
+        return _embeddings
+
+
+class MemoryUpdateMatcher:
+    """
+    定位 knowledge master 要更新的旧记忆
+
+    LLM 给出了提示词中的记忆 ID（previous_version_id）且该记忆仍是最新版本时直接使用；
+    否则按 knowledge_old 的规范化内容哈希做一次索引查询；LLM 改写了 knowledge_old 导致哈希未命中时，
+    再在该类别的最新记忆中按嵌入余弦相似度取最相近的一条（低于阈值视为未找到）。
+    """
+
+    def __init__(
+        self,
+        db_system,
+        embedding_fallback: bool = MEMORY_UPDATE_EMBEDDING_FALLBACK,
+        threshold: float = MEMORY_UPDATE_MATCH_THRESHOLD
+    ):
+        self.db_system = db_system
+        self.embedding_fallback = embedding_fallback
+        self.threshold = threshold
+        self.id_hits = 0
+        self.hash_hits = 0
+        self.embedding_hits = 0
+        self.misses = 0
+
+    def resolve(
+        self,
+        user_id: str,
+        category: str,
+        knowledge_old: Optional[str],
+        memory_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        if memory_id:
+            memory = self.db_system.find_latest_by_id(user_id, category, memory_id)
+            if memory is not None:
+                self.id_hits += 1
+                return memory
+
+        if not knowledge_old:
+            self.misses += 1
+            return None
+
+        memory = self.db_system.find_latest_by_knowledge(user_id, category, knowledge_old)
+        if memory is not None:
+            self.hash_hits += 1
+            return memory
+
+        if self.embedding_fallback:
+            candidates = self.db_system.get_latest_memories(user_id, [category], include_embeddings=True).get(category, [])
+            memory = self.nearest(knowledge_old, candidates)
+            if memory is not None:
+                self.embedding_hits += 1
+                return memory
+
+        self.misses += 1
+        return None
+
+    def nearest(self, knowledge_old: str, candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        candidates = [memory for memory in candidates if memory.get("knowledge")]
+        if not candidates:
+            return None
+
+        embeddings = get_memory_embeddings()
+        query = np.asarray(embeddings.embed_query(knowledge_old), dtype=np.float32)
+        # 写入时已保存向量的记忆直接使用，其余的再计算
+        missing = [memory["knowledge"] for memory in candidates if not memory.get("embedding")]
+        computed = iter(embeddings.embed_documents(missing) if missing else [])
+        vectors = np.asarray(
+            [memory["embedding"] if memory.get("embedding") else next(computed) for memory in candidates],
+            dtype=np.float32
+        )
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        scores = vectors @ query / np.where(norms == 0, 1, norms)
+
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        print(f"knowledge_old 未精确匹配，按语义相似度 {scores[best]:.3f} 匹配到: {candidates[best]['knowledge']}")
+        return candidates[best]
+
+    def stats(self) -> Dict[str, int]:
+        return {"id_hits": self.id_hits, "hash_hits": self.hash_hits, "embedding_hits": self.embedding_hits, "misses": self.misses}
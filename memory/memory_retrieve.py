@@ -1,10 +1,15 @@
 import rootutils
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
-from typing import Dict, List, Optional
-from pymongo import MongoClient
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from utils.mongodb_patient_info_system import get_patient_info_system, format_timestamp
+from utils.memory_cache import get_memory_cache, ALL_CATEGORIES
+from memory.semantic_memory_index import get_semantic_index
+from utils.token_estimate import estimate_tokens
+from load_config import MEMORY_RETRIEVAL_MODE, MEMORY_RETRIEVAL_TOP_K, MEMORY_RETRIEVAL_TOKEN_BUDGET
 from typing import Dict, List, TypedDict, Union
-from load_config import MONGODB_HOST, MONGODB_PORT
 
 
 class MemoryInfo(TypedDict):
@@ -14,12 +19,9 @@ class MemoryInfo(TypedDict):
 
 class MemoryRetrievalSystem:
     def __init__(self):
-        """初始化记忆检索系统，自动连接到MongoDB"""
-        self.client = MongoClient(
-            host=MONGODB_HOST,
-            port=MONGODB_PORT,
-            directConnection=True
-        )
+        """初始化记忆检索系统，读取配置的记忆存储（共享 MongoDB 连接池）"""
+        self.db_system = get_patient_info_system()
+        self.cache = get_memory_cache()
 
     def retrieve_memories_by_categories(
         self,
@@ -38,48 +40,114 @@ class MemoryRetrievalSystem:
         Returns:
             Dict[str, List[dict]]: 按类别组织的最新记忆字典
         """
-        result = {}
-        db = self.client[user_id]
-        
-        # 如果未指定类别，则获取数据库中所有可用的类别
-        if categories is None:
-            categories = db.list_collection_names()
+        try:
+            latest_memories = self._load_latest_memories(user_id, categories)
+        except Exception as e:
+            print(f"Error retrieving memories for user '{user_id}': {str(e)}")
+            return {}
 
-        # 从每个类别集合中获取文档
-        for category in categories:
-            collection = db[category]
-            
-            # 构建查询条件
-            query = {"is_latest": True}  # 只获取最新版本
+        result = {}
+        for category, memories in latest_memories.items():
             if confidence_threshold is not None:
-                query["confidence"] = {"$gte": confidence_threshold}
-                
-            try:
-                # 执行查询
-                latest_memories = list(collection.find(query))
-                
-                if latest_memories:
-                    # 处理查询结果
-                    memories = []
-                    for doc in latest_memories:
-                        doc_copy = doc.copy()
-                        if "_id" in doc_copy:
-                            doc_copy["_id"] = str(doc_copy["_id"])
-                        memories.append(doc_copy)
-                    
-                    result[category] = memories
-                    
-            except Exception as e:
-                print(f"Error processing category '{category}': {str(e)}")
+                memories = [doc for doc in memories if doc.get("confidence", 0) >= confidence_threshold]
+            if not memories:
                 continue
-                
+            result[category] = []
+            for doc in memories:
+                result[category].append(self._serialize_memory(doc))
+
+        return result
+
+    def retrieve_relevant_memories(
+        self,
+        user_id: str,
+        query: str,
+        categories: Optional[List[str]] = None,
+        top_k: int = MEMORY_RETRIEVAL_TOP_K,
+        token_budget: int = MEMORY_RETRIEVAL_TOKEN_BUDGET
+    ) -> Dict[str, List[dict]]:
+        """
+        语义检索：返回与 query 最相关的 top_k 条最新记忆，总长度不超过 token_budget
+        
+        Args:
+            user_id: 用户ID
+            query: 检索语句（通常是当前用户输入）
+            categories: 限定的类别列表，为None则在全部类别中检索
+            top_k: 最多返回的记忆条数
+            token_budget: 返回记忆的估计 token 总数上限
+            
+        Returns:
+            Dict[str, List[dict]]: 按类别组织的记忆字典，每条记忆带 relevance（余弦相似度）
+        """
+        try:
+            results = get_semantic_index().search(user_id, query, top_k, categories)
+        except Exception as e:
+            print(f"Error retrieving relevant memories for user '{user_id}': {str(e)}")
+            return {}
+
+        result = {}
+        used_tokens = 0
+        for score, memory in results:
+            memory_copy = self._serialize_memory(memory)
+            memory_copy["relevance"] = round(score, 3)
+            tokens = estimate_tokens(json.dumps(memory_copy, ensure_ascii=False))
+            if used_tokens + tokens > token_budget:
+                break
+            used_tokens += tokens
+            result.setdefault(memory_copy["category"], []).append(memory_copy)
         return result
 
+    def retrieve_memories(
+        self,
+        user_id: str,
+        categories: Optional[List[str]] = None,
+        query: Optional[str] = None
+    ) -> Dict[str, List[dict]]:
+        """按配置的检索模式取记忆：semantic 模式且有 query 时做 top-k 语义检索，否则返回所选类别的全部最新记忆"""
+        if MEMORY_RETRIEVAL_MODE == "semantic" and query:
+            return self.retrieve_relevant_memories(user_id, query, categories)
+        return self.retrieve_memories_by_categories(user_id=user_id, categories=categories)
+
+    def _load_latest_memories(self, user_id: str, categories: Optional[List[str]]) -> Dict[str, List[dict]]:
+        """读穿缓存：命中的类别直接返回，未命中的类别一次查询补齐后写回缓存（空类别也缓存）"""
+        if self.cache is None:
+            return self.db_system.get_latest_memories(user_id, categories)
+
+        keys = list(categories) if categories is not None else [ALL_CATEGORIES]
+        found, missing = self.cache.get_many(user_id, keys)
+        if missing:
+            generation = self.cache.generation(user_id)
+            if categories is None:
+                loaded = {ALL_CATEGORIES: self.db_system.get_latest_memories(user_id)}
+            else:
+                fetched = self.db_system.get_latest_memories(user_id, missing)
+                loaded = {category: fetched.get(category, []) for category in missing}
+            self.cache.put_many(user_id, loaded, generation)
+            found.update(loaded)
+
+        if categories is None:
+            return found[ALL_CATEGORIES]
+        return {category: found[category] for category in keys if found.get(category)}
+
+    @staticmethod
+    def _serialize_memory(memory: dict) -> dict:
+        """ObjectId 和 datetime 转为字符串，便于写入提示词或返回给前端"""
+        memory_copy = memory.copy()
+        if "_id" in memory_copy:
+            memory_copy["_id"] = str(memory_copy["_id"])
+        if memory_copy.get("previous_version_id") is not None:
+            memory_copy["previous_version_id"] = str(memory_copy["previous_version_id"])
+        memory_copy["timestamp"] = format_timestamp(memory_copy.get("timestamp"))
+        return memory_copy
+
     def retrieve_memory_history(
         self,
         user_id: str,
         category: str,
-        memory_id: str
+        memory_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_archived: bool = False
     ) -> List[dict]:
         """
         获取特定记忆的历史版本
@@ -88,29 +156,68 @@ class MemoryRetrievalSystem:
             user_id: 用户ID
             category: 记忆类别
             memory_id: 记忆ID
+            since: 只返回该时间之后的版本
+            until: 只返回该时间之前的版本
+            include_archived: 是否包含已被压缩任务归档的旧版本
             
         Returns:
             List[dict]: 记忆的历史版本列表，按时间倒序排列
         """
-        collection = self.client[user_id][category]
-        history = []
-        current_id = memory_id
+        try:
+            history = self.db_system.get_memory_history(user_id, category, memory_id, since, until, include_archived)
+        except Exception as e:
+            print(f"Error retrieving memory history: {str(e)}")
+            return []
+
+        return [self._serialize_memory(memory) for memory in history]
+
+    def retrieve_memory_history_page(
+        self,
+        user_id: str,
+        category: str,
+        memory_id: str,
+        page: int = 1,
+        page_size: int = 20,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_archived: bool = False
+    ) -> Dict[str, Any]:
+        """
+        分页获取特定记忆的历史版本（供审计界面使用）
         
-        while current_id:
-            try:
-                memory = collection.find_one({"_id": current_id})
-                if memory:
-                    memory_copy = memory.copy()
-                    memory_copy["_id"] = str(memory_copy["_id"])
-                    history.append(memory_copy)
-                    current_id = memory.get('previous_version_id')
-                else:
-                    break
-            except Exception as e:
-                print(f"Error retrieving memory history: {str(e)}")
-                break
-                
-        return history
+        Returns:
+            Dict: {"items": 当前页的版本（从新到旧）, "total": 版本总数, "page": 页码, "page_size": 每页条数}
+        """
+        page = max(page, 1)
+        try:
+            result = self.db_system.get_memory_history_page(
+                user_id, category, memory_id, (page - 1) * page_size, page_size, since, until, include_archived
+            )
+        except Exception as e:
+            print(f"Error retrieving memory history page: {str(e)}")
+            return {"items": [], "total": 0, "page": page, "page_size": page_size}
+
+        return {
+            "items": [self._serialize_memory(memory) for memory in result["items"]],
+            "total": result["total"],
+            "page": page,
+            "page_size": page_size
+        }
+
+    @staticmethod
+    def format_memories_compact(memory_result: Dict[str, List[dict]]) -> str:
+        """
+        把检索结果渲染为写入 knowledge master 提示词的紧凑文本，每条记忆一行：[记忆ID] 时间 内容
+
+        只有一个类别时省略类别标题（当前类别已写在提示词中）；没有记忆时返回空字符串。
+        """
+        lines = []
+        for category, memories in memory_result.items():
+            if len(memory_result) > 1:
+                lines.append(f"{category}:")
+            for memory in memories:
+                lines.append(f"[{memory['_id']}] {format_timestamp(memory.get('timestamp')) or '-'} {memory['knowledge']}")
+        return "\n".join(lines)
 
     def parse_memory_result(self, memory_result: Dict[str, List[dict]]) -> Dict[str, List[MemoryInfo]]:
         """
@@ -0,0 +1,163 @@
+"""
+记忆存储迁移工具：每用户一个数据库 -> 单集合多租户存储
+
+迁移可以在线进行，步骤：
+    1. 服务保持 [MEMORY_STORE] LAYOUT = per_user 运行，执行一次或多次全量迁移:
+           python memory/migrate_memory_store.py
+    2. 将 LAYOUT 改为 collection 并重启服务
+    3. 再执行一次迁移，补齐切换前最后写入旧库的记忆，然后校验:
+           python memory/migrate_memory_store.py --verify
+    4. 确认无误后可删除旧的用户数据库:
+           python memory/migrate_memory_store.py --drop-legacy
+
+每条记忆沿用原来的 _id 写入新集合，重复执行是幂等的；is_latest 只会由 True 变为 False，
+因此旧库中被标记为非最新的记忆会同步到新集合，而新集合中切换后产生的更新不会被覆盖。
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from memory.unified_memory_system import ExplicitCategory, ImplicitCategory
+from utils.mongo_pool import get_mongo_client
+from utils.mongodb_patient_info_system import MongoDBPatientInfoSystem, parse_timestamp, knowledge_hash, to_object_id
+from load_config import MONGODB_DB_NAME, MEMORY_STORE_DB_NAME
+
+MIGRATION_COLLECTION = "memory_migrations"
+SYSTEM_DATABASES = {"admin", "local", "config"}
+# benchmark_memory_store.py 生成的旧布局测试库
+BENCHMARK_DB_PREFIX = "memory_bench_"
+MEMORY_CATEGORIES = set(ExplicitCategory._value2member_map_) | set(ImplicitCategory._value2member_map_)
+
+
+def find_legacy_users(client, users: Optional[List[str]] = None) -> List[str]:
+    """旧布局中的用户数据库：除系统库和业务库外、集合名全部是记忆类别的数据库"""
+    if users:
+        return users
+    skip = SYSTEM_DATABASES | {MONGODB_DB_NAME, MEMORY_STORE_DB_NAME}
+    legacy_users = []
+    for db_name in client.list_database_names():
+        if db_name in skip or db_name.startswith(BENCHMARK_DB_PREFIX):
+            continue
+        collections = set(client[db_name].list_collection_names())
+        if collections and collections <= MEMORY_CATEGORIES:
+            legacy_users.append(db_name)
+    return legacy_users
+
+
+def to_shared_document(doc: Dict, user_id: str, category: str) -> Dict:
+    document = dict(doc)
+    document["user_id"] = user_id
+    document["category"] = category
+    document["timestamp"] = parse_timestamp(doc.get("timestamp"))
+    document["knowledge_hash"] = knowledge_hash(doc.get("knowledge"))
+    if doc.get("previous_version_id"):
+        document["previous_version_id"] = to_object_id(doc["previous_version_id"])
+    return document
+
+
+def migration_ops(docs: List[Dict], user_id: str, category: str) -> List[UpdateOne]:
+    ops = []
+    for doc in docs:
+        document = to_shared_document(doc, user_id, category)
+        is_latest = document.pop("is_latest", True)
+        if is_latest:
+            update = {"$setOnInsert": {**document, "is_latest": True}}
+        else:
+            update = {"$setOnInsert": document, "$set": {"is_latest": False}}
+        ops.append(UpdateOne({"_id": doc["_id"]}, update, upsert=True))
+    return ops
+
+
+def migrate_user(client, store: MongoDBPatientInfoSystem, user_id: str, batch_size: int) -> Dict[str, int]:
+    stats = {"documents": 0, "inserted": 0, "updated": 0}
+    user_db = client[user_id]
+    for category in user_db.list_collection_names():
+        batch = []
+        for doc in user_db[category].find(batch_size=batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                _write(store, batch, user_id, category, stats)
+                batch = []
+        if batch:
+            _write(store, batch, user_id, category, stats)
+    return stats
+
+
+def _write(store: MongoDBPatientInfoSystem, batch: List[Dict], user_id: str, category: str, stats: Dict[str, int]):
+    result = store.collection.bulk_write(migration_ops(batch, user_id, category), ordered=False)
+    stats["documents"] += len(batch)
+    stats["inserted"] += result.upserted_count
+    stats["updated"] += result.modified_count
+
+
+def verify_user(client, store: MongoDBPatientInfoSystem, user_id: str) -> Dict[str, int]:
+    legacy = sum(client[user_id][category].count_documents({}) for category in client[user_id].list_collection_names())
+    legacy_ids = [doc["_id"] for category in client[user_id].list_collection_names()
+                  for doc in client[user_id][category].find({}, {"_id": 1})]
+    migrated = store.collection.count_documents({"user_id": user_id, "_id": {"$in": legacy_ids}}) if legacy_ids else 0
+    return {"legacy": legacy, "migrated": migrated}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆存储迁移：每用户一个数据库 -> 单集合")
+    parser.add_argument("--users", nargs="*", default=None, help="只迁移指定用户（默认自动发现全部旧用户数据库）")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--verify", action="store_true", help="迁移后校验每个用户的记忆数量")
+    parser.add_argument("--drop-legacy", action="store_true", help="校验通过后删除旧的用户数据库")
+    parser.add_argument("--backfill-hashes", action="store_true", help="为新集合中缺少 knowledge_hash 的记忆补写哈希后退出")
+    parser.add_argument("--normalize-version-ids", action="store_true",
+                        help="把新集合中字符串形式的 previous_version_id 转换为 ObjectId 后退出")
+    args = parser.parse_args()
+
+    client = get_mongo_client()
+    store = MongoDBPatientInfoSystem()
+    markers = client[MEMORY_STORE_DB_NAME][MIGRATION_COLLECTION]
+
+    if args.backfill_hashes or args.normalize_version_ids:
+        if args.backfill_hashes:
+            print(f"补写 knowledge_hash: {store.backfill_knowledge_hashes(args.batch_size)} 条")
+        if args.normalize_version_ids:
+            print(f"转换 previous_version_id: {store.normalize_version_ids(args.batch_size)} 条")
+        return
+
+    users = find_legacy_users(client, args.users)
+    print(f"发现 {len(users)} 个旧布局用户数据库")
+
+    start = time.perf_counter()
+    totals = {"documents": 0, "inserted": 0, "updated": 0}
+    failed = []
+    for i, user_id in enumerate(users, 1):
+        stats = migrate_user(client, store, user_id, args.batch_size)
+        for key in totals:
+            totals[key] += stats[key]
+
+        marker = {"migrated_at": datetime.now(), **stats}
+        if args.verify or args.drop_legacy:
+            check = verify_user(client, store, user_id)
+            marker["verified"] = check["legacy"] == check["migrated"]
+            if not marker["verified"]:
+                failed.append(user_id)
+                print(f"校验失败 - 用户: {user_id}, 旧库: {check['legacy']}, 新集合: {check['migrated']}")
+            elif args.drop_legacy:
+                client.drop_database(user_id)
+                marker["legacy_dropped"] = True
+        markers.update_one({"_id": user_id}, {"$set": marker}, upsert=True)
+
+        if i % 100 == 0 or i == len(users):
+            elapsed = time.perf_counter() - start
+            print(f"[{i}/{len(users)}] 记忆 {totals['documents']} 条, 新增 {totals['inserted']}, "
+                  f"同步 is_latest {totals['updated']}, {totals['documents'] / elapsed if elapsed else 0:.0f} docs/s")
+
+    print(f"迁移完成: 用户 {len(users)}, 记忆 {totals['documents']} 条, 用时 {time.perf_counter() - start:.1f}s")
+    if failed:
+        print(f"{len(failed)} 个用户校验失败，未删除其旧数据库: {failed[:20]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from utils.token_estimate import estimate_tokens
+from utils.mongo_pool import get_mongo_client
+from utils.mongodb_patient_info_system import MemoryWrite, format_timestamp, get_patient_info_system
+from load_config import (
+    MEMORY_STORE_DB_NAME,
+    PATIENT_CONTEXT_ENABLED,
+    PATIENT_CONTEXT_COLLECTION,
+    PATIENT_CONTEXT_TOKEN_BUDGET,
+    PATIENT_CONTEXT_MIN_CONFIDENCE,
+    PATIENT_CONTEXT_MAX_PER_CATEGORY
+)
+
+# 系统提示中患者档案片段的起始标记，重建会话时据此替换旧片段
+CONTEXT_PACK_MARKER = "【患者档案】"
+CONTEXT_PACK_HEADER = (
+    f"{CONTEXT_PACK_MARKER}以下是根据该用户既往记忆整理的档案，可直接作为背景知识使用，"
+    "无需为这些内容调用 memory_retrieve；只有需要档案中没有的细节时再调用该工具。"
+)
+
+
+def _pack_entry(category: str, memory: Dict[str, Any], timestamp: Optional[datetime] = None) -> Dict[str, Any]:
+    return {
+        "category": category,
+        "knowledge": memory.get("knowledge"),
+        "confidence": memory.get("confidence"),
+        "timestamp": timestamp or memory.get("timestamp"),
+    }
+
+
+class PatientContextPackStore:
+    """
+    每个用户一份的患者档案文档：{_id: user_id, memories: {记忆ID: {category, knowledge, confidence, timestamp}}}
+
+    记忆系统每次批量写入后以一次 update_one 增量更新（新版本写入、被更新的旧版本移除）；
+    档案不存在或只由增量写入创建（complete 为 False）时，从记忆库的最新记忆完整重建一次。
+    会话开始时 render 为限定 token 数的提示词片段，大多数轮次不再需要调用记忆检索工具。
+    """
+
+    def __init__(
+        self,
+        collection=None,
+        token_budget: int = PATIENT_CONTEXT_TOKEN_BUDGET,
+        min_confidence: float = PATIENT_CONTEXT_MIN_CONFIDENCE,
+        max_per_category: int = PATIENT_CONTEXT_MAX_PER_CATEGORY
+    ):
+        self.collection = collection if collection is not None else get_mongo_client()[MEMORY_STORE_DB_NAME][PATIENT_CONTEXT_COLLECTION]
+        self.token_budget = token_budget
+        self.min_confidence = min_confidence
+        self.max_per_category = max_per_category
+        self._lock = threading.Lock()
+        self.incremental_updates = 0
+        self.rebuilds = 0
+        self.renders = 0
+        self.rendered_tokens = 0
+        self.failures = 0
+
+    def apply_writes(self, user_id: str, writes: List[MemoryWrite], inserted_ids: List[Any]):
+        """把一批记忆写入合并进档案：新版本加入，被更新的旧版本移除（同一批多次更新同一条记忆时只保留最后一版）"""
+        if not PATIENT_CONTEXT_ENABLED or not writes:
+            return
+        now = datetime.now()
+        set_fields = {}
+        replaced = {}
+        for write, memory_id in zip(writes, inserted_ids):
+            if memory_id is None:
+                continue
+            set_fields[f"memories.{memory_id}"] = _pack_entry(write.category, write.memory, now)
+            if write.previous_id is not None:
+                previous_id = str(write.previous_id)
+                if previous_id in replaced:
+                    set_fields.pop(f"memories.{replaced[previous_id]}", None)
+                replaced[previous_id] = str(memory_id)
+        update = {
+            "$set": {**set_fields, "updated_at": now},
+            "$setOnInsert": {"complete": False},
+        }
+        if replaced:
+            update["$unset"] = {f"memories.{previous_id}": "" for previous_id in replaced}
+        try:
+            self.collection.update_one({"_id": user_id}, update, upsert=True)
+        except Exception as e:
+            # 档案只是记忆库的派生数据，更新失败不影响记忆写入，下次重建时修正
+            self._count("failures")
+            print(f"患者档案增量更新失败，稍后重建: {str(e)}")
+            return
+        self._count("incremental_updates")
+
+    def rebuild(self, user_id: str, db_system=None) -> Dict[str, Any]:
+        """从记忆库的最新记忆完整重建档案（压缩任务修改记忆后、或档案缺失时调用）"""
+        db_system = db_system or get_patient_info_system()
+        latest = db_system.get_latest_memories(user_id)
+        pack = {
+            "_id": user_id,
+            "memories": {
+                str(memory["_id"]): _pack_entry(category, memory)
+                for category, items in latest.items()
+                for memory in items
+                if memory.get("knowledge")
+            },
+            "complete": True,
+            "updated_at": datetime.now(),
+        }
+        self.collection.replace_one({"_id": user_id}, pack, upsert=True)
+        self._count("rebuilds")
+        return pack
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        pack = self.collection.find_one({"_id": user_id})
+        if pack is None or not pack.get("complete"):
+            pack = self.rebuild(user_id)
+        return pack
+
+    def render(self, pack: Dict[str, Any], token_budget: Optional[int] = None) -> str:
+        """
+        把档案渲染为提示词片段，不超过 token_budget 个估计 token
+
+        置信度高、时间新的记忆优先入选，每个类别最多 max_per_category 条；
+        输出按类别分行，类别顺序为其首条入选记忆的顺序。没有可用记忆时返回空字符串。
+        """
+        token_budget = self.token_budget if token_budget is None else token_budget
+        entries = [
+            entry for entry in (pack.get("memories") or {}).values()
+            if entry.get("knowledge") and (entry.get("confidence") is None or entry["confidence"] >= self.min_confidence)
+        ]
+        entries.sort(key=lambda entry: format_timestamp(entry.get("timestamp")) or "", reverse=True)
+        entries.sort(key=lambda entry: entry.get("confidence") if entry.get("confidence") is not None else 1.0, reverse=True)
+
+        used = estimate_tokens(CONTEXT_PACK_HEADER)
+        selected: Dict[str, List[str]] = {}
+        for entry in entries:
+            items = selected.get(entry["category"], [])
+            if len(items) >= self.max_per_category:
+                continue
+            # 新类别多占一行标题
+            cost = estimate_tokens(entry["knowledge"]) + (1 if items else estimate_tokens(entry["category"]) + 2)
+            if used + cost > token_budget:
+                continue
+            used += cost
+            selected.setdefault(entry["category"], items).append(entry["knowledge"])
+        if not selected:
+            return ""
+
+        lines = [CONTEXT_PACK_HEADER] + [f"{category}：{'；'.join(items)}" for category, items in selected.items()]
+        with self._lock:
+            self.renders += 1
+            self.rendered_tokens += used
+        return "\n".join(lines)
+
+    def fragment(self, user_id: str, token_budget: Optional[int] = None) -> str:
+        """返回该用户的患者档案提示词片段；读取失败时返回空字符串，模型仍可调用记忆检索工具"""
+        try:
+            return self.render(self.get(user_id), token_budget)
+        except Exception as e:
+            self._count("failures")
+            print(f"患者档案读取失败，本次会话不注入: {str(e)}")
+            return ""
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "enabled": PATIENT_CONTEXT_ENABLED,
+                "incremental_updates": self.incremental_updates,
+                "rebuilds": self.rebuilds,
+                "renders": self.renders,
+                "avg_rendered_tokens": self.rendered_tokens / self.renders if self.renders else 0.0,
+                "failures": self.failures,
+            }
+
+
+def attach_context_pack(system_prompt: str, fragment: str) -> str:
+    """把档案片段附加到系统提示末尾，已有的旧片段（会话重建时）先去掉"""
+    base = system_prompt.split(CONTEXT_PACK_MARKER, 1)[0].rstrip()
+    return f"{base}\n\n{fragment}" if fragment else base
+
+
+_context_pack_store: Optional[PatientContextPackStore] = None
+_context_pack_store_lock = threading.Lock()
+
+
+def get_context_pack_store() -> PatientContextPackStore:
+    """返回进程内共享的患者档案存储"""
+    global _context_pack_store
+    with _context_pack_store_lock:
+        if _context_pack_store is None:
+            _context_pack_store = PatientContextPackStore()
+        return _context_pack_store
@@ -0,0 +1,158 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from memory.memory_matcher import get_memory_embeddings
+from utils.memory_cache import memory_generation
+from load_config import MEMORY_EMBED_ON_WRITE, MEMORY_INDEX_MAX_USERS, MEMORY_INDEX_TTL_SECONDS
+
+
+def embed_memory_writes(writes: List[Any]):
+    """写入前为一批 MemoryWrite 计算 knowledge 向量（一次批量嵌入请求），保存在记忆文档的 embedding 字段"""
+    if not MEMORY_EMBED_ON_WRITE:
+        return
+    pending = [write for write in writes if write.memory.get("knowledge")]
+    if not pending:
+        return
+    try:
+        vectors = get_memory_embeddings().embed_documents([write.memory["knowledge"] for write in pending])
+    except Exception as e:
+        # 嵌入失败不影响记忆写入，缺少向量的记忆会在建索引时补齐
+        print(f"记忆向量计算失败，稍后建索引时补齐: {str(e)}")
+        return
+    for write, vector in zip(pending, vectors):
+        # 不修改调用方的工具输入（它还会作为本轮新记忆返回），只替换为带向量的副本
+        write.memory = {**write.memory, "embedding": list(vector)}
+
+
+def normalize_vectors(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    faiss.normalize_L2(matrix)
+    return matrix
+
+
+class UserMemoryIndex:
+    """单个用户全部最新记忆的内积索引（向量已归一化，内积即余弦相似度）"""
+
+    def __init__(self, memories: List[Dict[str, Any]], vectors: np.ndarray, generation: int):
+        self.memories = memories
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.index = faiss.IndexFlatIP(vectors.shape[1])
+        self.index.add(vectors)
+
+    def search(self, query_vector: np.ndarray, k: int) -> List[Tuple[float, Dict[str, Any]]]:
+        k = min(k, self.index.ntotal)
+        if k <= 0:
+            return []
+        scores, ids = self.index.search(query_vector, k)
+        return [(float(score), self.memories[i]) for score, i in zip(scores[0], ids[0]) if i >= 0]
+
+
+class SemanticMemoryIndex:
+    """
+    按用户懒加载的记忆向量索引
+
+    首次检索时从记忆库读取该用户的最新记忆及其向量建索引（缺失的向量批量计算并写回），
+    用户记忆写入后（失效代数变化）或超过 TTL 时重建；最多保留 max_users 个用户的索引，按 LRU 淘汰。
+    """
+
+    def __init__(self, db_system, max_users: int = MEMORY_INDEX_MAX_USERS, ttl_seconds: float = MEMORY_INDEX_TTL_SECONDS):
+        self.db_system = db_system
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._indexes: "OrderedDict[str, UserMemoryIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.backfilled = 0
+
+    def get(self, user_id: str) -> Optional[UserMemoryIndex]:
+        generation = memory_generation(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.generation == generation \
+                    and time.monotonic() - index.built_at < self.ttl_seconds:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        index = self._build(user_id, generation)
+        with self._lock:
+            if index is None:
+                self._indexes.pop(user_id, None)
+                return None
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _build(self, user_id: str, generation: int) -> Optional[UserMemoryIndex]:
+        latest = self.db_system.get_latest_memories(user_id, include_embeddings=True)
+        memories = [
+            {**memory, "category": memory.get("category", category)}
+            for category, items in latest.items()
+            for memory in items
+            if memory.get("knowledge")
+        ]
+        if not memories:
+            return None
+
+        missing = [memory for memory in memories if not memory.get("embedding")]
+        if missing:
+            vectors = get_memory_embeddings().embed_documents([memory["knowledge"] for memory in missing])
+            for memory, vector in zip(missing, vectors):
+                memory["embedding"] = list(vector)
+            self.db_system.set_memory_embeddings(
+                user_id, [(memory["category"], memory["_id"], memory["embedding"]) for memory in missing]
+            )
+            self.backfilled += len(missing)
+
+        vectors = normalize_vectors([memory.pop("embedding") for memory in memories])
+        self.builds += 1
+        return UserMemoryIndex(memories, vectors, generation)
+
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        top_k: int,
+        categories: Optional[List[str]] = None
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """返回与 query 最相关的 top_k 条最新记忆 [(相似度, 记忆)]，按相似度降序"""
+        index = self.get(user_id)
+        if index is None:
+            return []
+        query_vector = normalize_vectors(get_memory_embeddings().embed_query(query))
+        if categories is None:
+            return index.search(query_vector, top_k)
+        # 单个用户的记忆量不大，按类别过滤时检索全部再截取
+        allowed = set(categories)
+        results = [item for item in index.search(query_vector, index.index.ntotal) if item[1]["category"] in allowed]
+        return results[:top_k]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"users": len(self._indexes), "builds": self.builds, "backfilled": self.backfilled}
+
+
+_semantic_index: Optional[SemanticMemoryIndex] = None
+_semantic_index_lock = threading.Lock()
+
+
+def get_semantic_index() -> SemanticMemoryIndex:
+    """返回进程内共享的语义记忆索引"""
+    global _semantic_index
+    with _semantic_index_lock:
+        if _semantic_index is None:
+            from utils.mongodb_patient_info_system import get_patient_info_system
+            _semantic_index = SemanticMemoryIndex(get_patient_info_system())
+        return _semantic_index
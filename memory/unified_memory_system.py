@@ -2,6 +2,7 @@ import rootutils
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
 import json
+import asyncio
 from enum import Enum
 from datetime import datetime
 from typing import Dict, List, TypedDict, Sequence, Optional, Any
@@ -21,77 +22,16 @@ from langchain.prompts import (
 
 from prompts import memory_prompt
 from memory.memory_retrieve import MemoryRetrievalSystem
-from load_config import CHAT_MODEL, API_KEY, MONGODB_HOST, MONGODB_PORT
-from pymongo import MongoClient
+from memory.memory_matcher import MemoryUpdateMatcher
+from memory.semantic_memory_index import embed_memory_writes
+from memory.patient_context_pack import get_context_pack_store
+from load_config import CHAT_MODEL, API_KEY
+from utils.mongodb_patient_info_system import get_patient_info_system, MemoryWrite
 
 class MemoryType(str, Enum):
     EXPLICIT = "explicit"
     IMPLICIT = "implicit"
 
-class MongoDBPatientInfoSystem:
-    def __init__(self, connection_string: str):
-        self.client = MongoClient(connection_string)
-
-    def get_user_db(self, user_id: str):
-        return self.client[user_id]
-
-    def get_category_collection(self, user_id: str, category: str):
-        db = self.get_user_db(user_id)
-        return db[category]
-
-    def add_memory(self, user_id: str, category: str, memory: Dict[str, Any]):
-        collection = self.get_category_collection(user_id, category)
-        memory['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        memory['is_latest'] = True
-        result = collection.insert_one(memory)
-        return result.inserted_id
-
-    def update_memory(self, user_id: str, category: str, memory_id: str, updated_memory: Dict[str, Any]):
-        collection = self.get_category_collection(user_id, category)
-        original_memory = collection.find_one({"_id": memory_id})
-        if not original_memory:
-            return None
-            
-        collection.update_one(
-            {"_id": memory_id},
-            {"$set": {"is_latest": False}}
-        )
-
-        updated_memory['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        updated_memory['previous_version_id'] = str(memory_id)
-        updated_memory['is_latest'] = True
-        
-        result = collection.insert_one(updated_memory)
-        return result.inserted_id
-
-    def get_memories(self, user_id: str, category: str, include_history: bool = False):
-        collection = self.get_category_collection(user_id, category)
-        if include_history:
-            return list(collection.find().sort("timestamp", -1))
-        else:
-            query = {
-                "$or": [
-                    {"action": "创建"},
-                    {"$and": [{"action": "更新"}, {"is_latest": True}]}
-                ]
-            }
-            return list(collection.find(query))
-
-    def get_memory_history(self, user_id: str, category: str, memory_id: str) -> List[Dict[str, Any]]:
-        collection = self.get_category_collection(user_id, category)
-        history = []
-        current_id = memory_id
-        
-        while current_id:
-            memory = collection.find_one({"_id": current_id})
-            if memory:
-                history.append(memory)
-                current_id = memory.get('previous_version_id')
-            else:
-                break
-                
-        return history
-
 class ExplicitCategory(str, Enum):
     DEMOGRAPHIC_INFO = "人口学信息"
     CHIEF_COMPLAINT = "主诉"
@@ -109,6 +49,7 @@ class ImplicitCategory(str, Enum):
     COGNITIVE = "认知特征"
     HISTORY = "历史信息"
     PERSONALITY = "人格特质"
+    STRESS = "压力状态"
 
 class Action(str, Enum):
     Create = "创建"
@@ -173,19 +114,32 @@ class AgentState(TypedDict):
     contains_information: Optional[str]
 
 class BaseMemorySystem:
-    def __init__(self, memory_type: MemoryType):
+    """
+    sentinel + knowledge master 记忆系统
+
+    sentinel 判定消息涉及的记忆类别，knowledge master 结合该类别已有记忆调用工具创建或更新记忆。
+    显式、隐式记忆系统只在记忆类型（决定提示词和类别）和工具参数上不同。
+    """
+
+    def __init__(self, memory_type: Optional[MemoryType], agent_tools: Optional[List[StructuredTool]] = None):
+        """memory_type 为 None 时（如 UnifiedMemorySystem）只初始化记忆存储和工具，不构建 sentinel 和 knowledge master"""
         self.memory_type = memory_type
-        self.db_system = MongoDBPatientInfoSystem(f"mongodb://{MONGODB_HOST}:{MONGODB_PORT}/")
-        self.agent_tools = [tool_modify_patient_knowledge]
+        self.db_system = get_patient_info_system()
+        self.update_matcher = MemoryUpdateMatcher(self.db_system)
+        self.agent_tools = agent_tools or [tool_modify_patient_knowledge]
         self.tool_executor = ToolExecutor(self.agent_tools)
-        self.category_enum = ExplicitCategory if memory_type == MemoryType.EXPLICIT else ImplicitCategory
-        
+        if memory_type is not None:
+            self._init_runnables(memory_type)
+
+    def _init_runnables(self, memory_type: MemoryType):
+        self.category_enum = get_category_enum(memory_type)
+
         sentinel_template = (
             memory_prompt.explicit_initial_sentinel_prompt()
             if memory_type == MemoryType.EXPLICIT
             else memory_prompt.implicit_initial_sentinel_prompt()
         )
-        knowledge_master_template = (
+        self.knowledge_master_template = (
             memory_prompt.explicit_initial_knowledge_master_prompt()
             if memory_type == MemoryType.EXPLICIT
             else memory_prompt.implicit_initial_knowledge_master_prompt()
@@ -195,11 +149,6 @@ class BaseMemorySystem:
             SystemMessagePromptTemplate.from_template(sentinel_template),
             MessagesPlaceholder(variable_name="messages"),
         ])
-        knowledge_master_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(knowledge_master_template),
-            MessagesPlaceholder(variable_name="messages"),
-            SystemMessagePromptTemplate.from_template("现有的记忆：{memories}"),
-        ])
 
         tools = [convert_to_openai_function(t) for t in self.agent_tools]
 
@@ -208,12 +157,40 @@ class BaseMemorySystem:
             model=CHAT_MODEL,
             api_key=API_KEY,
         )
-        self.knowledge_master_runnable = knowledge_master_prompt | ChatOpenAI(
+        self.knowledge_master_llm = ChatOpenAI(
             temperature=0.5,
             model=CHAT_MODEL,
             api_key=API_KEY,
         ).bind_tools(tools)
 
+    def _knowledge_master_runnable(self, category: str):
+        # 基础提示词中已有 {memories} 占位符，这里只补充当前类别和记忆行格式
+        knowledge_master_prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(
+                self.knowledge_master_template + "\n" +
+                f"当前类别：{category}\n" +
+                "已有记忆每行格式：[记忆ID] 时间 内容；更新某条记忆时把其记忆ID填入 previous_version_id"
+            ),
+            MessagesPlaceholder(variable_name="messages")
+        ])
+        return knowledge_master_prompt | self.knowledge_master_llm
+
+    def _load_memories(self, user_id: str, category: str, query: Optional[str] = None) -> str:
+        """只取 sentinel 判定的类别的记忆，按行紧凑渲染"""
+        retrieval_system = MemoryRetrievalSystem()
+        memories = retrieval_system.retrieve_memories(user_id, [category], query)
+        return retrieval_system.format_memories_compact(memories)
+
+    def _handle_knowledge_master_response(self, user_id: str, category: str, response):
+        if "tool_calls" in response.additional_kwargs:
+            new_memories = self.process_tool_calls(
+                user_id,
+                category,
+                response.additional_kwargs["tool_calls"]
+            )
+            return new_memories if new_memories else f"无{self.memory_type.value}记忆记录"
+        return f"无{self.memory_type.value}记忆记录"
+
     def process_user_input(self, user_id: str, conversation_history: List[str]):
         messages = [HumanMessage(content=msg) for msg in conversation_history]
         
@@ -222,51 +199,35 @@ class BaseMemorySystem:
         print(f"Sentinel响应: {response.content}")
         contains_information = parse_sentinel_response(response.content, self.memory_type)
         print(f"解析结果: {contains_information}")
+        if not contains_information:
+            return f"无{self.memory_type.value}记忆记录"
+
+        memories = self._load_memories(user_id, contains_information, "\n".join(conversation_history))
+        response = self._knowledge_master_runnable(contains_information).invoke({
+            "messages": messages,
+            "memories": memories if memories else "（该类别暂无记忆）"
+        })
+        return self._handle_knowledge_master_response(user_id, contains_information, response)
+
+    async def aprocess_user_input(self, user_id: str, conversation_history: List[str]):
+        """process_user_input 的异步版本：LLM 调用使用 ainvoke，数据库读写放到线程池中执行，不阻塞事件循环"""
+        messages = [HumanMessage(content=msg) for msg in conversation_history]
 
-        if contains_information:
-            retrieval_system = MemoryRetrievalSystem()
-            categories = list(self.category_enum._value2member_map_.keys())
-            memories = retrieval_system.retrieve_memories_by_categories(categories)
-            memories = json.dumps(memories, ensure_ascii=False, default=str)
-            print(memories)
-
-            knowledge_master_prompt = ChatPromptTemplate.from_messages([
-                SystemMessagePromptTemplate.from_template(
-                    (memory_prompt.explicit_initial_knowledge_master_prompt() 
-                     if self.memory_type == MemoryType.EXPLICIT 
-                     else memory_prompt.implicit_initial_knowledge_master_prompt()) + "\n" +
-                    f"当前类别：{contains_information}\n" +
-                    "已有记忆：{memories}"
-                ),
-                MessagesPlaceholder(variable_name="messages")
-            ])
-            
-            self.knowledge_master_runnable = knowledge_master_prompt | ChatOpenAI(
-                temperature=0.5,
-                model=CHAT_MODEL,
-                api_key=API_KEY,
-            ).bind_tools([convert_to_openai_function(t) for t in self.agent_tools])
-            
-            response = self.knowledge_master_runnable.invoke({
-                "messages": messages,
-                "memories": memories if memories else "（该类别暂无记忆）"
-            })
-            messages.append(response)
-            last_message = messages[-1]
-
-            if "tool_calls" in last_message.additional_kwargs:
-                new_memories = self.process_tool_calls(
-                    user_id, 
-                    contains_information,
-                    last_message.additional_kwargs["tool_calls"]
-                )
-                return new_memories if new_memories else f"无{self.memory_type.value}记忆记录"
-            else:
-                return f"无{self.memory_type.value}记忆记录"
-        return f"无{self.memory_type.value}记忆记录"
+        response = await self.sentinel_runnable.ainvoke({"messages": messages})
+        contains_information = parse_sentinel_response(response.content, self.memory_type)
+        if not contains_information:
+            return f"无{self.memory_type.value}记忆记录"
+
+        memories = await asyncio.to_thread(self._load_memories, user_id, contains_information, "\n".join(conversation_history))
+        response = await self._knowledge_master_runnable(contains_information).ainvoke({
+            "messages": messages,
+            "memories": memories if memories else "（该类别暂无记忆）"
+        })
+        return await asyncio.to_thread(self._handle_knowledge_master_response, user_id, contains_information, response)
 
     def process_tool_calls(self, user_id: str, category: str, tool_calls):
         new_memories = []
+        writes = []
         for tool_call in tool_calls:
             action = ToolInvocation(
                 tool=tool_call["function"]["name"],
@@ -277,45 +238,187 @@ class BaseMemorySystem:
             
             if isinstance(action.tool_input, dict):
                 new_memories.append(action.tool_input)
-                self.handle_tool_response(user_id, response_dict, action.tool_input)
+                write = self.plan_memory_write(user_id, response_dict, action.tool_input)
+                if write:
+                    writes.append(write)
+        self.write_memories(user_id, writes)
         return new_memories
 
     def handle_tool_response(self, user_id: str, response_dict, tool_input):
+        write = self.plan_memory_write(user_id, response_dict, tool_input)
+        if write:
+            self.write_memories(user_id, [write])
+
+    def plan_memory_write(self, user_id: str, response_dict, tool_input) -> Optional[MemoryWrite]:
+        """把一次工具调用转换为待写入的记忆，实际写入由 write_memories 批量完成"""
         if response_dict["status"] == "Success":
             action = tool_input.get('action')
             category = tool_input.get('category')
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            tool_input['timestamp'] = current_time
+            tool_input['timestamp'] = current_time  # 确保工具输入中也包含时间戳
             
             if action == Action.Create:
-                self.db_system.add_memory(user_id, category, tool_input)
-                print(f"[{current_time}] 成功创建新知识: {tool_input['knowledge']}")
+                return MemoryWrite(category, tool_input)
             elif action == Action.Update:
                 if 'knowledge_old' in tool_input:
-                    self.update_existing_memory(user_id, category, tool_input)
-                else:
-                    print(f"[{current_time}] 警告: 尝试更新不存在的知识。将其作为新知识添加。")
-                    self.db_system.add_memory(user_id, category, tool_input)
+                    return self.plan_memory_update(user_id, category, tool_input)
+                print(f"[{current_time}] 警告: 尝试更新不存在的知识。将其作为新知识添加。")
+                return MemoryWrite(category, tool_input)
         else:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 处理知识时出错: {response_dict['message']}")
+        return None
+
+    def plan_memory_update(self, user_id: str, category: str, memory: Dict[str, Any]) -> MemoryWrite:
+        existing_memory = self.update_matcher.resolve(
+            user_id, category, memory.get('knowledge_old'), memory.get('previous_version_id')
+        )
+        if existing_memory:
+            # 作为原记忆的新版本写入
+            return MemoryWrite(category, memory, previous_id=existing_memory['_id'])
 
-    def update_existing_memory(self, user_id: str, category: str, memory: Dict[str, Any]):
-        memories = self.db_system.get_memories(user_id, category)
-        for existing_memory in memories:
-            if existing_memory['knowledge'] == memory.get('knowledge_old'):
-                new_memory_id = self.db_system.update_memory(
-                    user_id, 
-                    category, 
-                    existing_memory['_id'], 
-                    memory
-                )
-                if new_memory_id:
-                    print(f"[{memory.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}] "
-                        f"成功更新知识: {memory['knowledge']} (版本ID: {new_memory_id})")
-                    return
-                
         print(f"警告: 未找到要更新的知识。将其作为新知识添加。")
-        self.db_system.add_memory(user_id, category, memory)
+        return MemoryWrite(category, memory)
+
+    def write_memories(self, user_id: str, writes: List[MemoryWrite]):
+        if not writes:
+            return
+        embed_memory_writes(writes)
+        result = self.db_system.write_memories(user_id, writes)
+        get_context_pack_store().apply_writes(user_id, writes, result.inserted_ids)
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for write, memory_id in zip(writes, result.inserted_ids):
+            if write.previous_id is not None:
+                print(f"[{current_time}] 成功更新知识: {write.memory['knowledge']} (版本ID: {memory_id})")
+            else:
+                print(f"[{current_time}] 成功创建新知识: {write.memory['knowledge']}")
+        print(f"[{current_time}] 批量写入 {len(writes)} 条记忆，用时 {result.latency_ms:.1f}ms"
+              f"{'（事务）' if result.transaction else ''}")
+
+class ClassifiedKnowledge(BaseModel):
+    memory_type: MemoryType = Field(
+        ...,
+        description="explicit 表示患者明确陈述的事实，implicit 表示心理推断"
+    )
+    category: str = Field(
+        ...,
+        description="此知识所属的类别，必须属于 memory_type 对应的类别"
+    )
+    knowledge: str = Field(
+        ...,
+        description="要保存的患者知识的简洁表述",
+    )
+    knowledge_old: Optional[str] = Field(
+        None,
+        description="如果是更新记录，需要修改的完整、准确的原始短语",
+    )
+    previous_version_id: Optional[str] = Field(
+        None,
+        description="如果是更新记录，被修改记忆的记忆ID（已有记忆每行开头方括号中的ID）",
+    )
+    confidence: float = Field(
+        ...,
+        description="此信息的置信度，从 0.0 到 1.0",
+    )
+    action: Action = Field(
+        ...,
+        description="此知识是添加新记录还是更新记录",
+    )
+
+class MemoryClassification(BaseModel):
+    explicit_categories: List[ExplicitCategory] = Field(
+        default_factory=list,
+        description="消息中包含新信息的显式记忆类别，没有则为空"
+    )
+    implicit_categories: List[ImplicitCategory] = Field(
+        default_factory=list,
+        description="可以从消息中做出新推断的隐式记忆类别，没有则为空"
+    )
+    items: List[ClassifiedKnowledge] = Field(
+        default_factory=list,
+        description="需要创建或更新的记忆项"
+    )
+
+    def valid_items(self) -> List[ClassifiedKnowledge]:
+        """丢弃类别与记忆类型不匹配的记忆项"""
+        valid = []
+        for item in self.items:
+            category_enum = get_category_enum(item.memory_type)
+            if item.category in category_enum._value2member_map_:
+                valid.append(item)
+        return valid
+
+class UnifiedMemorySystem(BaseMemorySystem):
+    """
+    单次调用的记忆系统
+
+    用一次结构化输出调用同时得到显式/隐式记忆类别和待保存的记忆项，
+    取代显式、隐式各自的 sentinel + knowledge master（每轮最多四次 LLM 调用）。
+    """
+
+    def __init__(self):
+        super().__init__(None)
+        self.categories = list(ExplicitCategory._value2member_map_.keys()) + list(ImplicitCategory._value2member_map_.keys())
+
+        classifier_prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(memory_prompt.unified_memory_classifier_prompt()),
+            MessagesPlaceholder(variable_name="messages"),
+        ])
+        self.classifier_runnable = classifier_prompt | ChatOpenAI(
+            temperature=0,
+            model=CHAT_MODEL,
+            api_key=API_KEY,
+        ).with_structured_output(MemoryClassification, method="function_calling")
+
+    def _load_all_memories(self, user_id: str, query: Optional[str] = None) -> str:
+        """分类器需要判断记忆属于哪个类别，因此读取全部类别的记忆，按类别紧凑渲染（带记忆ID）"""
+        retrieval_system = MemoryRetrievalSystem()
+        memories = retrieval_system.retrieve_memories(user_id, self.categories, query)
+        return retrieval_system.format_memories_compact(memories)
+
+    def classify(self, user_id: str, conversation_history: List[str]) -> MemoryClassification:
+        messages = [HumanMessage(content=msg) for msg in conversation_history]
+        memories = self._load_all_memories(user_id, "\n".join(conversation_history))
+        return self.classifier_runnable.invoke({
+            "messages": messages,
+            "memories": memories if memories else "（暂无记忆）"
+        })
+
+    async def aclassify(self, user_id: str, conversation_history: List[str]) -> MemoryClassification:
+        messages = [HumanMessage(content=msg) for msg in conversation_history]
+        memories = await asyncio.to_thread(self._load_all_memories, user_id, "\n".join(conversation_history))
+        return await self.classifier_runnable.ainvoke({
+            "messages": messages,
+            "memories": memories if memories else "（暂无记忆）"
+        })
+
+    def save_classification(self, user_id: str, classification: MemoryClassification):
+        new_memories = []
+        writes = []
+        for item in classification.valid_items():
+            tool_input = item.model_dump(mode="json")
+            response_dict = modify_patient_knowledge(
+                knowledge=item.knowledge,
+                category=item.category,
+                confidence=item.confidence,
+                action=item.action.value,
+                knowledge_old=item.knowledge_old or "",
+                previous_version_id=item.previous_version_id,
+            )
+            write = self.plan_memory_write(user_id, response_dict, tool_input)
+            if write:
+                writes.append(write)
+            new_memories.append(tool_input)
+        # 显式、隐式记忆在同一次 bulk_write 中写入
+        self.write_memories(user_id, writes)
+        return new_memories if new_memories else "无记忆记录"
+
+    def process_user_input(self, user_id: str, conversation_history: List[str]):
+        classification = self.classify(user_id, conversation_history)
+        return self.save_classification(user_id, classification)
+
+    async def aprocess_user_input(self, user_id: str, conversation_history: List[str]):
+        classification = await self.aclassify(user_id, conversation_history)
+        return await asyncio.to_thread(self.save_classification, user_id, classification)
 
 def create_memory_system(memory_type: str) -> BaseMemorySystem:
     """Factory function to create the appropriate memory system"""
@@ -0,0 +1,225 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import random
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from utils.token_estimate import estimate_tokens
+
+# (doc_id, patient_id, text, content_hash)
+WorkItem = Tuple[str, str, str, str]
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "rate limit" in str(error).lower()
+
+
+class TokenBucket:
+    """
+    异步令牌桶：按固定速率补充令牌，不足时等待
+
+    每次按实际数量扣除令牌：超过桶内余量的请求让令牌变为负数（欠账），
+    并在持有锁的情况下等待欠账按速率补回，后续请求排在其后，长期速率不会超过 rate。
+    """
+
+    def __init__(self, rate_per_second: float, capacity: Optional[float] = None):
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else rate_per_second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        async with self._lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class AdaptiveBatchSizer:
+    """加性增大、乘性减小的批次大小控制器"""
+
+    def __init__(self, initial: int = 64, minimum: int = 8, maximum: int = 512, step: int = 16):
+        self.current = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+
+    def on_success(self):
+        self.current = min(self.maximum, self.current + self.step)
+
+    def on_throttle(self):
+        self.current = max(self.minimum, self.current // 2)
+
+
+@dataclass
+class IngestionReport:
+    documents: int = 0
+    tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failed_documents: int = 0
+    elapsed: float = 0.0
+    final_batch_size: int = 0
+    per_feature: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.documents / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"嵌入 {self.documents} 条 / {self.tokens} tokens, 用时 {self.elapsed:.1f}s, "
+            f"吞吐 {self.docs_per_second:.1f} docs/s, {self.tokens_per_second:.0f} tokens/s, "
+            f"批次 {self.batches}, 重试 {self.retries}, 限流 {self.throttled}, "
+            f"失败 {self.failed_documents}, 最终批次大小 {self.final_batch_size}"
+        )
+
+
+class EmbeddingIngestionPipeline:
+    """
+    并发批量嵌入流水线
+
+    所有特征的待嵌入条目进入同一个工作池：固定数量的 worker 轮流从各特征队列中
+    取出一个自适应大小的批次，经请求数和 token 数两个令牌桶限流后调用嵌入接口，
+    失败时指数退避重试；完成的批次交给单独的 writer 任务依次写入对应特征的向量库。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        write_batch: Callable[[str, List[WorkItem], List[List[float]]], None],
+        concurrency: int = 8,
+        requests_per_minute: float = 3000,
+        tokens_per_minute: float = 1000000,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
+        max_retries: int = 5,
+        base_backoff: float = 0.5,
+    ):
+        self.embeddings = embeddings
+        self.write_batch = write_batch
+        self.concurrency = concurrency
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, capacity=max(1.0, requests_per_minute / 60.0))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, capacity=tokens_per_minute / 60.0)
+        self.batch_sizer = batch_sizer or AdaptiveBatchSizer()
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.report = IngestionReport()
+
+    def _next_batch(self, queues: Dict[str, Deque[WorkItem]], order: Deque[str]) -> Optional[Tuple[str, List[WorkItem]]]:
+        while order:
+            feature = order[0]
+            order.rotate(-1)
+            queue = queues[feature]
+            if not queue:
+                order.remove(feature)
+                continue
+            size = self.batch_sizer.current
+            batch = [queue.popleft() for _ in range(min(size, len(queue)))]
+            # 估计 token 数超过 token 桶容量的批次拆小，超出的条目放回队首留给下一个批次
+            tokens = 0
+            for index, (_, _, text, _) in enumerate(batch):
+                tokens += estimate_tokens(text)
+                if tokens > self.token_bucket.capacity and index > 0:
+                    queue.extendleft(reversed(batch[index:]))
+                    batch = batch[:index]
+                    break
+            return feature, batch
+        return None
+
+    async def _embed_with_retry(self, texts: List[str]) -> Optional[List[List[float]]]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(tokens)
+            try:
+                vectors = await self.embeddings.aembed_documents(texts)
+                self.batch_sizer.on_success()
+                self.report.tokens += tokens
+                return vectors
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"嵌入批次失败（已重试 {attempt} 次）: {str(e)}")
+                    return None
+                self.report.retries += 1
+                if is_rate_limit_error(e):
+                    self.report.throttled += 1
+                    self.batch_sizer.on_throttle()
+                delay = self.base_backoff * (2 ** attempt) * (1 + random.random())
+                await asyncio.sleep(delay)
+        return None
+
+    async def _worker(self, queues, order, results: asyncio.Queue):
+        while True:
+            job = self._next_batch(queues, order)
+            if job is None:
+                return
+            feature, batch = job
+            vectors = await self._embed_with_retry([text for _, _, text, _ in batch])
+            if vectors is None:
+                self.report.failed_documents += len(batch)
+                continue
+            await results.put((feature, batch, vectors))
+
+    async def _writer(self, results: asyncio.Queue):
+        while True:
+            job = await results.get()
+            if job is None:
+                return
+            feature, batch, vectors = job
+            try:
+                await asyncio.to_thread(self.write_batch, feature, batch, vectors)
+            except Exception as e:
+                # 写入失败只计入失败文档，writer 继续消费，避免 worker 阻塞在已满的结果队列上
+                print(f"写入批次失败（{feature}，{len(batch)} 条）: {str(e)}")
+                self.report.failed_documents += len(batch)
+                continue
+            self.report.documents += len(batch)
+            self.report.batches += 1
+            self.report.per_feature[feature] = self.report.per_feature.get(feature, 0) + len(batch)
+
+    async def run(self, items_by_feature: Dict[str, List[WorkItem]]) -> IngestionReport:
+        queues = {feature: deque(items) for feature, items in items_by_feature.items() if items}
+        order = deque(queues.keys())
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        start = time.perf_counter()
+        writer = asyncio.create_task(self._writer(results))
+        workers = [asyncio.create_task(self._worker(queues, order, results)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            await results.put(None)
+            await writer
+            self.report.elapsed = time.perf_counter() - start
+            self.report.final_batch_size = self.batch_sizer.current
+        return self.report
+
+
+async def run_ingestion(
+    embeddings: Embeddings,
+    items_by_feature: Dict[str, List[WorkItem]],
+    write_batch: Callable[[str, List[WorkItem], List[List[float]]], None],
+    **kwargs,
+) -> IngestionReport:
+    pipeline = EmbeddingIngestionPipeline(embeddings, write_batch, **kwargs)
+    report = await pipeline.run(items_by_feature)
+    print(report.summary())
+    return report
@@ -0,0 +1,107 @@
+"""
+本地伪嵌入服务，兼容 OpenAI /v1/embeddings 接口
+
+用于在不消耗真实额度的情况下测试向量化流水线的并发、限流与重试：
+向量由输入文本哈希确定性生成，可配置响应延迟和随机 429 比例。
+
+用法:
+    python preprocess/fake_embedding_server.py --port 8089 --dim 256 --latency 0.2 --error-rate 0.05
+    python preprocess/vectorize.py --parallel --embedding-base-url http://127.0.0.1:8089/v1
+"""
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_vector(payload, dim: int):
+    seed = hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    dim = 256
+    latency = 0.0
+    error_rate = 0.0
+    stats = {"requests": 0, "inputs": 0, "throttled": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with self.lock:
+            self._send(200, dict(self.stats))
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        inputs = request.get("input", [])
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.stats["requests"] += 1
+            if random.random() < self.error_rate:
+                self.stats["throttled"] += 1
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+                return
+            self.stats["inputs"] += len(inputs)
+
+        data = []
+        for i, item in enumerate(inputs):
+            vector = fake_vector(item, self.dim)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        self._send(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地伪嵌入服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dim", type=int, default=256, help="向量维度")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 429 的比例")
+    args = parser.parse_args()
+
+    FakeEmbeddingHandler.dim = args.dim
+    FakeEmbeddingHandler.latency = args.latency
+    FakeEmbeddingHandler.error_rate = args.error_rate
+    server = ThreadingHTTPServer((args.host, args.port), FakeEmbeddingHandler)
+    print(f"伪嵌入服务已启动: http://{args.host}:{args.port}/v1/embeddings")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
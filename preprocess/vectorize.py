@@ -2,79 +2,344 @@ import rootutils
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
 import os
-from pymongo import MongoClient
-from langchain_core.documents import Document
+import sqlite3
+import asyncio
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from utils.mongo_pool import get_mongo_client
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
+from utils.embedding_cache import cached_embeddings
+from preprocess.embedding_pipeline import AdaptiveBatchSizer, IngestionReport, run_ingestion
 
 from load_config import (
-    API_KEY, 
-    MONGODB_HOST, 
-    MONGODB_PORT,  
-    MONGODB_DB_NAME, 
+    API_KEY,
+    MONGODB_DB_NAME,
     MONGODB_COLLECTION_NAME,
     MONGODB_FEATURES,
-    CASE_HISTORY_BASE_DIRECTOR
+    CASE_HISTORY_BASE_DIRECTOR,
+    EMBEDDING_INGEST_CONCURRENCY,
+    EMBEDDING_INGEST_REQUESTS_PER_MINUTE,
+    EMBEDDING_INGEST_TOKENS_PER_MINUTE,
+    EMBEDDING_INGEST_MAX_BATCH_SIZE
     )
 
 os.environ['OPENAI_API_KEY'] = API_KEY
 
+MANIFEST_FILENAME = "vectorize_manifest.sqlite"
+MANIFEST_PATH = os.path.join(CASE_HISTORY_BASE_DIRECTOR, MANIFEST_FILENAME)
+
+
+def feature_text(doc: Dict, feature: str) -> str:
+    """安全地获取特征值并转换为字符串"""
+    value = doc.get(feature, "")
+    return str(value) if value is not None else ""
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def override_directory(model: str, base_url: str) -> str:
+    """
+    自定义嵌入服务（如本地伪嵌入服务）的向量库和清单目录，按模型和服务地址区分
+
+    这些向量与生产向量的来源、维度都可能不同，不能写入生产目录：
+    否则清单会把相应病例记为已嵌入，之后的真实增量运行会跳过它们，向量库中也会混入不同维度的向量。
+    """
+    key = hashlib.sha256(f"{model}@{base_url}".encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CASE_HISTORY_BASE_DIRECTOR, "embedding_overrides", key)
+
+
+class VectorizeManifest:
+    """
+    记录每个 (patient_id, 特征) 已写入向量库的内容哈希
+
+    每个批次写入 Chroma 成功后才更新清单，因此清单本身就是断点：
+    进程中断后重新运行，只会重新嵌入尚未落盘的批次。
+    清单同时是向量库内容的索引：病例库中已删除的病例按清单找到对应条目后从向量库和清单中移除。
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # 并发流水线的 writer 在工作线程中更新清单（同一时刻只有一个写入者）
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            "doc_id TEXT PRIMARY KEY, patient_id TEXT, feature TEXT, content_hash TEXT, updated_at TEXT)"
+        )
+        self.conn.commit()
+
+    def get_hashes(self, doc_ids: List[str]) -> Dict[str, str]:
+        hashes = {}
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT doc_id, content_hash FROM manifest WHERE doc_id IN ({placeholders})", chunk
+            ).fetchall()
+            hashes.update(rows)
+        return hashes
+
+    def mark(self, rows: List[Tuple[str, str, str, str]]):
+        """rows: (doc_id, patient_id, feature, content_hash)"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO manifest (doc_id, patient_id, feature, content_hash, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(*row, now) for row in rows],
+        )
+        self.conn.commit()
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM manifest").fetchone()[0]
+
+    def patient_ids(self) -> Set[str]:
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT patient_id FROM manifest")}
+
+    def entries_for_patients(self, patient_ids: List[str]) -> List[Tuple[str, str]]:
+        """返回这些病例在清单中的 (doc_id, 特征)"""
+        entries = []
+        for start in range(0, len(patient_ids), 500):
+            chunk = patient_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            entries.extend(self.conn.execute(
+                f"SELECT doc_id, feature FROM manifest WHERE patient_id IN ({placeholders})", chunk
+            ).fetchall())
+        return entries
+
+    def remove(self, doc_ids: List[str]):
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            self.conn.execute(f"DELETE FROM manifest WHERE doc_id IN ({placeholders})", chunk)
+        self.conn.commit()
+
+    def reset(self):
+        self.conn.execute("DELETE FROM manifest")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
 class PatientDataVectorizer:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
-        self.client = MongoClient(MONGODB_HOST, MONGODB_PORT)
+    def __init__(self, batch_size: int = 256, embeddings: Optional[Embeddings] = None,
+                 base_directory: str = CASE_HISTORY_BASE_DIRECTOR):
+        self.base_directory = base_directory
+        self.embeddings = cached_embeddings(embeddings or OpenAIEmbeddings())
+        self.client = get_mongo_client()
         self.db = self.client[MONGODB_DB_NAME]
         self.collection = self.db[MONGODB_COLLECTION_NAME]
         self.feature_columns = MONGODB_FEATURES
+        self.batch_size = batch_size
+        self.manifest = VectorizeManifest(os.path.join(base_directory, MANIFEST_FILENAME))
+        self.vector_stores = {}
 
-    def vectorize_and_store(self):
-        print(f"要处理的特征列表: {self.feature_columns}")
-        print(f"数据库中的总文档数: {self.collection.count_documents({})}")
-        
-        for feature in self.feature_columns:
-            doc_count = self.collection.count_documents({feature: {"$exists": True}})
-            print(f"特征 '{feature}' 存在的文档数: {doc_count}")
-            
-            documents = []
-            document_ids = []
-            
-            cursor = self.collection.find({"patient_id": {"$exists": True}})
-            
-            for doc in cursor:
-                # 安全地获取值并转换为字符串
-                value = doc.get(feature, "")
-                text = str(value) if value is not None else ""
-                
-                print(f"找到文档: patient_id={doc['patient_id']}, {feature}={text[:50]} (类型: {type(value)})")
-                
-                doc_id = f"{doc['patient_id']}_{feature}"
-                documents.append(Document(
-                    page_content=text,
-                    metadata={
-                        "patient_id": doc["patient_id"],
-                        "feature": feature,
-                    }
-                ))
-                document_ids.append(doc_id)
-            
-            if not documents:
-                print(f"Warning: No documents found for feature {feature}")
-                continue
-                
-            persist_directory = os.path.join(CASE_HISTORY_BASE_DIRECTOR, feature)
+    def _get_store(self, feature: str) -> Chroma:
+        if feature not in self.vector_stores:
+            persist_directory = os.path.join(self.base_directory, feature)
             os.makedirs(persist_directory, exist_ok=True)
-
-            Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
+            self.vector_stores[feature] = Chroma(
                 persist_directory=persist_directory,
-                ids=document_ids
+                embedding_function=self.embeddings
             )
+        return self.vector_stores[feature]
+
+    def _iter_chunks(self):
+        """单次遍历游标，按 batch_size 分块返回病例（只投影需要的特征）"""
+        projection = {"_id": 0, "patient_id": 1, **{feature: 1 for feature in self.feature_columns}}
+        cursor = self.collection.find({"patient_id": {"$exists": True}}, projection, batch_size=self.batch_size)
+        chunk = []
+        for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= self.batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _iter_changed(self, docs: List[Dict], incremental: bool = True):
+        """对一批病例计算所有特征的内容哈希，返回与清单不一致的 (特征, 待写入条目)；非增量模式返回全部条目"""
+        entries = []
+        for doc in docs:
+            for feature in self.feature_columns:
+                text = feature_text(doc, feature)
+                doc_id = f"{doc['patient_id']}_{feature}"
+                entries.append((feature, doc_id, doc["patient_id"], text, content_hash(text)))
+
+        known = self.manifest.get_hashes([entry[1] for entry in entries]) if incremental else {}
+        for feature, doc_id, patient_id, text, digest in entries:
+            if known.get(doc_id) != digest:
+                yield feature, (doc_id, patient_id, text, digest)
+
+    def _flush(self, feature: str, pending: List[Tuple[str, str, str, str]]):
+        """写入一个批次并更新清单（断点）"""
+        if not pending:
+            return
+        self._get_store(feature).add_texts(
+            texts=[text for _, _, text, _ in pending],
+            metadatas=[{"patient_id": patient_id, "feature": feature} for _, patient_id, _, _ in pending],
+            ids=[doc_id for doc_id, _, _, _ in pending],
+        )
+        self.manifest.mark([(doc_id, str(patient_id), feature, digest) for doc_id, patient_id, _, digest in pending])
+        print(f"特征 '{feature}' 写入批次: {len(pending)} 条")
+
+    def _remove_deleted(self, scanned_patient_ids: Iterable[str]) -> int:
+        """
+        从向量库和清单中移除病例库里已不存在的病例
+
+        需在完整扫描病例库之后调用：清单中有、本次扫描中没有的病例即为已删除的病例。
+
+        Returns:
+            int: 移除的条目数
+        """
+        deleted = sorted(self.manifest.patient_ids() - set(scanned_patient_ids))
+        if not deleted:
+            return 0
+        by_feature: Dict[str, List[str]] = {}
+        for doc_id, feature in self.manifest.entries_for_patients(deleted):
+            by_feature.setdefault(feature, []).append(doc_id)
+        for feature, doc_ids in by_feature.items():
+            store = self._get_store(feature)
+            for start in range(0, len(doc_ids), self.batch_size):
+                store.delete(ids=doc_ids[start:start + self.batch_size])
+            # 向量库删除成功后再更新清单，中途失败时下次运行会重试
+            self.manifest.remove(doc_ids)
+            print(f"特征 '{feature}' 移除已删除病例的条目: {len(doc_ids)} 条")
+        return sum(len(doc_ids) for doc_ids in by_feature.values())
+
+    def vectorize_and_store(self, incremental: bool = True) -> Dict[str, int]:
+        """
+        向量化病例库并写入各特征的 Chroma 向量库
+
+        只遍历一次游标即可处理全部特征；增量模式下仅嵌入内容哈希发生变化的
+        (patient_id, 特征) 条目，并按固定批次大小写入，每个批次完成后记录断点。
+        扫描结束后，病例库中已删除的病例会从向量库和清单中移除。
+
+        Args:
+            incremental: 为 False 时忽略清单中的哈希，对全部条目重新写入
+
+        Returns:
+            Dict[str, int]: 本次运行的统计信息
+        """
+        print(f"要处理的特征列表: {self.feature_columns}")
+        print(f"数据库中的总文档数: {self.collection.count_documents({})}")
+        print(f"清单中已有条目数: {self.manifest.count()}")
+
+        stats = {"scanned": 0, "changed": 0, "written": 0, "removed": 0}
+        pending = {feature: [] for feature in self.feature_columns}
+        scanned_patient_ids = set()
+        for docs in self._iter_chunks():
+            scanned_patient_ids.update(str(doc["patient_id"]) for doc in docs)
+            self._process_chunk(docs, pending, stats, incremental)
+
+        for feature, items in pending.items():
+            self._flush(feature, items)
+            stats["written"] += len(items)
+        stats["removed"] = self._remove_deleted(scanned_patient_ids)
+
+        print(f"向量化完成: 扫描 {stats['scanned']} 个病例, 变更 {stats['changed']} 条, "
+              f"写入 {stats['written']} 条, 移除 {stats['removed']} 条")
+        print(f"嵌入缓存统计: {self.embeddings.stats() if hasattr(self.embeddings, 'stats') else '未启用'}")
+        return stats
+
+    def _process_chunk(self, docs: List[Dict], pending: Dict[str, List], stats: Dict[str, int], incremental: bool = True):
+        stats["scanned"] += len(docs)
+        for feature, item in self._iter_changed(docs, incremental):
+            stats["changed"] += 1
+            pending[feature].append(item)
+            if len(pending[feature]) >= self.batch_size:
+                self._flush(feature, pending[feature])
+                stats["written"] += len(pending[feature])
+                pending[feature] = []
+
+    def _write_embedded_batch(self, feature: str, batch: List[Tuple[str, str, str, str]], vectors: List[List[float]]):
+        """写入已嵌入的批次（直接写入向量，不再经过 embedding_function）并更新清单"""
+        self._get_store(feature)._collection.upsert(
+            ids=[doc_id for doc_id, _, _, _ in batch],
+            embeddings=vectors,
+            documents=[text for _, _, text, _ in batch],
+            metadatas=[{"patient_id": patient_id, "feature": feature} for _, patient_id, _, _ in batch],
+        )
+        self.manifest.mark([(doc_id, str(patient_id), feature, digest) for doc_id, patient_id, _, digest in batch])
+
+    def vectorize_and_store_parallel(
+        self,
+        incremental: bool = True,
+        concurrency: int = EMBEDDING_INGEST_CONCURRENCY,
+        requests_per_minute: float = EMBEDDING_INGEST_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = EMBEDDING_INGEST_TOKENS_PER_MINUTE,
+    ) -> IngestionReport:
+        """
+        并发向量化：所有特征的变更条目进入同一个有界 worker 池并发嵌入，
+        由单独的 writer 依次写入各特征的向量库，每个批次写入后更新清单；
+        嵌入结束后移除病例库中已删除的病例。
+
+        Returns:
+            IngestionReport: 吞吐量（docs/s、tokens/s）、重试和失败统计
+        """
+        print(f"要处理的特征列表: {self.feature_columns}")
+
+        items = {feature: [] for feature in self.feature_columns}
+        scanned = 0
+        scanned_patient_ids = set()
+        for docs in self._iter_chunks():
+            scanned += len(docs)
+            scanned_patient_ids.update(str(doc["patient_id"]) for doc in docs)
+            for feature, item in self._iter_changed(docs, incremental):
+                items[feature].append(item)
+        changed = sum(len(v) for v in items.values())
+        print(f"扫描 {scanned} 个病例, 待嵌入 {changed} 条")
+
+        report = asyncio.run(run_ingestion(
+            self.embeddings,
+            items,
+            self._write_embedded_batch,
+            concurrency=concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            batch_sizer=AdaptiveBatchSizer(
+                initial=min(self.batch_size, EMBEDDING_INGEST_MAX_BATCH_SIZE),
+                maximum=EMBEDDING_INGEST_MAX_BATCH_SIZE,
+            ),
+        ))
+        removed = self._remove_deleted(scanned_patient_ids)
+        print(f"移除已删除病例的条目 {removed} 条")
+        print(f"嵌入缓存统计: {self.embeddings.stats() if hasattr(self.embeddings, 'stats') else '未启用'}")
+        return report
 
     def close_connection(self):
-        self.client.close()
+        self.manifest.close()
 
 if __name__ == "__main__":
-    vectorizer = PatientDataVectorizer()
-    vectorizer.vectorize_and_store()
-    vectorizer.close_connection()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="病例库向量化")
+    parser.add_argument("--full", action="store_true", help="忽略清单，全量重新写入")
+    parser.add_argument("--batch-size", type=int, default=256, help="每个写入批次的条目数")
+    parser.add_argument("--parallel", action="store_true", help="使用并发嵌入流水线")
+    parser.add_argument("--concurrency", type=int, default=EMBEDDING_INGEST_CONCURRENCY, help="并发嵌入的 worker 数")
+    parser.add_argument("--embedding-base-url", default=None, help="嵌入服务地址，例如本地伪嵌入服务 http://127.0.0.1:8089/v1")
+    parser.add_argument("--embedding-model", default=None, help="配合 --embedding-base-url 使用的嵌入模型名")
+    parser.add_argument("--output-dir", default=None,
+                        help="向量库和清单目录；指定 --embedding-base-url 时默认按模型和服务地址使用单独的目录，且不允许写入生产目录")
+    args = parser.parse_args()
+
+    embeddings = None
+    output_dir = args.output_dir or CASE_HISTORY_BASE_DIRECTOR
+    if args.embedding_base_url:
+        options = {"model": args.embedding_model} if args.embedding_model else {}
+        embeddings = OpenAIEmbeddings(base_url=args.embedding_base_url, check_embedding_ctx_length=False, **options)
+        output_dir = args.output_dir or override_directory(embeddings.model, args.embedding_base_url)
+        if os.path.abspath(output_dir) == os.path.abspath(CASE_HISTORY_BASE_DIRECTOR):
+            parser.error("使用 --embedding-base-url 时不能写入生产向量库目录")
+        print(f"自定义嵌入服务 {embeddings.model}@{args.embedding_base_url}，写入 {output_dir}")
+
+    vectorizer = PatientDataVectorizer(batch_size=args.batch_size, embeddings=embeddings, base_directory=output_dir)
+    if args.parallel:
+        vectorizer.vectorize_and_store_parallel(incremental=not args.full, concurrency=args.concurrency)
+    else:
+        vectorizer.vectorize_and_store(incremental=not args.full)
+    vectorizer.close_connection()
@@ -150,3 +150,55 @@ def implicit_initial_knowledge_master_prompt():
         请深呼吸，采用精神分析的视角，逐步思考，然后分析以下消息：
         """
     )
+
+
+def unified_memory_classifier_prompt():
+    return dedent(
+        """
+        您是一位精神心理健康记录与分析助手，需要在一次分析中同时完成两项工作：
+
+        一、显式记忆（客观事实）：提取患者明确陈述的具体信息，类别从以下选择：
+            人口学信息、主诉、现病史、用药史、物质使用史、家族史、社会史、创伤史、治疗史
+
+        二、隐式记忆（心理推断）：基于专业心理学知识推断患者可能的心理因素，类别从以下选择：
+            情绪体验、行为模式、认知特征、历史信息、人格特质、压力状态
+
+        请按以下步骤处理：
+        1. 分析最近的Human消息。您会看到多条消息作为上下文，但只关注其中的新信息。
+        2. 分别列出与消息相关的显式类别和隐式类别；没有值得记录的信息时对应列表为空。
+        3. 对每条值得记录的信息输出一个记忆项：memory_type 为 explicit 或 implicit，
+           category 必须属于对应类型的类别，并给出置信度。
+        4. 将信息与已有记忆比较：新信息使用"创建"；需要修改已有记忆时使用"更新"，
+           在 knowledge_old 中给出被修改记忆的完整原文，并在 previous_version_id 中填入其记忆ID。
+
+        重要指南：
+        - 显式记忆只记录明确陈述的信息，不推测或诊断；隐式记忆是推测性的，置信度应如实反映。
+        - 保持客观中立，不做判断；陈述不清晰或信息不足时不要输出记忆项。
+        - 一条消息可能包含多条应该单独保存的信息。
+        - 你很容易出现幻觉，在输出的时候务必仔细检查两遍，如果出现幻觉务必修正。
+        - 所有内容必须用中文记录。
+
+        以下是我们已有的关于患者的记忆（按类别分组，每行：[记忆ID] 时间 内容）：
+
+        {memories}
+
+        请处理以下患者陈述：
+        """
+    )
+
+
+def memory_summary_prompt():
+    return dedent(
+        """
+        您是一位精神心理健康记录整理助手。下面是同一位患者在"{category}"类别下的多条较早或置信度较低的记忆，
+        请将它们合并为一条简洁的中文摘要：
+
+        - 保留所有仍有临床意义的事实，去除重复内容；
+        - 信息之间有矛盾时，以时间较新的记录为准，并简要注明变化；
+        - 不要添加记忆中没有的信息，不做诊断；
+        - 只输出摘要正文，不要输出任何解释或标题。
+
+        记忆（时间 | 置信度 | 内容）：
+        {memories}
+        """
+    )
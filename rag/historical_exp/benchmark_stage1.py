@@ -0,0 +1,167 @@
+"""
+两阶段检索第一阶段（实体特征匹配）性能对比
+
+在一个合成的病例集合上比较三种实现的延迟：
+1. legacy：逐字段 find + 非锚定正则 + Python 计数（原实现）
+2. aggregate：单条聚合管道一次性打分
+3. term_index：进程内结构化倒排索引
+
+用法:
+    python rag/historical_exp/benchmark_stage1.py --cases 100000 --queries 20
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import random
+import argparse
+import statistics
+from typing import Dict, List
+from pymongo import MongoClient
+
+from load_config import MONGODB_HOST, MONGODB_PORT
+from rag.historical_exp.feature_match import (
+    STRUCTURED_SUFFIX,
+    build_feature_match_pipeline,
+    StructuredTermIndex,
+)
+
+FEATURES = ["现病史", "既往史", "过敏史"]
+VOCAB = {
+    "现病史": {
+        "主要症状": ["情绪低落", "失眠", "焦虑", "胸闷", "心慌", "乏力", "纳差", "头痛", "幻听", "兴趣减退"],
+        "发病方式": ["急性", "慢性", "亚急性", "突发反复性"],
+        "诱因": ["工作压力", "家庭矛盾", "失恋", "躯体疾病", "无明显诱因"],
+    },
+    "既往史": {
+        "疾病史": ["高血压", "糖尿病", "甲状腺功能亢进", "冠心病", "无"],
+        "手术史": ["阑尾切除术", "剖宫产", "无"],
+    },
+    "过敏史": {
+        "过敏物质": ["青霉素", "头孢", "海鲜", "花粉", "无"],
+    },
+}
+
+
+def synthetic_case(i: int, rng: random.Random) -> Dict:
+    doc = {"patient_id": f"bench_{i:07d}"}
+    for feature, fields in VOCAB.items():
+        structure = {}
+        for field, choices in fields.items():
+            if field in ("主要症状", "疾病史"):
+                structure[field] = rng.sample(choices, rng.randint(1, 3))
+            else:
+                structure[field] = rng.choice(choices)
+        doc[f"{feature}{STRUCTURED_SUFFIX}"] = structure
+    return doc
+
+
+def synthetic_query(rng: random.Random) -> Dict[str, Dict]:
+    return {
+        "现病史": {
+            "主要症状": rng.sample(VOCAB["现病史"]["主要症状"], 2),
+            "发病方式": rng.choice(VOCAB["现病史"]["发病方式"]),
+            "诱因": rng.choice(VOCAB["现病史"]["诱因"])[:2],
+        },
+        "既往史": {"疾病史": [rng.choice(VOCAB["既往史"]["疾病史"])]},
+        "过敏史": {"过敏物质": rng.choice(VOCAB["过敏史"]["过敏物质"])},
+    }
+
+
+def populate(collection, cases: int, seed: int):
+    existing = collection.estimated_document_count()
+    if existing == cases:
+        print(f"复用已有的合成集合: {existing} 个病例")
+        return
+    collection.drop()
+    rng = random.Random(seed)
+    batch = []
+    for i in range(cases):
+        batch.append(synthetic_case(i, rng))
+        if len(batch) == 5000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    collection.create_index("patient_id")
+    print(f"已生成合成集合: {cases} 个病例")
+
+
+def legacy_stage1(collection, structured_features: Dict[str, Dict]) -> List[str]:
+    """原 _build_entity_query 的查询方式（去掉调试输出）"""
+    doc_match_counts = {}
+    for feature, structure in structured_features.items():
+        for field, value in structure.items():
+            if value is None or (isinstance(value, (list, str)) and not value):
+                continue
+            if isinstance(value, list):
+                query = {f"{feature}{STRUCTURED_SUFFIX}.{field}": {"$in": value}}
+            elif isinstance(value, str) and value.strip():
+                query = {f"{feature}{STRUCTURED_SUFFIX}.{field}": {"$regex": value, "$options": "i"}}
+            else:
+                continue
+            for doc in collection.find(query, {"patient_id": 1}):
+                doc_id = doc["patient_id"]
+                doc_match_counts[doc_id] = doc_match_counts.get(doc_id, 0) + 1
+    sorted_docs = sorted(doc_match_counts.items(), key=lambda x: x[1], reverse=True)
+    return [doc_id for doc_id, _ in sorted_docs]
+
+
+def aggregate_stage1(collection, structured_features: Dict[str, Dict], top_n: int) -> List[str]:
+    pipeline = build_feature_match_pipeline(structured_features, top_n=top_n)
+    return [doc["patient_id"] for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+def report(name: str, timings: List[float]):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<12} mean={statistics.mean(timings) * 1000:9.1f}ms  "
+          f"p50={statistics.median(timings) * 1000:9.1f}ms  p95={p95 * 1000:9.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="第一阶段实体匹配性能对比")
+    parser.add_argument("--cases", type=int, default=100000, help="合成病例数量")
+    parser.add_argument("--queries", type=int, default=20, help="测试查询数量")
+    parser.add_argument("--top-n", type=int, default=10, help="第一阶段返回的候选数")
+    parser.add_argument("--db", default="benchmark_stage1", help="用于压测的数据库名")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    client = MongoClient(MONGODB_HOST, MONGODB_PORT)
+    collection = client[args.db]["cases"]
+    try:
+        populate(collection, args.cases, args.seed)
+
+        start = time.perf_counter()
+        term_index = StructuredTermIndex(FEATURES).build(collection)
+        print(f"倒排索引构建耗时: {time.perf_counter() - start:.2f}s")
+
+        rng = random.Random(args.seed + 1)
+        queries = [synthetic_query(rng) for _ in range(args.queries)]
+        timings = {"legacy": [], "aggregate": [], "term_index": []}
+        for query in queries:
+            start = time.perf_counter()
+            legacy = legacy_stage1(collection, query)[:args.top_n]
+            timings["legacy"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            aggregate_stage1(collection, query, args.top_n)
+            timings["aggregate"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            indexed = term_index.score(query, top_n=args.top_n)
+            timings["term_index"].append(time.perf_counter() - start)
+
+            if legacy and indexed and len(legacy) != len(indexed):
+                print(f"警告: 候选数量不一致 legacy={len(legacy)} term_index={len(indexed)}")
+
+        print(f"\n=== 第一阶段延迟（{args.cases} 个病例, {args.queries} 个查询） ===")
+        for name, values in timings.items():
+            report(name, values)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,15 @@ rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
 import os
 import json
+import numpy as np
 from datetime import datetime
-from typing import Dict, List
-from pymongo import MongoClient
+from typing import Dict, List, Optional
+from utils.mongo_pool import get_mongo_client
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from preprocess.structurer import ExternalInputProcessor
+from rag.historical_exp.feature_match import build_feature_match_pipeline, StructuredTermIndex
+from utils.embedding_cache import cached_embeddings
 
 from config_loader import (
     load_specific_config, 
@@ -24,20 +27,47 @@ API_KEY = config['API_KEY']
 
 KEYWORDS_FEATURES = ["现病史", "既往史", "过敏史"]   # 用于关键词匹配
 VECTOR_FEATURES = ["诊疗经过", "体格检查"]   # 用于向量相似度计算
+TERM_INDEX_PATH = os.path.join(CASE_HISTORY_BASE_DIRECTOR, "structured_term_index.json")   # 结构化倒排索引
+
+
+def _vector_distances(matrix: np.ndarray, query_vector: np.ndarray, space: str = "l2") -> np.ndarray:
+    """按 Chroma 的距离定义（l2 为平方欧氏距离）计算查询向量到每一行的距离"""
+    if space == "cosine":
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+        return 1.0 - (matrix @ query_vector) / np.where(norms == 0, 1.0, norms)
+    if space == "ip":
+        return 1.0 - matrix @ query_vector
+    diff = matrix - query_vector
+    return np.einsum("ij,ij->i", diff, diff)
 
 
 class TwoStageRetrieval:
-    def __init__(self):
-        # 原有的初始化代码保持不变
-        self.client = MongoClient(MONGODB_HOST, MONGODB_PORT)
+    def __init__(self, use_term_index: bool = False):
+        """
+        Args:
+            use_term_index: 第一阶段是否使用进程内结构化倒排索引；
+                            索引文件存在且水位与病例库一致时直接加载，否则扫描病例库重建并保存
+        """
+        self.client = get_mongo_client(f"mongodb://{MONGODB_HOST}:{MONGODB_PORT}/")
         self.db = self.client[MONGODB_DB_NAME]
         self.collection = self.db[MONGODB_COLLECTION_NAME]
+
+        self.term_index = None
+        if use_term_index:
+            if os.path.exists(TERM_INDEX_PATH):
+                term_index = StructuredTermIndex.load(TERM_INDEX_PATH)
+                if term_index.is_current(self.collection, KEYWORDS_FEATURES):
+                    self.term_index = term_index
+                else:
+                    print("结构化倒排索引与病例库不一致，重新构建")
+            if self.term_index is None:
+                self.build_term_index()
         
         # 初始化结构化处理器
         self.structured_processor = ExternalInputProcessor(output_mode="all_features")
         
         # 初始化向量存储，扩展为包含所有特征
-        self.embeddings = OpenAIEmbeddings(openai_api_key=API_KEY)
+        self.embeddings = cached_embeddings(OpenAIEmbeddings(openai_api_key=API_KEY))
         self.vector_stores = {}
         all_features = VECTOR_FEATURES + KEYWORDS_FEATURES
         for feature in all_features:
@@ -119,53 +149,50 @@ class TwoStageRetrieval:
         
         return final_results
     
-    def _build_entity_query(self, structured_features: Dict[str, Dict]) -> List[str]:
-        """构建实体查询条件并返回按匹配数量排序的文档ID列表"""
+    def _build_entity_query(self, structured_features: Dict[str, Dict], top_n: Optional[int] = None) -> List[str]:
+        """
+        构建实体查询条件并返回按匹配数量排序的文档ID列表
+
+        所有字段条件在一次查询中完成打分：若已加载结构化倒排索引则直接在内存中查找，
+        否则使用单条聚合管道，避免逐字段扫描集合。
+
+        Args:
+            structured_features: {特征: {字段: 值}} 形式的结构化查询
+            top_n: 只返回匹配数最高的前 top_n 个文档ID，为 None 时返回全部
+
+        Returns:
+            List[str]: 按匹配字段数降序排列的文档ID列表
+        """
         print("\n=== 开始构建查询条件 ===")
-        
-        doc_match_counts = {}
-        doc_matched_fields = {}
-        
         for feature, structure in structured_features.items():
             print(f"\n处理特征 '{feature}' 的结构化数据:")
             print(json.dumps(structure, ensure_ascii=False, indent=2))
-            
-            for field, value in structure.items():
-                if value is None or (isinstance(value, (list, str)) and not value):
-                    continue
-                    
-                if isinstance(value, list):
-                    query = {f"{feature}_结构化.{field}": {"$in": value}}
-                    print(f"\n字段 '{field}' 的列表查询条件:")
-                    print(json.dumps(query, ensure_ascii=False, indent=2))
-                    
-                elif isinstance(value, str) and value.strip():
-                    query = {f"{feature}_结构化.{field}": {"$regex": value, "$options": "i"}}
-                    print(f"\n字段 '{field}' 的字符串查询条件:")
-                    print(json.dumps(query, ensure_ascii=False, indent=2))
-                else:
-                    continue
-                    
-                matching_docs = self.collection.find(query, {"patient_id": 1})
-                matching_docs_list = list(matching_docs)
-                print(f"匹配到 {len(matching_docs_list)} 个文档")
-                
-                for doc in matching_docs_list:
-                    doc_id = doc["patient_id"]
-                    doc_match_counts[doc_id] = doc_match_counts.get(doc_id, 0) + 1
-                    if doc_id not in doc_matched_fields:
-                        doc_matched_fields[doc_id] = []
-                    doc_matched_fields[doc_id].append(f"{feature}.{field}")
-        
-        sorted_docs = sorted(doc_match_counts.items(), key=lambda x: x[1], reverse=True)
-        
+
+        if self.term_index is not None:
+            ranked = self.term_index.score(structured_features, top_n=top_n)
+        else:
+            pipeline = build_feature_match_pipeline(structured_features, top_n=top_n)
+            if not pipeline:
+                return []
+            ranked = [
+                (doc["patient_id"], doc["score"], doc["matched"])
+                for doc in self.collection.aggregate(pipeline, allowDiskUse=True)
+            ]
+
         print("\n=== 匹配结果详情 ===")
-        for doc_id, match_count in sorted_docs:
+        for doc_id, match_count, matched_fields in ranked:
             print(f"\n文档 {doc_id}:")
             print(f"- 匹配字段数: {match_count}")
-            print(f"- 匹配的字段: {', '.join(doc_matched_fields[doc_id])}")
-        
-        return [doc_id for doc_id, _ in sorted_docs]
+            print(f"- 匹配的字段: {', '.join(matched_fields)}")
+
+        return [doc_id for doc_id, _, _ in ranked]
+
+    def build_term_index(self, save: bool = True) -> StructuredTermIndex:
+        """重新扫描病例库构建结构化倒排索引，并可选择持久化到磁盘"""
+        self.term_index = StructuredTermIndex(KEYWORDS_FEATURES).build(self.collection)
+        if save:
+            self.term_index.save(TERM_INDEX_PATH)
+        return self.term_index
         
     def retrieve_similar_cases(self, query_texts: Dict[str, str], scheme: str = 'A', n: int = 10, k: int = 5) -> List[Dict]:
         """
@@ -197,6 +224,52 @@ class TwoStageRetrieval:
         except Exception as e:
             return {"error": f"检索过程中出错: {str(e)}"}
 
+    def _batched_vector_scores(self, query_texts: Dict[str, str], candidate_ids: List[str]) -> Dict[str, Dict[str, float]]:
+        """
+        批量计算候选文档在各向量特征上的相似度
+
+        每个特征只嵌入一次查询文本，并通过一次 get 取回所有候选文档的已存向量，
+        再用 NumPy 向量化计算距离。距离度量与 Chroma 集合保持一致（默认平方 L2），
+        因此得分 1 / (1 + distance) 与逐条 similarity_search_with_score 的结果相同。
+
+        Args:
+            query_texts: 输入的查询文本
+            candidate_ids: 第一阶段选出的候选文档ID
+
+        Returns:
+            Dict[str, Dict[str, float]]: {特征: {patient_id: 相似度}}
+        """
+        feature_scores = {}
+        if not candidate_ids:
+            return feature_scores
+
+        for feature in VECTOR_FEATURES:
+            if feature not in query_texts or feature not in self.vector_stores:
+                continue
+
+            store = self.vector_stores[feature]
+            stored = store.get(
+                where={"patient_id": {"$in": list(candidate_ids)}},
+                include=["embeddings", "metadatas"]
+            )
+            if stored["embeddings"] is None or len(stored["embeddings"]) == 0:
+                continue
+
+            query_vector = np.asarray(self.embeddings.embed_query(query_texts[feature]), dtype=np.float32)
+            matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+            space = (store._collection.metadata or {}).get("hnsw:space", "l2")
+            distances = _vector_distances(matrix, query_vector, space)
+
+            scores = {}
+            for metadata, distance in zip(stored["metadatas"], distances):
+                patient_id = metadata.get("patient_id")
+                score = 1 / (1 + float(distance))
+                if patient_id is not None and score > scores.get(patient_id, -1.0):
+                    scores[patient_id] = score
+            feature_scores[feature] = scores
+
+        return feature_scores
+
     def _original_two_stage_retrieval(self, query_texts: Dict[str, str], n: int, k: int) -> List[Dict]:
         """
         原有的两阶段检索方案（方案A）
@@ -227,40 +300,23 @@ class TwoStageRetrieval:
             if not structured_features:
                 return []
 
-            candidate_ids = self._build_entity_query(structured_features)
+            candidate_ids = self._build_entity_query(structured_features, top_n=n)
             
             if not candidate_ids:
                 return []
                 
-            print(f"\n实体匹配找到的文档数: {len(candidate_ids)}")
+            print(f"\n实体匹配返回的文档数: {len(candidate_ids)}")
             print(f"选择匹配度最高的前 {n} 个文档进行向量相似度计算")
             
-            # 第二阶段：向量相似度计算
+            # 第二阶段：向量相似度计算（每个特征只做一次嵌入和一次批量取向量）
             vector_scores = []
+            feature_scores = self._batched_vector_scores(query_texts, candidate_ids[:n])
             for doc_id in candidate_ids[:n]:
-                total_score = 0
-                valid_features = 0
-                
-                for feature in VECTOR_FEATURES:
-                    if feature not in query_texts or feature not in self.vector_stores:
-                        continue
-                    
-                    results = self.vector_stores[feature].similarity_search_with_score(
-                        query_texts[feature],
-                        k=1,
-                        filter={"patient_id": doc_id}
-                    )
-                    
-                    if results:
-                        score = 1 / (1 + results[0][1])
-                        total_score += score
-                        valid_features += 1
-                
-                if valid_features > 0:
-                    avg_score = total_score / valid_features
+                scores = [per_doc[doc_id] for per_doc in feature_scores.values() if doc_id in per_doc]
+                if scores:
                     vector_scores.append({
                         "patient_id": doc_id,
-                        "similarity": avg_score
+                        "similarity": sum(scores) / len(scores)
                     })
             
             sorted_cases = sorted(vector_scores, key=lambda x: x["similarity"], reverse=True)
@@ -283,8 +339,7 @@ class TwoStageRetrieval:
             return []
     
     def close(self):
-        """安全关闭连接"""
-        self.client.close()
+        """安全关闭连接（MongoDB 客户端由连接池注册表共享，不在此关闭）"""
         if hasattr(self.structured_processor, "close"):
             self.structured_processor.close()
 
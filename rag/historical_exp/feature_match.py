@@ -0,0 +1,280 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import os
+import re
+import json
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+STRUCTURED_SUFFIX = "_结构化"
+
+
+def iter_feature_conditions(structured_features: Dict[str, Dict]) -> Iterator[Tuple[str, str, str, Any]]:
+    """
+    将结构化特征展开为匹配条件
+
+    Args:
+        structured_features: {特征: {字段: 值}} 形式的结构化查询
+
+    Yields:
+        (特征, 字段, 条件类型, 值)，条件类型为 "in"（列表精确匹配）或 "regex"（字符串正则匹配）
+    """
+    for feature, structure in structured_features.items():
+        for field, value in structure.items():
+            if value is None or (isinstance(value, (list, str)) and not value):
+                continue
+            if isinstance(value, list):
+                yield feature, field, "in", value
+            elif isinstance(value, str) and value.strip():
+                yield feature, field, "regex", value
+
+
+def _as_array(path: str) -> Dict:
+    """聚合表达式：把字段统一视为数组，兼容标量与数组两种存储形式"""
+    return {"$cond": [{"$isArray": f"${path}"}, f"${path}", [f"${path}"]]}
+
+
+def _condition_expr(path: str, kind: str, value: Any) -> Dict:
+    """生成与 find 查询语义一致的聚合布尔表达式"""
+    if kind == "in":
+        return {"$gt": [{"$size": {"$setIntersection": [_as_array(path), value]}}, 0]}
+    return {
+        "$anyElementTrue": [{
+            "$map": {
+                "input": _as_array(path),
+                "as": "v",
+                "in": {
+                    "$regexMatch": {
+                        "input": {"$convert": {"input": "$$v", "to": "string", "onError": "", "onNull": ""}},
+                        "regex": value,
+                        "options": "i",
+                    }
+                },
+            }
+        }]
+    }
+
+
+def build_feature_match_pipeline(structured_features: Dict[str, Dict], top_n: Optional[int] = None) -> List[Dict]:
+    """
+    构建一次性完成所有字段匹配与打分的聚合管道
+
+    每个候选文档只被扫描一次：$match 过滤出至少命中一个字段的文档，
+    $project 统计命中的字段列表，按命中数量降序返回前 top_n 个。
+
+    Args:
+        structured_features: {特征: {字段: 值}} 形式的结构化查询
+        top_n: 只返回得分最高的前 top_n 个文档，为 None 时返回全部
+
+    Returns:
+        List[Dict]: MongoDB 聚合管道，若没有有效条件则返回空列表
+    """
+    match_clauses = []
+    matched_parts = []
+    for feature, field, kind, value in iter_feature_conditions(structured_features):
+        path = f"{feature}{STRUCTURED_SUFFIX}.{field}"
+        if kind == "in":
+            match_clauses.append({path: {"$in": value}})
+        else:
+            match_clauses.append({path: {"$regex": value, "$options": "i"}})
+        matched_parts.append({"$cond": [_condition_expr(path, kind, value), [f"{feature}.{field}"], []]})
+
+    if not match_clauses:
+        return []
+
+    pipeline = [
+        {"$match": {"$or": match_clauses}},
+        {"$project": {"_id": 0, "patient_id": 1, "matched": {"$concatArrays": matched_parts}}},
+        {"$addFields": {"score": {"$size": "$matched"}}},
+        {"$match": {"score": {"$gt": 0}}},
+        {"$sort": {"score": -1, "patient_id": 1}},
+    ]
+    if top_n:
+        pipeline.append({"$limit": top_n})
+    return pipeline
+
+
+class StructuredTermIndex:
+    """
+    基于 *_结构化 字段的进程内倒排索引
+
+    索引以 (特征, 字段) 为分区，每个分区保存 词项 -> 病例ID集合 的映射。
+    列表条件变成字典查找，正则条件只需扫描该分区的词表（远小于文档数），
+    从而把全表正则扫描变成索引查找。
+    构建时记录病例库的水位（参与索引的文档数、最大 _id 和结构化字段的内容指纹），随索引一起保存；
+    加载后水位与病例库不一致（新增、删除或原地修改了病例）时需要重建。
+    内容指纹由服务端 $toHashedIndexKey 聚合得到，需要 MongoDB 7.0 及以上；
+    更早的版本上指纹为 None，只能发现病例的增删，原地修改后需手动调用 build 重建。
+    """
+
+    WATERMARK_QUERY = {"patient_id": {"$exists": True}}
+    # 正则条件的匹配结果缓存上限，按 LRU 淘汰
+    REGEX_CACHE_SIZE = 1024
+
+    def __init__(self, features: List[str]):
+        self.features = list(features)
+        self.postings: Dict[str, Dict[str, set]] = {}
+        self.doc_count = 0
+        self.watermark: Optional[Dict[str, Any]] = None
+        self._regex_cache: "OrderedDict[Tuple[str, str], set]" = OrderedDict()
+
+    @staticmethod
+    def _key(feature: str, field: str) -> str:
+        return f"{feature}\t{field}"
+
+    @staticmethod
+    def _terms(value: Any) -> Iterator[str]:
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if isinstance(item, (str, int, float)) and not isinstance(item, bool):
+                term = str(item)
+                if term:
+                    yield term
+
+    def add_document(self, doc: Dict):
+        patient_id = doc.get("patient_id")
+        if patient_id is None:
+            return
+        for feature in self.features:
+            structure = doc.get(f"{feature}{STRUCTURED_SUFFIX}")
+            if not isinstance(structure, dict):
+                continue
+            for field, value in structure.items():
+                partition = self.postings.setdefault(self._key(feature, field), {})
+                for term in self._terms(value):
+                    partition.setdefault(term, set()).add(patient_id)
+        self.doc_count += 1
+        self._regex_cache.clear()
+
+    @classmethod
+    def content_fingerprint(cls, collection, features: List[str]) -> Optional[int]:
+        """
+        结构化字段的内容指纹：逐文档对 patient_id 和各 *_结构化 字段做哈希后求和，与文档顺序无关
+
+        每个哈希先取模到 2^31 以内再求和，保证结果是不溢出的整数；服务端不支持
+        $toHashedIndexKey（MongoDB 7.0 以下）时返回 None
+        """
+        from pymongo.errors import OperationFailure
+
+        content = {"patient_id": "$patient_id"}
+        content.update({feature: f"${feature}{STRUCTURED_SUFFIX}" for feature in features})
+        pipeline = [
+            {"$match": cls.WATERMARK_QUERY},
+            {"$group": {
+                "_id": None,
+                "fingerprint": {"$sum": {"$abs": {"$mod": [{"$toHashedIndexKey": content}, 2 ** 31]}}},
+            }},
+        ]
+        try:
+            result = list(collection.aggregate(pipeline))
+        except OperationFailure:
+            return None
+        return int(result[0]["fingerprint"]) if result else 0
+
+    @classmethod
+    def collection_watermark(cls, collection, features: List[str]) -> Dict[str, Any]:
+        """病例库当前的水位：参与索引的文档数、最大 _id（转为字符串以便保存）和内容指纹"""
+        latest = collection.find_one(cls.WATERMARK_QUERY, {"_id": 1}, sort=[("_id", -1)])
+        return {
+            "doc_count": collection.count_documents(cls.WATERMARK_QUERY),
+            "max_id": str(latest["_id"]) if latest else None,
+            "fingerprint": cls.content_fingerprint(collection, features),
+        }
+
+    def is_current(self, collection, features: List[str]) -> bool:
+        """索引的特征和水位都与病例库一致时可以直接使用"""
+        return (
+            self.watermark is not None
+            and self.features == list(features)
+            and self.watermark == self.collection_watermark(collection, features)
+        )
+
+    def build(self, collection) -> "StructuredTermIndex":
+        """对集合进行一次投影扫描构建索引"""
+        self.postings = {}
+        self.doc_count = 0
+        self._regex_cache.clear()
+        # 扫描前记录水位：扫描期间新增或修改的病例会使下次加载时水位不一致，从而触发重建
+        self.watermark = self.collection_watermark(collection, self.features)
+        projection = {"_id": 0, "patient_id": 1}
+        projection.update({f"{feature}{STRUCTURED_SUFFIX}": 1 for feature in self.features})
+        for doc in collection.find(self.WATERMARK_QUERY, projection):
+            self.add_document(doc)
+        print(f"结构化倒排索引构建完成: {self.doc_count} 个文档, {len(self.postings)} 个字段分区")
+        return self
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            "features": self.features,
+            "doc_count": self.doc_count,
+            "watermark": self.watermark,
+            "postings": {
+                key: {term: sorted(ids, key=str) for term, ids in partition.items()}
+                for key, partition in self.postings.items()
+            },
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "StructuredTermIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(data["features"])
+        index.doc_count = data["doc_count"]
+        index.watermark = data.get("watermark")
+        index.postings = {
+            key: {term: set(ids) for term, ids in partition.items()}
+            for key, partition in data["postings"].items()
+        }
+        return index
+
+    def lookup(self, feature: str, field: str, kind: str, value: Any) -> set:
+        """返回满足单个条件的病例ID集合"""
+        partition = self.postings.get(self._key(feature, field), {})
+        if kind == "in":
+            matched = set()
+            for term in self._terms(value):
+                matched |= partition.get(term, set())
+            return matched
+
+        cache_key = (self._key(feature, field), value)
+        matched = self._regex_cache.get(cache_key)
+        if matched is not None:
+            self._regex_cache.move_to_end(cache_key)
+            return matched
+
+        try:
+            pattern = re.compile(value, re.IGNORECASE)
+        except re.error:
+            pattern = re.compile(re.escape(value), re.IGNORECASE)
+        matched = set()
+        for term, ids in partition.items():
+            if pattern.search(term):
+                matched |= ids
+        self._regex_cache[cache_key] = matched
+        while len(self._regex_cache) > self.REGEX_CACHE_SIZE:
+            self._regex_cache.popitem(last=False)
+        return matched
+
+    def score(self, structured_features: Dict[str, Dict], top_n: Optional[int] = None) -> List[Tuple[Any, int, List[str]]]:
+        """
+        一次性对所有候选文档打分
+
+        Returns:
+            List[Tuple]: (patient_id, 命中字段数, 命中字段列表)，按命中数降序
+        """
+        counts = Counter()
+        matched_fields: Dict[Any, List[str]] = {}
+        for feature, field, kind, value in iter_feature_conditions(structured_features):
+            for patient_id in self.lookup(feature, field, kind, value):
+                counts[patient_id] += 1
+                matched_fields.setdefault(patient_id, []).append(f"{feature}.{field}")
+
+        ranked = sorted(counts.items(), key=lambda x: (-x[1], str(x[0])))
+        if top_n:
+            ranked = ranked[:top_n]
+        return [(patient_id, count, matched_fields[patient_id]) for patient_id, count in ranked]
@@ -3,7 +3,7 @@ rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
 import os
 from typing import Dict, List, Union
-from pymongo import MongoClient
+from utils.mongo_pool import get_mongo_client
 import json
 from datetime import datetime
 from bson import ObjectId
@@ -27,7 +27,7 @@ class QueryOperator(str, Enum):
 
 class FeatureRetrieval:
     def __init__(self, host: str, port: int, db_name: str, collection_name: str):
-        self.client = MongoClient(host, port)
+        self.client = get_mongo_client(f"mongodb://{host}:{port}/")
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
         self.structure_file = "./database/feature_structures.json"
@@ -115,8 +115,8 @@ class FeatureRetrieval:
         return results
     
     def close(self):
-        if hasattr(self, 'client'):
-            self.client.close()
+        # MongoDB 客户端由连接池注册表共享，不在此关闭
+        pass
             
 def print_results(results):
             
@@ -0,0 +1,103 @@
+"""
+知识图谱检索查询元素抽取基准测试：节点名称词典本地抽取 vs LLM 抽取
+
+加载知识图谱快照并构建词典后，对每个问题：
+    - fast_path：EntityMatcher.extract，记录抽取情况（命中/无实体/无关系/不明确）和延迟（微秒）
+    - llm：指定 --invoke 时调用 GraphQA.extract_query_elements，记录延迟（毫秒），
+      并统计本地命中的问题中两者 (头部实体, 关系) 集合一致的比例
+问题可通过 --questions-file（每行一个问题）替换。
+
+用法:
+    python rag/knowledge_graph/benchmark_entity_fast_path.py --questions-file questions.txt --invoke
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import argparse
+import statistics
+from collections import Counter
+
+from rag.knowledge_graph.retrieve import GraphQA, VALID_RELATIONSHIPS
+from rag.knowledge_graph.entity_matcher import EntityMatcher, HIT
+from rag.knowledge_graph.benchmark_graph_qa import percentile
+
+DEFAULT_QUESTIONS = [
+    "抑郁症的治疗方法有哪些",
+    "焦虑障碍会导致什么？",
+    "失眠会引起哪些问题",
+    "惊恐发作属于哪类疾病",
+    "双相情感障碍包括哪些症状",
+    "怎么缓解焦虑",
+    "抑郁症和焦虑症经常伴随出现吗",
+    "我最近心情很差，不知道该怎么办",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询元素本地抽取与 LLM 抽取对比")
+    parser.add_argument("--questions-file", default=None, help="问题文件，每行一个问题")
+    parser.add_argument("--graph-label", default=None, help="检索的子知识图谱标签")
+    parser.add_argument("--invoke", action="store_true", help="同时调用 LLM 抽取（会产生 API 费用）")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions_file:
+        with open(args.questions_file, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    qa = GraphQA(prewarm=False)
+    if qa.snapshot is None:
+        raise SystemExit("本地抽取依赖知识图谱快照，请先开启 KG_SNAPSHOT.ENABLED")
+    qa.snapshot.on_load = None
+    qa.snapshot.refresh(force=True)
+    if qa.snapshot.snapshot is None:
+        raise SystemExit("知识图谱快照加载失败")
+    matcher = EntityMatcher(qa.snapshot.snapshot, VALID_RELATIONSHIPS)
+    print(f"词典 {matcher.entities.size} 个名称，构建 {matcher.build_seconds:.2f}s")
+
+    cases = []
+    for question in questions:
+        start = time.perf_counter()
+        queries, outcome = matcher.extract(question, args.graph_label)
+        case = {"question": question, "outcome": outcome, "fast_us": (time.perf_counter() - start) * 1e6,
+                "fast_queries": queries}
+        if args.invoke:
+            start = time.perf_counter()
+            elements = qa.extract_query_elements(question).queries
+            case["llm_ms"] = (time.perf_counter() - start) * 1000
+            case["llm_queries"] = [element.model_dump() for element in elements]
+            if outcome == HIT:
+                fast = {(q["head_entity"], q["relationship"]) for q in queries}
+                case["agree"] = fast == {(e.head_entity, e.relationship) for e in elements}
+        cases.append(case)
+
+    outcomes = Counter(case["outcome"] for case in cases)
+    fast_latencies = [case["fast_us"] for case in cases]
+    llm_latencies = [case["llm_ms"] for case in cases if "llm_ms" in case]
+    agreements = [case["agree"] for case in cases if "agree" in case]
+    summary = {
+        "questions": len(cases),
+        "hit_rate": outcomes[HIT] / len(cases) if cases else 0.0,
+        "outcomes": dict(outcomes),
+        "fast_p50_us": percentile(fast_latencies, 0.5),
+        "fast_p95_us": percentile(fast_latencies, 0.95),
+        "llm_p50_ms": percentile(llm_latencies, 0.5),
+        "llm_p95_ms": percentile(llm_latencies, 0.95),
+        "agreement": sum(agreements) / len(agreements) if agreements else None,
+    }
+    llm_mean_ms = statistics.mean(llm_latencies) if llm_latencies else 0.0
+    summary["saved_ms_per_question"] = summary["hit_rate"] * llm_mean_ms
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "cases": cases}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    qa.close()
+
+
+if __name__ == "__main__":
+    main()
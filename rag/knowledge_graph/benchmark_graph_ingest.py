@@ -0,0 +1,130 @@
+"""
+知识图谱写入基准测试：逐条 MERGE vs GraphIngestor 批量 UNWIND
+
+用合成的 GraphData 文档（不经过 LLM 抽取，两种方式抽取开销相同）分别写入本地 Neo4j：
+    - per_statement：原 build_graph 的方式，每个实体、每个关系一条拼接的 Cypher 语句，按文档内局部 id MERGE
+    - batched：GraphIngestor，实体按稳定 id 合并，每个文档按类型几条 UNWIND 语句在一个事务中写入
+报告每种方式的三元组写入吞吐（triples/s）；batched 方式再重复写入一遍，检查节点数和关系数不变（幂等）。
+
+用法:
+    python rag/knowledge_graph/benchmark_graph_ingest.py --docs 200 --entities 30 --relations 40 --drop
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import random
+import argparse
+from typing import Dict, List
+
+from rag.knowledge_graph.retrieve import NODE_TYPES, VALID_RELATIONSHIPS
+from rag.knowledge_graph.graph_ingest import GraphIngestor
+from rag.knowledge_graph.text2graph_prompt import GraphData
+from load_config import NEO4J_DATABASE
+
+BENCH_LABEL = "GraphIngestBench"
+LEGACY_LABEL = "GraphIngestLegacyBench"
+
+
+def synthetic_documents(docs: int, entities: int, relations: int, vocabulary: int) -> List[GraphData]:
+    """实体名称从有限词表中抽取，不同文档之间有大量同名实体，用来检验跨文档合并"""
+    rng = random.Random(0)
+    documents = []
+    for _ in range(docs):
+        names = rng.sample(range(vocabulary), min(entities, vocabulary))
+        graph_entities = [
+            {"id": f"E{i + 1}", "type": NODE_TYPES[name % len(NODE_TYPES)], "name": f"实体{name}"}
+            for i, name in enumerate(names)
+        ]
+        graph_relations = [
+            {"from": f"E{rng.randrange(len(names)) + 1}", "to": f"E{rng.randrange(len(names)) + 1}",
+             "type": rng.choice(VALID_RELATIONSHIPS)}
+            for _ in range(relations)
+        ]
+        documents.append(GraphData.model_validate({"entities": graph_entities, "relations": graph_relations}))
+    return documents
+
+
+def per_statement(driver, graph_data: GraphData, graph_label: str):
+    """原实现：逐条拼接 Cypher 执行"""
+    for entity in graph_data.entities:
+        driver.execute_query(f"""
+            MERGE (e:{graph_label}:{entity.type} {{id: '{entity.id}'}})
+            ON CREATE SET e.name = '{entity.name}'
+            ON MATCH SET e.name = '{entity.name}'
+            """, database_=NEO4J_DATABASE)
+    for relation in graph_data.relations:
+        driver.execute_query(f"""
+            MATCH (e1:{graph_label} {{id: '{relation.from_}'}})
+            MATCH (e2:{graph_label} {{id: '{relation.to}'}})
+            MERGE (e1)-[r:{relation.type}]->(e2)
+            """, database_=NEO4J_DATABASE)
+
+
+def graph_size(driver, graph_label: str) -> Dict[str, int]:
+    records, _, _ = driver.execute_query(
+        f"MATCH (n:{graph_label}) OPTIONAL MATCH (n)-[r]->() RETURN count(DISTINCT n) AS nodes, count(r) AS relationships",
+        database_=NEO4J_DATABASE
+    )
+    return {"nodes": records[0]["nodes"], "relationships": records[0]["relationships"]}
+
+
+def timed(name: str, write, documents: List[GraphData]) -> Dict:
+    start = time.perf_counter()
+    for graph_data in documents:
+        write(graph_data)
+    seconds = time.perf_counter() - start
+    triples = sum(len(graph_data.relations) for graph_data in documents)
+    return {"mode": name, "docs": len(documents), "triples": triples, "seconds": seconds,
+            "triples_per_second": triples / seconds if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱批量写入基准测试")
+    parser.add_argument("--docs", type=int, default=200, help="合成文档数")
+    parser.add_argument("--entities", type=int, default=30, help="每个文档的实体数")
+    parser.add_argument("--relations", type=int, default=40, help="每个文档的关系数")
+    parser.add_argument("--vocabulary", type=int, default=2000, help="实体名称词表大小")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    parser.add_argument("--drop", action="store_true", help="结束后删除写入的测试数据")
+    args = parser.parse_args()
+
+    ingestor = GraphIngestor()
+    driver = ingestor.driver
+    documents = synthetic_documents(args.docs, args.entities, args.relations, args.vocabulary)
+    for label in (BENCH_LABEL, LEGACY_LABEL):
+        driver.execute_query(f"MATCH (n:{label}) DETACH DELETE n", database_=NEO4J_DATABASE)
+    driver.execute_query(f"CREATE INDEX graph_ingest_legacy_id IF NOT EXISTS FOR (n:{LEGACY_LABEL}) ON (n.id)",
+                         database_=NEO4J_DATABASE)
+
+    results = [
+        timed("per_statement", lambda graph_data: per_statement(driver, graph_data, LEGACY_LABEL), documents),
+        timed("batched", lambda graph_data: ingestor.ingest(graph_data, BENCH_LABEL, bump_version=False), documents),
+    ]
+    results[0].update(graph_size(driver, LEGACY_LABEL))
+    results[1].update(graph_size(driver, BENCH_LABEL))
+    timed("batched_again", lambda graph_data: ingestor.ingest(graph_data, BENCH_LABEL, bump_version=False), documents)
+    idempotent = graph_size(driver, BENCH_LABEL) == {k: results[1][k] for k in ("nodes", "relationships")}
+
+    print(f"{'方式':<16}{'文档数':>8}{'三元组':>10}{'秒':>10}{'triples/s':>12}{'节点':>10}{'关系':>10}")
+    for r in results:
+        print(f"{r['mode']:<16}{r['docs']:>8}{r['triples']:>10}{r['seconds']:>10.2f}{r['triples_per_second']:>12.0f}"
+              f"{r['nodes']:>10}{r['relationships']:>10}")
+    print(f"重复写入后节点数和关系数不变: {idempotent}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "idempotent": idempotent}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.drop:
+        for label in (BENCH_LABEL, LEGACY_LABEL):
+            driver.execute_query(f"MATCH (n:{label}) DETACH DELETE n", database_=NEO4J_DATABASE)
+        driver.execute_query("DROP INDEX graph_ingest_legacy_id IF EXISTS", database_=NEO4J_DATABASE)
+        driver.execute_query(f"DROP INDEX `kg_name_{BENCH_LABEL}` IF EXISTS", database_=NEO4J_DATABASE)
+    ingestor.close()
+
+
+if __name__ == "__main__":
+    main()
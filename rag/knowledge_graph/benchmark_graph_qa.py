@@ -0,0 +1,151 @@
+"""
+知识图谱检索基准测试：每次调用新建驱动 + 拼接 Cypher vs 常驻驱动 + 参数化 UNWIND
+
+在本地 Neo4j 中写入一个带 BENCH_LABEL 标签的合成子图，然后用同一组查询元素分别测量：
+    - per_call：原 run() 的方式，每次工具调用新建驱动，逐个查询元素拼接 Cypher 执行，最后关闭驱动
+    - pooled：共享的 GraphQA，驱动连接池常驻，一个问题的全部查询元素一次 UNWIND 查询
+查询元素直接合成，不经过 LLM 抽取（两种方式的抽取开销相同），只比较图数据库部分的工具调用延迟。
+
+用法:
+    python rag/knowledge_graph/benchmark_graph_qa.py --entities 5000 --questions 300 --drop
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import random
+import argparse
+import statistics
+from typing import Dict, List
+
+from neo4j import GraphDatabase
+
+from rag.knowledge_graph.retrieve import GraphQA, QueryElement, NODE_TYPES, VALID_RELATIONSHIPS
+from load_config import NEO4J_URI, NEO4J_USERNAME, NEO4J_PASSWORD, NEO4J_DATABASE
+
+BENCH_LABEL = "GraphQABench"
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def seed_graph(driver, entities: int, degree: int):
+    rng = random.Random(0)
+    driver.execute_query(f"MATCH (n:{BENCH_LABEL}) DETACH DELETE n", database_=NEO4J_DATABASE)
+    driver.execute_query(f"CREATE INDEX graph_qa_bench_name IF NOT EXISTS FOR (n:{BENCH_LABEL}) ON (n.name)",
+                         database_=NEO4J_DATABASE)
+    for node_type in NODE_TYPES:
+        names = [f"实体{i}" for i in range(entities) if i % len(NODE_TYPES) == NODE_TYPES.index(node_type)]
+        driver.execute_query(
+            f"UNWIND $names AS name CREATE (:{BENCH_LABEL}:{node_type} {{name: name}})",
+            names=names, database_=NEO4J_DATABASE
+        )
+    for relationship in VALID_RELATIONSHIPS:
+        edges = [
+            {"h": f"实体{i}", "t": f"实体{rng.randrange(entities)}"}
+            for i in range(entities)
+            for _ in range(degree)
+            if rng.random() < 1 / len(VALID_RELATIONSHIPS)
+        ]
+        for start in range(0, len(edges), 5000):
+            driver.execute_query(
+                f"UNWIND $edges AS e MATCH (h:{BENCH_LABEL} {{name: e.h}}), (t:{BENCH_LABEL} {{name: e.t}}) "
+                f"CREATE (h)-[:{relationship}]->(t)",
+                edges=edges[start:start + 5000], database_=NEO4J_DATABASE
+            )
+
+
+def synthetic_questions(entities: int, questions: int, max_elements: int) -> List[List[QueryElement]]:
+    rng = random.Random(1)
+    return [
+        [
+            QueryElement(head_entity=f"实体{rng.randrange(entities)}", relationship=rng.choice(VALID_RELATIONSHIPS))
+            for _ in range(rng.randint(1, max_elements))
+        ]
+        for _ in range(questions)
+    ]
+
+
+def per_call(query_elements: List[QueryElement]) -> List[dict]:
+    """原实现：新建驱动，逐个查询元素拼接 Cypher，用完关闭"""
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+    try:
+        results = []
+        for element in query_elements:
+            cypher = f"""
+            MATCH (h:{BENCH_LABEL} {{name: '{element.head_entity}'}})-[r:{element.relationship}]->(t:{BENCH_LABEL})
+            RETURN h, r, t
+            LIMIT 10
+            """
+            with driver.session(database=NEO4J_DATABASE) as session:
+                for record in session.run(cypher).fetch(10):
+                    results.append({'h': record['h']['name'], 'r': record['r'].type, 't': record['t']['name']})
+        return results
+    finally:
+        driver.close()
+
+
+def measure(name: str, call, workload: List[List[QueryElement]]) -> Dict:
+    latencies = []
+    rows = 0
+    for query_elements in workload:
+        start = time.perf_counter()
+        rows += len(call(query_elements))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "mode": name,
+        "calls": len(latencies),
+        "rows": rows,
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "mean_ms": statistics.mean(latencies) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱检索连接池与参数化查询基准测试")
+    parser.add_argument("--entities", type=int, default=5000, help="合成子图的实体数")
+    parser.add_argument("--degree", type=int, default=4, help="每个实体的平均出边数")
+    parser.add_argument("--questions", type=int, default=300, help="模拟的工具调用次数")
+    parser.add_argument("--max-elements", type=int, default=4, help="每个问题最多的查询元素数")
+    parser.add_argument("--skip-seed", action="store_true", help="复用已写入的合成子图")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    parser.add_argument("--drop", action="store_true", help="结束后删除合成子图")
+    args = parser.parse_args()
+
+    qa = GraphQA(prewarm=False)
+    if not args.skip_seed:
+        seed_graph(qa.driver, args.entities, args.degree)
+    workload = synthetic_questions(args.entities, args.questions, args.max_elements)
+
+    # 预热常驻驱动后再计时，与线上服务启动时预热一致
+    qa.driver.verify_connectivity()
+    qa.execute_query_elements(workload[0], graph_label=BENCH_LABEL)
+
+    results = [
+        measure("per_call", per_call, workload),
+        measure("pooled", lambda elements: qa.execute_query_elements(elements, graph_label=BENCH_LABEL), workload),
+    ]
+
+    print(f"{'方式':<10}{'调用数':>8}{'返回行数':>10}{'p50 ms':>10}{'p95 ms':>10}{'平均 ms':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['calls']:>8}{r['rows']:>10}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['mean_ms']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.drop:
+        qa.driver.execute_query(f"MATCH (n:{BENCH_LABEL}) DETACH DELETE n", database_=NEO4J_DATABASE)
+        qa.driver.execute_query("DROP INDEX graph_qa_bench_name IF EXISTS", database_=NEO4J_DATABASE)
+    qa.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+知识图谱内存快照基准测试：快照大小、加载时间，以及 1 跳查询延迟（快照 vs Neo4j UNWIND 查询）
+
+复用 benchmark_graph_qa 的合成子图（BENCH_LABEL 分区）和合成查询元素：
+    - snapshot：GraphSnapshot.lookup（含查询参数转换），单位微秒
+    - neo4j：关闭快照的 GraphQA.execute_query_elements，单位微秒
+同时统计两者结果一致的问题占比（每个查询元素的结果不足 limit 条时两者应完全一致）。
+
+用法:
+    python rag/knowledge_graph/benchmark_graph_snapshot.py --entities 20000 --questions 1000 --drop
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import json
+import time
+import argparse
+import statistics
+from typing import Dict, List
+
+from rag.knowledge_graph.retrieve import GraphQA, QueryElement, VALID_RELATIONSHIPS
+from rag.knowledge_graph.graph_snapshot import GraphSnapshot
+from rag.knowledge_graph.benchmark_graph_qa import BENCH_LABEL, percentile, seed_graph, synthetic_questions
+from load_config import NEO4J_DATABASE
+
+
+def measure(name: str, call, workload: List[List[QueryElement]]) -> Dict:
+    latencies = []
+    results = []
+    for query_elements in workload:
+        start = time.perf_counter()
+        results.append(call(query_elements))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return {
+        "mode": name,
+        "p50_us": percentile(latencies, 0.5),
+        "p95_us": percentile(latencies, 0.95),
+        "mean_us": statistics.mean(latencies) if latencies else 0.0,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱内存快照基准测试")
+    parser.add_argument("--entities", type=int, default=20000, help="合成子图的实体数")
+    parser.add_argument("--degree", type=int, default=4, help="每个实体的平均出边数")
+    parser.add_argument("--questions", type=int, default=1000, help="模拟的问题数")
+    parser.add_argument("--max-elements", type=int, default=4, help="每个问题最多的查询元素数")
+    parser.add_argument("--skip-seed", action="store_true", help="复用已写入的合成子图")
+    parser.add_argument("--output", default=None, help="保存结果的 JSON 文件")
+    parser.add_argument("--drop", action="store_true", help="结束后删除合成子图")
+    args = parser.parse_args()
+
+    qa = GraphQA(prewarm=False)
+    # 关闭 GraphQA 自带的快照，neo4j 一栏只测 UNWIND 查询
+    qa.snapshot = None
+    if not args.skip_seed:
+        seed_graph(qa.driver, args.entities, args.degree)
+
+    snapshot = GraphSnapshot.load(qa.driver, VALID_RELATIONSHIPS)
+    size = {
+        "version": snapshot.version,
+        "nodes": snapshot.nodes,
+        "edges": snapshot.edges,
+        "partitions": len(snapshot.partitions),
+        "names": len(snapshot.names),
+        "bytes": snapshot.nbytes(),
+        "load_seconds": snapshot.load_seconds,
+    }
+    print(json.dumps(size, ensure_ascii=False))
+
+    workload = synthetic_questions(args.entities, args.questions, args.max_elements)
+    # 预热驱动后再计时
+    qa.driver.verify_connectivity()
+    qa.execute_query_elements(workload[0], graph_label=BENCH_LABEL)
+
+    neo4j = measure("neo4j", lambda elements: qa.execute_query_elements(elements, graph_label=BENCH_LABEL), workload)
+    memory = measure("snapshot", lambda elements: snapshot.lookup(qa.query_parameters(elements), BENCH_LABEL,
+                                                                 qa.result_limit), workload)
+
+    def triples(rows):
+        return sorted((row["h"], row["r"], row["t"]) for row in rows)
+
+    agreement = sum(triples(a) == triples(b) for a, b in zip(neo4j["results"], memory["results"])) / len(workload)
+    results = [{k: v for k, v in r.items() if k != "results"} for r in (neo4j, memory)]
+
+    print(f"{'方式':<10}{'p50 us':>12}{'p95 us':>12}{'平均 us':>12}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['p50_us']:>12.1f}{r['p95_us']:>12.1f}{r['mean_us']:>12.1f}")
+    print(f"快照 {size['bytes'] / 1e6:.1f} MB，加载 {size['load_seconds']:.2f}s，结果一致率 {agreement:.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"snapshot": size, "lookups": results, "agreement": agreement}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.drop:
+        qa.driver.execute_query(f"MATCH (n:{BENCH_LABEL}) DETACH DELETE n", database_=NEO4J_DATABASE)
+        qa.driver.execute_query("DROP INDEX graph_qa_bench_name IF EXISTS", database_=NEO4J_DATABASE)
+    qa.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+知识图谱构建：并行、增量地把 ./data/raw_knowledge 下的文档写入 Neo4j
+
+根目录下每个子文件夹是一个子知识图谱（子文件夹名作为 graph_label），其中的 .txt/.md 文件：
+    - 长文档按 chunk_size 切块，相邻块重叠 overlap 个字符，尽量在句末切分
+    - 所有待处理文档的块提交到同一个有界线程池并发调用 LLM 抽取，失败的块按指数退避重试
+    - 一个文档的全部块抽取完成后合并（块内局部 id 加块前缀，同名实体由 GraphIngestor 按稳定 id 合并），一次写入
+    - 本地清单记录每个文件的内容哈希和抽取配置，哈希和配置都没变的文件直接跳过
+全部文档写入后只递增一次图版本，常驻服务的内存快照随后重新加载。
+
+注意：增量构建只新增/合并实体和关系，修改后的文档中被删掉的三元组不会从图中移除，需要时用 --force 重建。
+
+用法:
+    python rag/knowledge_graph/build_graph.py
+    python rag/knowledge_graph/build_graph.py --labels FolderA --workers 16
+    python rag/knowledge_graph/build_graph.py --dry-run
+"""
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from rag.knowledge_graph.graph_snapshot import bump_graph_version
+from rag.knowledge_graph.text2graph_prompt import LLMGraphBuilder, GraphData
+from load_config import (
+    CHAT_MODEL,
+    KG_BUILD_ROOT,
+    KG_BUILD_MANIFEST,
+    KG_BUILD_WORKERS,
+    KG_BUILD_CHUNK_SIZE,
+    KG_BUILD_CHUNK_OVERLAP,
+    KG_BUILD_MAX_RETRIES,
+    KG_BUILD_BASE_BACKOFF
+)
+
+TEXT_SUFFIXES = (".txt", ".md")
+SENTENCE_ENDS = ("\n", "。", "！", "？", "；", ".", "!", "?")
+
+
+def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """按 chunk_size 切块，相邻块重叠约 overlap 个字符；块的后半段内有句末标点时在句末切分"""
+    if len(text) <= chunk_size:
+        return [text] if text.strip() else []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = max(text.rfind(sep, start + chunk_size // 2, end) for sep in SENTENCE_ENDS)
+            if cut != -1:
+                end = cut + 1
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        # 重叠部分从句首开始
+        overlap_start = max(end - overlap, start + 1)
+        boundaries = [i for i in (text.find(sep, overlap_start, end - 1) for sep in SENTENCE_ENDS) if i != -1]
+        start = min(boundaries) + 1 if boundaries else overlap_start
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def merge_chunks(results: List[GraphData]) -> GraphData:
+    """合并一个文档各块的抽取结果：块内局部 id（E1、E2…）加块序号前缀，避免不同块的 id 冲突"""
+    entities, relations = [], []
+    for index, graph_data in enumerate(results):
+        prefix = f"C{index}:"
+        entities.extend({"id": prefix + e.id, "type": e.type, "name": e.name} for e in graph_data.entities)
+        relations.extend({"from": prefix + r.from_, "to": prefix + r.to, "type": r.type} for r in graph_data.relations)
+    return GraphData.model_validate({"entities": entities, "relations": relations})
+
+
+def content_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class GraphBuildManifest:
+    """本地构建清单：{相对路径: {sha256, extractor, graph_label, entities, triples, built_at}}，每写入一个文档保存一次"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def unchanged(self, key: str, sha256: str, extractor: str) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry["sha256"] == sha256 and entry["extractor"] == extractor
+
+    def record(self, key: str, entry: dict):
+        self.entries[key] = entry
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再替换，构建中断时清单不会损坏
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def discover(root: str, labels: Optional[List[str]] = None) -> List[dict]:
+    """列出 root 下各子文件夹中的文本文件，返回 [{graph_label, path, key}]"""
+    documents = []
+    for graph_label in sorted(os.listdir(root)):
+        folder = os.path.join(root, graph_label)
+        if not os.path.isdir(folder) or (labels and graph_label not in labels):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(TEXT_SUFFIXES):
+                documents.append({
+                    "graph_label": graph_label,
+                    "path": os.path.join(folder, filename),
+                    "key": f"{graph_label}/{filename}",
+                })
+    return documents
+
+
+class GraphBuildRunner:
+    """
+    并行增量构建
+
+    LLM 抽取在有界线程池中并发执行（I/O 密集）；写入在主线程按文档顺序串行执行，
+    避免多个事务并发 MERGE 同一批实体时互相等待锁。
+    单个块抽取失败（限流、超时、输出不合法）时按指数退避重试 max_retries 次，仍失败才把整个文档记为失败。
+    """
+
+    def __init__(self, graph_builder: Optional[LLMGraphBuilder], manifest: GraphBuildManifest,
+                 workers: int = KG_BUILD_WORKERS, chunk_size: int = KG_BUILD_CHUNK_SIZE, overlap: int = KG_BUILD_CHUNK_OVERLAP,
+                 max_retries: int = KG_BUILD_MAX_RETRIES, base_backoff: float = KG_BUILD_BASE_BACKOFF):
+        self.graph_builder = graph_builder
+        self.manifest = manifest
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.retries = 0
+        self._lock = threading.Lock()
+        # 模型或切块参数变化时抽取结果会不同，清单中的旧记录不再有效
+        self.extractor = f"{CHAT_MODEL}:{chunk_size}:{overlap}"
+
+    def _extract(self, chunk: str) -> GraphData:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.graph_builder.validate_relations(self.graph_builder.extract_entities_and_relations(chunk))
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                delay = self.base_backoff * (2 ** attempt) * (1 + random.random())
+                print(f"块抽取失败，{delay:.1f}s 后重试（第 {attempt + 1} 次）: {str(e)}")
+                time.sleep(delay)
+
+    def plan(self, documents: List[dict], force: bool = False) -> List[dict]:
+        """计算内容哈希，返回需要重新构建的文档"""
+        pending = []
+        for document in documents:
+            document["sha256"] = content_hash(document["path"])
+            if force or not self.manifest.unchanged(document["key"], document["sha256"], self.extractor):
+                pending.append(document)
+        return pending
+
+    def run(self, documents: List[dict], force: bool = False, dry_run: bool = False) -> Dict[str, object]:
+        start = time.perf_counter()
+        pending = self.plan(documents, force)
+        report = {"files": len(documents), "skipped": len(documents) - len(pending), "built": 0, "failed": 0,
+                  "chunks": 0, "retries": 0, "entities": 0, "triples": 0, "documents": []}
+        if dry_run or not pending:
+            report["pending"] = [document["key"] for document in pending]
+            report["seconds"] = time.perf_counter() - start
+            return report
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # 先提交全部文档的全部块，线程池在写入前面文档时继续抽取后面的文档
+            for document in pending:
+                with open(document["path"], encoding="utf-8") as f:
+                    chunks = chunk_text(f.read(), self.chunk_size, self.overlap)
+                document["futures"] = [pool.submit(self._extract, chunk) for chunk in chunks]
+                report["chunks"] += len(chunks)
+
+            for document in pending:
+                try:
+                    graph_data = merge_chunks([future.result() for future in document.pop("futures")])
+                    stats = self.graph_builder.ingestor.ingest(graph_data, document["graph_label"], bump_version=False)
+                except Exception as e:
+                    report["failed"] += 1
+                    print(f"构建失败 {document['key']}: {str(e)}")
+                    continue
+                self.manifest.record(document["key"], {
+                    "sha256": document["sha256"],
+                    "extractor": self.extractor,
+                    "graph_label": document["graph_label"],
+                    "entities": stats["entities"],
+                    "triples": stats["triples"],
+                    "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                })
+                report["built"] += 1
+                report["entities"] += stats["entities"]
+                report["triples"] += stats["triples"]
+                report["documents"].append({"key": document["key"], **stats})
+                print(f"{document['key']}: {stats['entities']} 个实体，{stats['triples']} 个三元组")
+
+        report["retries"] = self.retries
+        if report["built"]:
+            report["graph_version"] = bump_graph_version(self.graph_builder.ingestor.driver)
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行增量构建知识图谱")
+    parser.add_argument("--root", default=KG_BUILD_ROOT, help="知识文档根目录，每个子文件夹是一个子知识图谱")
+    parser.add_argument("--manifest", default=KG_BUILD_MANIFEST, help="构建清单文件")
+    parser.add_argument("--labels", nargs="+", default=None, help="只构建指定的子文件夹")
+    parser.add_argument("--workers", type=int, default=KG_BUILD_WORKERS, help="并发抽取的线程数")
+    parser.add_argument("--chunk-size", type=int, default=KG_BUILD_CHUNK_SIZE, help="每块的字符数")
+    parser.add_argument("--overlap", type=int, default=KG_BUILD_CHUNK_OVERLAP, help="相邻块重叠的字符数")
+    parser.add_argument("--force", action="store_true", help="忽略清单，重新构建全部文件")
+    parser.add_argument("--dry-run", action="store_true", help="只列出需要重新构建的文件")
+    parser.add_argument("--output", default=None, help="保存报告的 JSON 文件")
+    args = parser.parse_args()
+
+    documents = discover(args.root, args.labels)
+    manifest = GraphBuildManifest(args.manifest)
+    if args.dry_run:
+        # 只计算哈希，不连接 Neo4j 和模型
+        runner = GraphBuildRunner(None, manifest, args.workers, args.chunk_size, args.overlap)
+    else:
+        runner = GraphBuildRunner(LLMGraphBuilder(), manifest, args.workers, args.chunk_size, args.overlap)
+    report = runner.run(documents, force=args.force, dry_run=args.dry_run)
+
+    if args.dry_run:
+        print(f"共 {report['files']} 个文件，{len(report['pending'])} 个需要重新构建：")
+        for key in report["pending"]:
+            print(f"  {key}")
+    else:
+        triples_per_second = report["triples"] / report["seconds"] if report["seconds"] else 0.0
+        print(f"\n共 {report['files']} 个文件：跳过 {report['skipped']}，构建 {report['built']}，失败 {report['failed']}，"
+              f"{report['chunks']} 个块（重试 {report['retries']} 次），{report['triples']} 个三元组，耗时 {report['seconds']:.1f}s"
+              f"（{triples_per_second:.0f} triples/s）")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"报告已保存到 {args.output}")
+    if runner.graph_builder is not None:
+        runner.graph_builder.ingestor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from load_config import KG_FAST_PATH_MIN_NAME_LENGTH, KG_FAST_PATH_MAX_NAME_LENGTH, KG_FAST_PATH_MAX_QUERY_ELEMENTS
+
+# 关系关键词词表：问题中出现这些词时认为在问对应的关系（与 LLM 抽取一致，头部实体取问题中的病症/疾病等实体）
+# 只收录问"头部实体 -> 尾部实体"方向的词：如"原因"问的是反向关系（什么导致了该实体），不收录，交给 LLM 抽取
+RELATION_KEYWORDS = {
+    "导致": ["导致", "引起", "引发", "造成", "诱发", "后果", "会怎样"],
+    "缓解": ["缓解", "减轻", "改善", "舒缓", "放松"],
+    "治疗": ["治疗", "疗法", "怎么治", "如何治", "吃什么药", "用什么药", "用药"],
+    "伴随": ["伴随", "伴有", "并发", "合并", "同时出现"],
+    "属于": ["属于", "是一种", "哪一类", "哪类"],
+    "包含": ["包含", "包括", "表现", "有哪些症状", "症状有"],
+}
+
+# 抽取结果的几种情况，除 HIT 外都回退到 LLM
+HIT = "hit"
+NO_ENTITY = "no_entity"
+NO_RELATION = "no_relation"
+AMBIGUOUS = "ambiguous"
+UNKNOWN_LABEL = "unknown_label"
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多模式匹配自动机（纯 Python），一次扫描找出文本中出现的全部词条
+
+    节点以整数编号，goto 为每个节点一个 dict；构建完成后每个节点的 outputs
+    已合并了失败链上的词条，匹配时不再沿失败链回溯。
+    """
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[Tuple[Tuple[int, int], ...]] = [()]
+        self.size = 0
+
+    def add(self, word: str, value: int):
+        node = 0
+        for char in word:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append(())
+            node = child
+        if not self.outputs[node]:
+            self.size += 1
+        self.outputs[node] = ((len(word), value),)
+
+    def build(self) -> "AhoCorasick":
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+        return self
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int, int]]:
+        """依次产出 (起点, 终点, value)，终点不含"""
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.outputs[node]:
+                yield end - length, end, value
+
+
+def leftmost_longest(matches: Iterable[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """从可能重叠的匹配中按“最左最长”选出互不重叠的匹配，例如“抑郁症”优先于其中的“抑郁”"""
+    selected = []
+    covered_until = 0
+    for start, end, value in sorted(matches, key=lambda match: (match[0], match[0] - match[1])):
+        if start >= covered_until:
+            selected.append((start, end, value))
+            covered_until = end
+    return selected
+
+
+def _overlaps(span: Tuple[int, int, int], spans: List[Tuple[int, int, int]]) -> bool:
+    return any(span[0] < other[1] and other[0] < span[1] for other in spans)
+
+
+class EntityMatcher:
+    """
+    基于知识图谱快照的本地查询元素抽取
+
+    自动机建立在快照中全部节点名称上（value 为快照的名称 id），按 graph_label 过滤时
+    只保留在该标签分区中作为节点名称出现过的匹配；关系由关系关键词词表确定。
+    只有结果明确时才返回查询元素：
+        - 没有匹配到实体或关系：NO_ENTITY / NO_RELATION
+        - 多个实体同时对应多个关系（无法判断对应关系），或查询元素数超过上限：AMBIGUOUS
+    """
+
+    def __init__(self, snapshot, relationships: List[str],
+                 min_name_length: int = KG_FAST_PATH_MIN_NAME_LENGTH,
+                 max_name_length: int = KG_FAST_PATH_MAX_NAME_LENGTH,
+                 max_query_elements: int = KG_FAST_PATH_MAX_QUERY_ELEMENTS):
+        start = time.perf_counter()
+        self.snapshot = snapshot
+        self.max_query_elements = max_query_elements
+        self.entities = AhoCorasick()
+        for name_id, name in enumerate(snapshot.names):
+            # 过短的名称（单字）误匹配太多，过长的名称基本不会原样出现在问题里
+            if min_name_length <= len(name) <= max_name_length:
+                self.entities.add(name, name_id)
+        self.entities.build()
+
+        self.relationships = [relationship for relationship in relationships if relationship in RELATION_KEYWORDS]
+        self.relations = AhoCorasick()
+        for relationship_id, relationship in enumerate(self.relationships):
+            for keyword in RELATION_KEYWORDS[relationship]:
+                self.relations.add(keyword, relationship_id)
+        self.relations.build()
+        self.build_seconds = time.perf_counter() - start
+
+    def extract(self, question: str, graph_label: Optional[str] = None) -> Tuple[Optional[List[dict]], str]:
+        """返回 (查询元素列表, 抽取情况)，查询元素只在抽取情况为 HIT 时不为 None"""
+        partition = self.snapshot.partitions.get(graph_label)
+        if partition is None:
+            return None, UNKNOWN_LABEL
+
+        entity_spans = leftmost_longest(
+            match for match in self.entities.iter_matches(question) if match[2] in partition.by_name
+        )
+        if not entity_spans:
+            return None, NO_ENTITY
+        # 落在实体名称内部的关键词不算（例如实体“治疗抵抗”中的“治疗”）
+        relation_spans = [span for span in leftmost_longest(self.relations.iter_matches(question))
+                          if not _overlaps(span, entity_spans)]
+        if not relation_spans:
+            return None, NO_RELATION
+
+        heads = list(dict.fromkeys(self.snapshot.names[name_id] for _, _, name_id in entity_spans))
+        relationships = list(dict.fromkeys(self.relationships[relationship_id] for _, _, relationship_id in relation_spans))
+        if (len(heads) > 1 and len(relationships) > 1) or len(heads) * len(relationships) > self.max_query_elements:
+            return None, AMBIGUOUS
+        return [
+            {"head_entity": head, "relationship": relationship, "tail_type": None}
+            for head in heads
+            for relationship in relationships
+        ], HIT
+
+
+class FastPathStats:
+    """本地抽取的命中率和节省的延迟（按 LLM 抽取的滑动平均延迟估算）"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._fast_latencies = deque(maxlen=window)
+        self._llm_latencies = deque(maxlen=window)
+        self.outcomes: Dict[str, int] = {}
+        self.empty_results = 0
+        self.llm_calls = 0
+
+    def record_fast(self, outcome: str, elapsed_us: float):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self._fast_latencies.append(elapsed_us)
+
+    def record_empty(self):
+        """本地抽取命中但图中查不到结果，改由 LLM 重新抽取"""
+        with self._lock:
+            self.empty_results += 1
+
+    def record_llm(self, elapsed_ms: float):
+        with self._lock:
+            self.llm_calls += 1
+            self._llm_latencies.append(elapsed_ms)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            attempts = sum(self.outcomes.values())
+            hits = self.outcomes.get(HIT, 0) - self.empty_results
+            fast = sorted(self._fast_latencies)
+            llm_mean_ms = sum(self._llm_latencies) / len(self._llm_latencies) if self._llm_latencies else 0.0
+            fast_mean_ms = sum(fast) / len(fast) / 1000 if fast else 0.0
+            return {
+                "attempts": attempts,
+                "hits": hits,
+                "hit_rate": hits / attempts if attempts else 0.0,
+                "outcomes": dict(self.outcomes),
+                "empty_results": self.empty_results,
+                "llm_calls": self.llm_calls,
+                "fast_p50_us": fast[len(fast) // 2] if fast else 0.0,
+                "fast_p95_us": fast[min(len(fast) - 1, int(len(fast) * 0.95))] if fast else 0.0,
+                "llm_mean_ms": llm_mean_ms,
+                "saved_ms": max(0.0, hits * (llm_mean_ms - fast_mean_ms)),
+            }
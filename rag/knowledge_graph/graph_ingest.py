@@ -0,0 +1,148 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import re
+import time
+import hashlib
+import logging
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+from neo4j import GraphDatabase
+
+from rag.knowledge_graph.graph_snapshot import ENTITY_LABEL, META_LABEL, bump_graph_version
+from rag.knowledge_graph.retrieve import LABEL_PATTERN, VALID_RELATIONSHIPS
+from load_config import (
+    NEO4J_URI,
+    NEO4J_USERNAME,
+    NEO4J_PASSWORD,
+    NEO4J_DATABASE,
+    KG_INGEST_BATCH_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_QUERIES = [
+    f"CREATE CONSTRAINT kg_entity_uid IF NOT EXISTS FOR (n:{ENTITY_LABEL}) REQUIRE n.uid IS UNIQUE",
+    f"CREATE INDEX kg_entity_name IF NOT EXISTS FOR (n:{ENTITY_LABEL}) ON (n.name)",
+    f"CREATE CONSTRAINT kg_meta_key IF NOT EXISTS FOR (m:{META_LABEL}) REQUIRE m.key IS UNIQUE",
+]
+# 检索按 (h:graph_label {name}) 匹配头部实体，每个子知识图谱标签一个 name 索引
+LABEL_INDEX_QUERY = "CREATE INDEX `kg_name_{label}` IF NOT EXISTS FOR (n:`{label}`) ON (n.name)"
+
+NODES_QUERY = """
+UNWIND $rows AS row
+MERGE (e:{entity_label} {{uid: row.uid}})
+ON CREATE SET e.name = row.name
+SET e{labels}
+"""
+# 关系类型不能参数化，用 FOREACH 按类型分支，一条语句写入一个文档的全部关系
+RELATIONS_QUERY = f"""
+UNWIND $rows AS row
+MATCH (h:{ENTITY_LABEL} {{uid: row.h}}), (t:{ENTITY_LABEL} {{uid: row.t}})
+""" + "\n".join(
+    f"FOREACH (_ IN CASE WHEN row.type = '{relation_type}' THEN [1] ELSE [] END | MERGE (h)-[:`{relation_type}`]->(t))"
+    for relation_type in VALID_RELATIONSHIPS
+)
+
+
+def normalize_name(name: str) -> str:
+    """实体名称规范化：全角/半角统一（NFKC）、去掉首尾空白并合并内部空白、英文小写"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", name)).strip().lower()
+
+
+def entity_uid(graph_label: str, entity_type: str, name: str) -> str:
+    """实体的稳定 id：同一子知识图谱中类型和规范化名称相同的实体，无论来自哪个文档都得到同一个 id"""
+    key = "\x1f".join((graph_label, normalize_name(entity_type), normalize_name(name)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class GraphIngestor:
+    """
+    知识图谱批量写入
+
+    实体按 (graph_label, 类型, 规范化名称) 的哈希 MERGE，重复写入同一文档或不同文档中的同名实体都是幂等的；
+    一个文档的节点按实体类型各一条 UNWIND 语句、关系一条 UNWIND 语句，在同一个写事务中提交。
+    """
+
+    def __init__(self, driver=None, batch_size: int = KG_INGEST_BATCH_SIZE):
+        self.driver = driver or GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+        self.batch_size = batch_size
+        self._indexed_labels: Set[str] = set()
+        self.ensure_schema()
+
+    def ensure_schema(self):
+        """创建唯一约束和索引（已存在时不做任何事）"""
+        for query in SCHEMA_QUERIES:
+            self.driver.execute_query(query, database_=NEO4J_DATABASE)
+
+    def ensure_label_index(self, graph_label: str):
+        if graph_label in self._indexed_labels:
+            return
+        self.driver.execute_query(LABEL_INDEX_QUERY.format(label=graph_label), database_=NEO4J_DATABASE)
+        self._indexed_labels.add(graph_label)
+
+    def prepare(self, graph_data, graph_label: str) -> Dict[str, object]:
+        """
+        把 LLM 抽取的 GraphData 转换为写入参数：文档内的局部 id（E1、E2…）映射为稳定 id，
+        文档内重复的实体和关系去重，端点不存在或类型不合法的关系丢弃。
+        """
+        uids: Dict[str, str] = {}
+        nodes: Dict[Optional[str], Dict[str, dict]] = {}
+        for entity in graph_data.entities:
+            if not entity.name or not entity.name.strip():
+                continue
+            entity_type = entity.type if LABEL_PATTERN.match(entity.type or "") else None
+            if entity_type is None:
+                logger.warning(f"实体类型不是合法标签，只写入名称: {entity.type!r} ({entity.name})")
+            uid = entity_uid(graph_label, entity.type or "", entity.name)
+            uids[entity.id] = uid
+            nodes.setdefault(entity_type, {}).setdefault(uid, {"uid": uid, "name": entity.name.strip()})
+
+        relations = {}
+        for relation in graph_data.relations:
+            head, tail = uids.get(relation.from_), uids.get(relation.to)
+            if head is None or tail is None or relation.type not in VALID_RELATIONSHIPS:
+                continue
+            relations[(head, relation.type, tail)] = {"h": head, "type": relation.type, "t": tail}
+
+        return {
+            "nodes": {entity_type: list(rows.values()) for entity_type, rows in nodes.items()},
+            "relations": list(relations.values()),
+        }
+
+    def _batches(self, rows: List[dict]):
+        for start in range(0, len(rows), self.batch_size):
+            yield rows[start:start + self.batch_size]
+
+    def _write(self, tx, graph_label: str, prepared: Dict[str, object]) -> Dict[str, int]:
+        counters = {"nodes_created": 0, "relationships_created": 0}
+        for entity_type, rows in prepared["nodes"].items():
+            labels = f":`{graph_label}`" + (f":`{entity_type}`" if entity_type else "")
+            query = NODES_QUERY.format(entity_label=ENTITY_LABEL, labels=labels)
+            for batch in self._batches(rows):
+                counters["nodes_created"] += tx.run(query, rows=batch).consume().counters.nodes_created
+        for batch in self._batches(prepared["relations"]):
+            counters["relationships_created"] += tx.run(RELATIONS_QUERY, rows=batch).consume().counters.relationships_created
+        return counters
+
+    def ingest(self, graph_data, graph_label: str, bump_version: bool = True) -> Dict[str, float]:
+        """写入一个文档抽取出的实体和关系，返回写入统计；bump_version 时递增图版本通知内存快照重新加载"""
+        if not LABEL_PATTERN.match(graph_label):
+            raise ValueError(f"非法的 graph_label: {graph_label!r}")
+        start = time.perf_counter()
+        self.ensure_label_index(graph_label)
+        prepared = self.prepare(graph_data, graph_label)
+        with self.driver.session(database=NEO4J_DATABASE) as session:
+            counters = session.execute_write(self._write, graph_label, prepared)
+        if bump_version:
+            bump_graph_version(self.driver)
+        return {
+            "entities": sum(len(rows) for rows in prepared["nodes"].values()),
+            "triples": len(prepared["relations"]),
+            **counters,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def close(self):
+        self.driver.close()
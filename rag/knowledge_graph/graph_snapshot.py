@@ -0,0 +1,306 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from neo4j import RoutingControl
+
+from load_config import NEO4J_DATABASE, KG_SNAPSHOT_MAX_NODES, KG_SNAPSHOT_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 知识图谱构建完成后递增该节点的 version，常驻的快照据此判断是否需要重新加载
+META_LABEL = "KGMeta"
+META_KEY = "snapshot"
+# GraphIngestor 写入的实体都带有该标签（uid 唯一约束所在的标签），不单独作为快照分区
+ENTITY_LABEL = "KGEntity"
+VERSION_QUERY = f"OPTIONAL MATCH (m:{META_LABEL} {{key: $key}}) RETURN m.version AS version"
+BUMP_VERSION_QUERY = f"""
+MERGE (m:{META_LABEL} {{key: $key}})
+SET m.version = coalesce(m.version, 0) + 1, m.updated_at = datetime()
+RETURN m.version AS version
+"""
+NODES_QUERY = f"MATCH (n) WHERE NOT n:{META_LABEL} RETURN elementId(n) AS id, n.name AS name, labels(n) AS labels"
+EDGES_QUERY = "MATCH (h)-[r]->(t) WHERE type(r) IN $types RETURN elementId(h) AS h, type(r) AS r, elementId(t) AS t"
+
+# 不限定 graph_label 时查询的全局分区
+GLOBAL_PARTITION = None
+
+
+def bump_graph_version(driver) -> int:
+    """知识图谱写入完成后调用，通知各进程的快照重新加载"""
+    records, _, _ = driver.execute_query(BUMP_VERSION_QUERY, key=META_KEY, database_=NEO4J_DATABASE)
+    return records[0]["version"]
+
+
+class GraphPartition:
+    """
+    一个分区（某个标签下的子图，或全局）的 CSR 邻接表
+
+    节点按分区内的局部下标编号；每种关系类型一组 offsets/targets：
+    节点 i 的出边终点为 targets[offsets[i]:offsets[i + 1]]。
+    """
+
+    def __init__(self, node_ids: np.ndarray, name_ids: np.ndarray, label_masks: np.ndarray,
+                 edges: Dict[int, Tuple[np.ndarray, np.ndarray]]):
+        self.node_ids = node_ids          # 局部下标 -> 全局节点下标
+        self.name_ids = name_ids          # 局部下标 -> 名称 id
+        self.label_masks = label_masks    # 局部下标 -> 标签位图
+        self.by_name: Dict[int, np.ndarray] = {}
+        order = np.argsort(name_ids, kind="stable")
+        if len(order):
+            boundaries = np.flatnonzero(np.diff(name_ids[order])) + 1
+            for group in np.split(order, boundaries):
+                self.by_name[int(name_ids[group[0]])] = group.astype(np.int32)
+        self.adjacency: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for relationship_id, (heads, tails) in edges.items():
+            order = np.argsort(heads, kind="stable")
+            offsets = np.zeros(len(node_ids) + 1, dtype=np.int32)
+            np.cumsum(np.bincount(heads, minlength=len(node_ids)), out=offsets[1:])
+            self.adjacency[relationship_id] = (offsets, tails[order].astype(np.int32))
+
+    def nbytes(self) -> int:
+        size = self.node_ids.nbytes + self.name_ids.nbytes + self.label_masks.nbytes
+        size += sum(nodes.nbytes for nodes in self.by_name.values())
+        size += sum(offsets.nbytes + targets.nbytes for offsets, targets in self.adjacency.values())
+        return size
+
+
+class GraphSnapshot:
+    """
+    知识图谱的只读内存快照：节点名称驻留为整数 id，每个标签一个分区（外加全局分区），
+    分区内每种关系类型一组 CSR 数组。查询语义与 GraphQA 的 Cypher 一致：
+    (h:{graph_label} {name})-[r:{relationship}]->(t:{graph_label}{tail_type})，每个查询元素最多 limit 条。
+    """
+
+    def __init__(self, version, names: List[str], labels: List[str], relationships: List[str],
+                 partitions: Dict[Optional[str], GraphPartition], load_seconds: float):
+        self.version = version
+        self.names = names
+        self.name_index = {name: i for i, name in enumerate(names)}
+        self.labels = labels
+        self.label_bits = {label: np.uint64(1) << np.uint64(i) for i, label in enumerate(labels)}
+        self.relationships = {relationship: i for i, relationship in enumerate(relationships)}
+        self.relationship_names = relationships
+        self.partitions = partitions
+        self.load_seconds = load_seconds
+        self.nodes = len(partitions[GLOBAL_PARTITION].node_ids)
+        self.edges = sum(len(targets) for _, targets in partitions[GLOBAL_PARTITION].adjacency.values())
+
+    @classmethod
+    def load(cls, driver, relationships: List[str], max_nodes: int = KG_SNAPSHOT_MAX_NODES) -> "GraphSnapshot":
+        start = time.perf_counter()
+        version = read_graph_version(driver)
+        node_records, _, _ = driver.execute_query(NODES_QUERY, database_=NEO4J_DATABASE, routing_=RoutingControl.READ)
+        if len(node_records) > max_nodes:
+            raise ValueError(f"知识图谱节点数 {len(node_records)} 超过快照上限 {max_nodes}")
+        edge_records, _, _ = driver.execute_query(
+            EDGES_QUERY, types=relationships, database_=NEO4J_DATABASE, routing_=RoutingControl.READ
+        )
+
+        names: List[str] = []
+        name_index: Dict[str, int] = {}
+        label_index: Dict[str, int] = {}
+        node_index: Dict[str, int] = {}
+        name_ids = np.empty(len(node_records), dtype=np.int32)
+        node_labels: List[List[int]] = []
+        for i, record in enumerate(node_records):
+            node_index[record["id"]] = i
+            # 名称驻留：相同名称只保存一份字符串
+            name = sys.intern(record["name"] or "")
+            name_ids[i] = name_index.setdefault(name, len(names))
+            if name_ids[i] == len(names):
+                names.append(name)
+            node_labels.append([label_index.setdefault(label, len(label_index)) for label in record["labels"]])
+        labels = sorted(label_index, key=label_index.get)
+        if len(labels) > 64:
+            raise ValueError(f"知识图谱标签数 {len(labels)} 超过快照位图上限 64")
+        label_masks = np.array([sum(1 << label_id for label_id in label_ids) for label_ids in node_labels], dtype=np.uint64)
+
+        relationship_index = {relationship: i for i, relationship in enumerate(relationships)}
+        edge_records = [record for record in edge_records if record["r"] in relationship_index]
+        heads = np.fromiter((node_index[record["h"]] for record in edge_records), dtype=np.int32, count=len(edge_records))
+        tails = np.fromiter((node_index[record["t"]] for record in edge_records), dtype=np.int32, count=len(edge_records))
+        edge_types = np.fromiter((relationship_index[record["r"]] for record in edge_records), dtype=np.int32,
+                                 count=len(edge_records))
+
+        partitions = {GLOBAL_PARTITION: cls._partition(np.arange(len(node_records), dtype=np.int32),
+                                                       name_ids, label_masks, heads, tails, edge_types)}
+        for label_id, label in enumerate(labels):
+            if label == ENTITY_LABEL:
+                continue
+            members = np.flatnonzero(label_masks & (np.uint64(1) << np.uint64(label_id))).astype(np.int32)
+            partitions[label] = cls._partition(members, name_ids, label_masks, heads, tails, edge_types)
+
+        return cls(version, names, labels, relationships, partitions, time.perf_counter() - start)
+
+    @staticmethod
+    def _partition(members: np.ndarray, name_ids: np.ndarray, label_masks: np.ndarray,
+                   heads: np.ndarray, tails: np.ndarray, edge_types: np.ndarray) -> GraphPartition:
+        local = np.full(len(name_ids), -1, dtype=np.int32)
+        local[members] = np.arange(len(members), dtype=np.int32)
+        # 只保留两端都在分区内的边
+        keep = (local[heads] >= 0) & (local[tails] >= 0)
+        local_heads, local_tails, local_types = local[heads[keep]], local[tails[keep]], edge_types[keep]
+        edges = {
+            int(relationship_id): (local_heads[local_types == relationship_id], local_tails[local_types == relationship_id])
+            for relationship_id in np.unique(local_types)
+        }
+        return GraphPartition(members, name_ids[members], label_masks[members], edges)
+
+    def lookup(self, queries: List[dict], graph_label: Optional[str], limit: int) -> Optional[List[dict]]:
+        """
+        按 GraphQA.query_parameters 生成的查询元素在内存中查询，结果顺序与查询元素一致；
+        快照中没有该 graph_label 分区时返回 None，由调用方回退到 Neo4j。
+        """
+        partition = self.partitions.get(graph_label)
+        if partition is None:
+            return None
+
+        results = []
+        for query in queries:
+            name_id = self.name_index.get(query["head_entity"])
+            relationship_id = self.relationships.get(query["relationship"])
+            if name_id is None or relationship_id is None or relationship_id not in partition.adjacency:
+                continue
+            heads = partition.by_name.get(name_id)
+            if heads is None:
+                continue
+            tail_bit = None
+            if query.get("tail_type") is not None:
+                tail_bit = self.label_bits.get(query["tail_type"])
+                if tail_bit is None:
+                    continue
+            offsets, targets = partition.adjacency[relationship_id]
+            found = 0
+            for head in heads:
+                tails = targets[offsets[head]:offsets[head + 1]]
+                if tail_bit is not None:
+                    tails = tails[(partition.label_masks[tails] & tail_bit) != 0]
+                for tail in tails[:limit - found]:
+                    results.append({
+                        'h': query["head_entity"],
+                        'r': query["relationship"],
+                        't': self.names[partition.name_ids[tail]]
+                    })
+                found += min(len(tails), limit - found)
+                if found >= limit:
+                    break
+        return results
+
+    def nbytes(self) -> int:
+        """快照占用的估计字节数（CSR 数组 + 驻留的名称字符串）"""
+        return sum(partition.nbytes() for partition in self.partitions.values()) + sum(sys.getsizeof(name) for name in self.names)
+
+
+def read_graph_version(driver):
+    records, _, _ = driver.execute_query(VERSION_QUERY, key=META_KEY, database_=NEO4J_DATABASE, routing_=RoutingControl.READ)
+    return records[0]["version"] if records else None
+
+
+class GraphSnapshotManager:
+    """
+    持有当前快照，后台按 refresh_interval 检查图版本，版本变化时重新加载并整体替换
+    （查询线程读到的始终是完整的旧快照或新快照）；加载失败时保留旧快照，查询回退到 Neo4j。
+    on_load 在新快照替换后于刷新线程中调用，用于构建依赖快照的其他索引。
+    """
+
+    def __init__(self, driver, relationships: List[str], refresh_interval: float = KG_SNAPSHOT_REFRESH_INTERVAL,
+                 latency_window: int = 1000, on_load: Optional[Callable[[GraphSnapshot], None]] = None):
+        self.driver = driver
+        self.on_load = on_load
+        self.relationships = relationships
+        self.refresh_interval = refresh_interval
+        self.snapshot: Optional[GraphSnapshot] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.loads = 0
+        self.load_failures = 0
+        self.hits = 0
+        self.fallbacks = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="kg-snapshot-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.refresh_interval)
+
+    def refresh(self, force: bool = False) -> bool:
+        """图版本变化（或尚未加载）时重新加载快照，返回是否加载了新快照"""
+        try:
+            if not force and self.snapshot is not None and read_graph_version(self.driver) == self.snapshot.version:
+                return False
+            snapshot = GraphSnapshot.load(self.driver, self.relationships)
+        except Exception as e:
+            with self._lock:
+                self.load_failures += 1
+            logger.warning(f"知识图谱快照加载失败，查询回退到 Neo4j: {str(e)}")
+            return False
+        self.snapshot = snapshot
+        with self._lock:
+            self.loads += 1
+        logger.info(f"Loaded KG snapshot version={snapshot.version} nodes={snapshot.nodes} edges={snapshot.edges} "
+                    f"bytes={snapshot.nbytes()} in {snapshot.load_seconds:.2f}s")
+        if self.on_load is not None:
+            try:
+                self.on_load(snapshot)
+            except Exception as e:
+                logger.warning(f"知识图谱快照加载后的回调失败: {str(e)}")
+        return True
+
+    def lookup(self, queries: List[dict], graph_label: Optional[str], limit: int) -> Optional[List[dict]]:
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        start = time.perf_counter()
+        results = snapshot.lookup(queries, graph_label, limit)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        with self._lock:
+            if results is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+                self._latencies.append(elapsed_us)
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        snapshot = self.snapshot
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "loaded": snapshot is not None,
+                "loads": self.loads,
+                "load_failures": self.load_failures,
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+                "lookup_p50_us": latencies[len(latencies) // 2] if latencies else 0.0,
+                "lookup_p95_us": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+            }
+        if snapshot is not None:
+            stats.update({
+                "version": snapshot.version,
+                "nodes": snapshot.nodes,
+                "edges": snapshot.edges,
+                "partitions": len(snapshot.partitions),
+                "bytes": snapshot.nbytes(),
+                "load_seconds": snapshot.load_seconds,
+            })
+        return stats
@@ -1,13 +1,33 @@
 import rootutils
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
+import re
+import time
+import atexit
+import threading
 import instructor
 from openai import OpenAI
-from typing import List, Optional
+from typing import List, Optional, Set
 from pydantic import BaseModel, Field
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, RoutingControl
 
-from load_config import NEO4J_URI, NEO4J_USERNAME, NEO4J_PASSWORD, API_KEY, CHAT_MODEL
+from rag.knowledge_graph.graph_snapshot import GraphSnapshotManager
+from rag.knowledge_graph.entity_matcher import EntityMatcher, FastPathStats, HIT
+from load_config import (
+    NEO4J_URI,
+    NEO4J_USERNAME,
+    NEO4J_PASSWORD,
+    NEO4J_DATABASE,
+    NEO4J_MAX_POOL_SIZE,
+    NEO4J_ACQUISITION_TIMEOUT,
+    NEO4J_MAX_CONNECTION_LIFETIME,
+    NEO4J_POOL_PREWARM,
+    NEO4J_RESULT_LIMIT,
+    KG_SNAPSHOT_ENABLED,
+    KG_FAST_PATH_ENABLED,
+    API_KEY,
+    CHAT_MODEL
+)
 
 import logging
 from logging_config import setup_logging
@@ -29,109 +49,255 @@ class QueryElement(BaseModel):
 class QueryElements(BaseModel):
     queries: List[QueryElement] = Field(..., description="查询元素列表")
 
+# 标签只能拼接进 Cypher 文本（无法参数化），必须是合法标识符
+LABEL_PATTERN = re.compile(r"^[A-Za-z_\u4e00-\u9fff][A-Za-z0-9_\u4e00-\u9fff]*$")
+
+# 关系类型集合固定写在查询中，具体类型作为参数过滤，查询文本不随问题变化，Neo4j 可以复用执行计划
+RELATIONSHIP_PATTERN = "|".join(f"`{relationship}`" for relationship in VALID_RELATIONSHIPS)
+QUERY_TEMPLATE = """
+UNWIND $queries AS q
+CALL {{
+    WITH q
+    MATCH (h{label} {{name: q.head_entity}})-[r:{relationships}]->(t{label})
+    WHERE type(r) = q.relationship AND (q.tail_type IS NULL OR q.tail_type IN labels(t))
+    RETURN h.name AS h, type(r) AS r, t.name AS t
+    LIMIT $limit
+}}
+RETURN q.index AS query_index, h, r, t
+"""
+
+
 class GraphQA:
-    def __init__(self):
-        self.driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
-        self.client = instructor.from_openai(OpenAI(api_key=API_KEY), mode=instructor.Mode.JSON)
+    """
+    知识图谱问答服务，进程内常驻
 
-    def generate_cypher_query(self, query_element: QueryElement, graph_label: Optional[str] = None) -> str:
-        """
-        生成 Cypher 查询语句；若传入了 graph_label，则只匹配该子知识图谱。
+    Neo4j 驱动（连接池）和 instructor 客户端只在创建时初始化一次，由 get_graph_qa() 共享；
+    一个问题抽取出的全部查询元素优先在知识图谱内存快照中查询，
+    快照未加载或没有对应 graph_label 分区时，以参数形式通过一次 UNWIND 查询在 Neo4j 中执行。
+    快照加载后同时构建节点名称词典，问题中的实体和关系能明确匹配时在本地抽取查询元素，不再调用 LLM。
+    """
+
+    def __init__(self, prewarm: bool = NEO4J_POOL_PREWARM, result_limit: int = NEO4J_RESULT_LIMIT):
+        self.driver = GraphDatabase.driver(
+            NEO4J_URI,
+            auth=(NEO4J_USERNAME, NEO4J_PASSWORD),
+            max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT,
+            max_connection_lifetime=NEO4J_MAX_CONNECTION_LIFETIME
+        )
+        self._client = None
+        self.result_limit = result_limit
+        self._labels: Set[str] = set()
+        self._labels_lock = threading.Lock()
+        # 本地抽取依赖快照中的节点名称，关闭快照时也不启用
+        self.fast_path = KG_SNAPSHOT_ENABLED and KG_FAST_PATH_ENABLED
+        self.matcher: Optional[EntityMatcher] = None
+        self.fast_path_stats = FastPathStats()
+        self.snapshot = GraphSnapshotManager(
+            self.driver, VALID_RELATIONSHIPS, on_load=self._build_matcher if self.fast_path else None
+        ) if KG_SNAPSHOT_ENABLED else None
+        if prewarm:
+            threading.Thread(target=self._prewarm, daemon=True).start()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = instructor.from_openai(OpenAI(api_key=API_KEY), mode=instructor.Mode.JSON)
+        return self._client
+
+    def _prewarm(self):
+        """在后台建立第一条连接并读取图中的标签，首次检索不再承担建连和路由发现的开销；随后加载内存快照"""
+        try:
+            self.driver.verify_connectivity()
+            self._refresh_labels()
+        except Exception as e:
+            logger.warning(f"Neo4j 连接池预热失败: {str(e)}")
+        if self.snapshot is not None:
+            self.snapshot.start()
+
+    def _build_matcher(self, snapshot):
+        """快照刷新后重建节点名称词典，构建完成后整体替换"""
+        matcher = EntityMatcher(snapshot, VALID_RELATIONSHIPS)
+        self.matcher = matcher
+        logger.info(f"Built entity matcher over {matcher.entities.size} names in {matcher.build_seconds:.2f}s")
+
+    def _refresh_labels(self):
+        records, _, _ = self.driver.execute_query(
+            "CALL db.labels() YIELD label RETURN label",
+            database_=NEO4J_DATABASE,
+            routing_=RoutingControl.READ
+        )
+        with self._labels_lock:
+            self._labels = {record["label"] for record in records}
+
+    def validate_label(self, graph_label: Optional[str]) -> Optional[str]:
+        """graph_label 必须是图中已存在的标签（白名单），未知标签先刷新一次标签列表再判断"""
+        if graph_label is None:
+            return None
+        if not LABEL_PATTERN.match(graph_label):
+            raise ValueError(f"非法的 graph_label: {graph_label!r}")
+        with self._labels_lock:
+            known = graph_label in self._labels
+        if not known:
+            self._refresh_labels()
+            with self._labels_lock:
+                known = graph_label in self._labels
+        if not known:
+            raise ValueError(f"知识图谱中不存在标签: {graph_label!r}")
+        return graph_label
+
+    def build_cypher_query(self, graph_label: Optional[str] = None) -> str:
         """
-        tail_type_clause = f":{query_element.tail_type}" if query_element.tail_type else ""
-        
-        # 如果有子知识图谱 label，则构造一个 ":FolderA" 这样的字符串，否则为空
-        subfolder_head = f":{graph_label}" if graph_label else ""
-        subfolder_tail = f":{graph_label}" if graph_label else ""
-        
-        # 把上面构造的 label 放到 MATCH 里
-        cypher = f"""
-        MATCH (h{subfolder_head} {{name: '{query_element.head_entity}'}})-[r:{query_element.relationship}]->(t{subfolder_tail}{tail_type_clause})
-        RETURN h, r, t
-        LIMIT 10
+        生成 UNWIND 查询语句；若传入了 graph_label，则头尾节点都只匹配该子知识图谱。
+        查询文本只随 graph_label 变化，实体、关系和尾部类型都作为参数传入。
         """
-        logger.debug(f"Generated Cypher query: {cypher}")
-        return cypher
-
-    def execute_cypher_query(self, cypher_query: str) -> List[dict]:
-        with self.driver.session() as session:
-            result = session.run(cypher_query)
-            records = result.fetch(10)
-            logger.info(f"Executed Cypher query, returned {len(records)} records")
-            simplified_results = []
-            for record in records:
-                simplified_results.append({
-                    'h': record['h']['name'],
-                    'r': record['r'].type,
-                    't': record['t']['name']
-                })
-            return simplified_results
+        label = f":`{self.validate_label(graph_label)}`" if graph_label else ""
+        return QUERY_TEMPLATE.format(label=label, relationships=RELATIONSHIP_PATTERN)
+
+    @staticmethod
+    def query_parameters(query_elements: List[QueryElement]) -> List[dict]:
+        """把查询元素转换为 UNWIND 参数，丢弃关系或尾部类型不在白名单中的元素"""
+        parameters = []
+        for index, element in enumerate(query_elements):
+            if element.relationship not in VALID_RELATIONSHIPS:
+                logger.warning(f"Skipping query element with unknown relationship: {element.relationship}")
+                continue
+            tail_type = element.tail_type if element.tail_type in NODE_TYPES else None
+            parameters.append({
+                "index": index,
+                "head_entity": element.head_entity,
+                "relationship": element.relationship,
+                "tail_type": tail_type,
+            })
+        return parameters
+
+    def execute_query_elements(self, query_elements: List[QueryElement], graph_label: Optional[str] = None) -> List[dict]:
+        """一次往返执行所有查询元素，结果按查询元素的顺序返回"""
+        parameters = self.query_parameters(query_elements)
+        if not parameters:
+            return []
+        if self.snapshot is not None:
+            results = self.snapshot.lookup(parameters, graph_label, self.result_limit)
+            if results is not None:
+                return results
+        cypher_query = self.build_cypher_query(graph_label)
+        records, _, _ = self.driver.execute_query(
+            cypher_query,
+            queries=parameters,
+            limit=self.result_limit,
+            database_=NEO4J_DATABASE,
+            routing_=RoutingControl.READ
+        )
+        logger.info(f"Executed {len(parameters)} query elements in one query, returned {len(records)} records")
+        records = sorted(records, key=lambda record: record["query_index"])
+        return [{'h': record['h'], 'r': record['r'], 't': record['t']} for record in records]
+
+    def extract_query_elements(self, question: str) -> QueryElements:
+        return self.client.chat.completions.create(
+            model=CHAT_MODEL,
+            response_model=QueryElements,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"""
+                    你是一个AI助手，专门用于理解问题并提取查询Neo4j图数据库所需的关键元素。
+                    有效的关系类型包括：{', '.join(VALID_RELATIONSHIPS)}
+                    节点类型包括：{', '.join(NODE_TYPES)}
+                    如果问题涉及多个实体或关系，请生成多个查询元素。每个查询元素应包含头部实体和关系。
+                    在99%的情况下，不需要指定尾部实体的类型。只有在问题中明确要求特定类型的尾部实体时才应指定尾部类型。
+                    注意：头部实体通常与病症或疾病术语有关。
+                    """
+                },
+                {
+                    "role": "user",
+                    "content": f"请从以下问题中提取所需的查询元素：{question}"
+                }
+            ]
+        )
+
+    def extract_query_elements_fast(self, question: str, graph_label: Optional[str] = None) -> Optional[List[QueryElement]]:
+        """用节点名称词典在本地抽取查询元素；词典未构建、没有匹配或匹配不明确时返回 None"""
+        matcher = self.matcher
+        if matcher is None:
+            return None
+        start = time.perf_counter()
+        queries, outcome = matcher.extract(question, graph_label)
+        self.fast_path_stats.record_fast(outcome, (time.perf_counter() - start) * 1e6)
+        if outcome != HIT:
+            logger.info(f"Fast path extraction missed ({outcome}), falling back to LLM")
+            return None
+        return [QueryElement(**query) for query in queries]
 
     def query(self, question: str, graph_label: Optional[str] = None) -> List[dict]:
         """
         增加 graph_label，用于指定要检索哪个子知识图谱；
         如果不传，则默认检索全局。
+        优先在本地抽取查询元素，未命中或本地抽取的结果在图中查不到时再由 LLM 抽取。
         """
         logger.info(f"Received question: {question}")
         try:
-            query_elements: QueryElements = self.client.chat.completions.create(
-                model=CHAT_MODEL,
-                response_model=QueryElements,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": f"""
-                        你是一个AI助手，专门用于理解问题并提取查询Neo4j图数据库所需的关键元素。
-                        有效的关系类型包括：{', '.join(VALID_RELATIONSHIPS)}
-                        节点类型包括：{', '.join(NODE_TYPES)}
-                        如果问题涉及多个实体或关系，请生成多个查询元素。每个查询元素应包含头部实体和关系。
-                        在99%的情况下，不需要指定尾部实体的类型。只有在问题中明确要求特定类型的尾部实体时才应指定尾部类型。
-                        注意：头部实体通常与病症或疾病术语有关。
-                        """
-                    },
-                    {
-                        "role": "user",
-                        "content": f"请从以下问题中提取所需的查询元素：{question}"
-                    }
-                ]
-            )
-            
+            if self.fast_path:
+                query_elements = self.extract_query_elements_fast(question, graph_label)
+                if query_elements is not None:
+                    logger.info(f"Fast path extracted {len(query_elements)} query elements")
+                    all_results = self.execute_query_elements(query_elements, graph_label=graph_label)
+                    if all_results:
+                        return all_results
+                    self.fast_path_stats.record_empty()
+
+            start = time.perf_counter()
+            query_elements = self.extract_query_elements(question)
+            self.fast_path_stats.record_llm((time.perf_counter() - start) * 1000)
             logger.info(f"Generated {len(query_elements.queries)} query elements")
-            
-            all_results = []
-            for query_element in query_elements.queries:
-                # 调用 generate_cypher_query 时，额外传入 graph_label
-                cypher_query = self.generate_cypher_query(query_element, graph_label=graph_label)
-                logger.debug(f"Generated Cypher query: {cypher_query}")
-                
-                result = self.execute_cypher_query(cypher_query)
-                all_results.extend(result)
-                
-                if not result:
-                    logger.warning(f"Empty result for query: {cypher_query}")
-            
+
+            all_results = self.execute_query_elements(query_elements.queries, graph_label=graph_label)
             if not all_results:
                 logger.warning("All queries returned empty results")
-            
             return all_results
         except Exception as e:
             logger.error(f"Error occurred during query processing: {str(e)}", exc_info=True)
             return []
 
+    def stats(self) -> dict:
+        return {
+            "snapshot": self.snapshot.stats() if self.snapshot is not None else {"enabled": False},
+            "fast_path": self.fast_path_stats.stats() if self.fast_path else {"enabled": False},
+        }
+
     def close(self):
+        if self.snapshot is not None:
+            self.snapshot.stop()
         self.driver.close()
         logger.info("Closed Neo4j driver connection")
 
+
+_graph_qa: Optional[GraphQA] = None
+_graph_qa_lock = threading.Lock()
+
+
+def get_graph_qa() -> GraphQA:
+    """返回进程内共享的 GraphQA，首次调用时创建（驱动连接池随进程存活）"""
+    global _graph_qa
+    with _graph_qa_lock:
+        if _graph_qa is None:
+            _graph_qa = GraphQA()
+            atexit.register(close_graph_qa)
+        return _graph_qa
+
+
+def close_graph_qa():
+    global _graph_qa
+    with _graph_qa_lock:
+        if _graph_qa is not None:
+            _graph_qa.close()
+            _graph_qa = None
+
+
 def run(query, graph_label=None):
     """
-    run 函数同样增加一个可选的 graph_label 参数。
+    run 函数同样增加一个可选的 graph_label 参数；使用共享的 GraphQA，不再每次调用都新建和关闭驱动。
     """
-    qa = GraphQA()
-    try:
-        result = qa.query(query, graph_label=graph_label)
-        return result
-    finally:
-        qa.close()
+    return get_graph_qa().query(query, graph_label=graph_label)
 
 
 if __name__ == "__main__":
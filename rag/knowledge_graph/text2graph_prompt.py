@@ -1,13 +1,11 @@
 import rootutils
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
-import os
-
 from openai import OpenAI
 from typing import List, Dict, Any
 from pydantic import BaseModel, Field
-from langchain_community.graphs import Neo4jGraph
-from load_config import CHAT_MODEL, API_KEY, NEO4J_URI, NEO4J_USERNAME, NEO4J_PASSWORD
+from rag.knowledge_graph.graph_ingest import GraphIngestor
+from load_config import CHAT_MODEL, API_KEY, NEO4J_DATABASE
 
 
 class Entity(BaseModel):
@@ -31,11 +29,8 @@ RELATION_TYPES = ["导致", "缓解", "治疗", "伴随", "属于", "包含"]
 class LLMGraphBuilder:
     def __init__(self):
         self.client = OpenAI(api_key=API_KEY)
-        self.graph = Neo4jGraph(
-            url=NEO4J_URI,
-            username=NEO4J_USERNAME,
-            password=NEO4J_PASSWORD
-        )
+        # 启动时创建唯一约束和索引；实体按稳定 id 批量 MERGE
+        self.ingestor = GraphIngestor()
 
     def extract_entities_and_relations(self, text: str) -> GraphData:
         completion = self.client.chat.completions.create(
@@ -84,85 +79,29 @@ class LLMGraphBuilder:
         ]
         return GraphData(entities=graph_data.entities, relations=valid_relations)
 
-    def generate_cypher_queries(self, graph_data: GraphData, graph_label: str) -> List[str]:
+    def build_graph(self, text: str, graph_label: str) -> Dict[str, float]:
         """
-        graph_label 用于区分不同子文件夹对应的知识图谱。
-        可以将 graph_label 视为一个额外的标签（Label），比如 "FolderA"、"FolderB" 等。
+        graph_label 用于区分不同子文件夹对应的知识图谱，作为实体的额外标签（Label），比如 "FolderA"、"FolderB" 等。
+        实体按 (graph_label, 类型, 规范化名称) 得到稳定 id，不同文档中的同名实体合并为同一个节点，
+        重复写入同一文档不会产生重复的节点和关系。
         """
-        queries = []
-
-        # 生成创建/合并实体的 Cypher 语句：这里在实体类型的 Label 前增加一个 "graph_label"
-        # 例如 MERGE (e:FolderA:症状 {id: "E1", name: "头痛"})
-        # 这样就能在同一个 Neo4j 数据库里，用不同的 Label 区分子文件夹
-        for entity in graph_data.entities:
-            query = f"""
-            MERGE (e:{graph_label}:{entity.type} {{id: '{entity.id}'}})
-            ON CREATE SET e.name = '{entity.name}'
-            ON MATCH SET e.name = '{entity.name}'
-            """
-            queries.append(query)
-
-        # 生成创建/合并关系的 Cypher 语句：关系两端也加上 graph_label
-        # 使得只有同一子文件夹 (graph_label) 下的实体才能互相关联
-        for relation in graph_data.relations:
-            query = f"""
-            MATCH (e1:{graph_label} {{id: '{relation.from_}'}})
-            MATCH (e2:{graph_label} {{id: '{relation.to}'}})
-            MERGE (e1)-[r:{relation.type}]->(e2)
-            """
-            queries.append(query)
-        return queries
-
-    def build_graph(self, text: str, graph_label: str):
         # 提取实体和关系
         graph_data = self.extract_entities_and_relations(text)
         # 校验关系合法性
         validated_graph_data = self.validate_relations(graph_data)
-        # 生成 Cypher 查询
-        queries = self.generate_cypher_queries(validated_graph_data, graph_label)
-        # 执行 Cypher 查询，更新 Neo4j 图数据库
-        for query in queries:
-            self.graph.query(query)
-        print(f"知识图谱 {graph_label} 更新完成。")
+        # 批量写入 Neo4j 并递增图版本，常驻服务的内存快照随后重新加载
+        stats = self.ingestor.ingest(validated_graph_data, graph_label)
+        print(f"知识图谱 {graph_label} 更新完成：{stats['entities']} 个实体，{stats['triples']} 个三元组，"
+              f"耗时 {stats['seconds']:.2f}s。")
+        return stats
 
     def query_graph(self, cypher_query: str) -> List[Dict[str, Any]]:
-        return self.graph.query(cypher_query)
+        records, _, _ = self.ingestor.driver.execute_query(cypher_query, database_=NEO4J_DATABASE)
+        return [record.data() for record in records]
 
 
 if __name__ == "__main__":
-    # 假设根目录为 "database"
-    root_folder_path = "./data/raw_knowledge"
-    
-    builder = LLMGraphBuilder()
-    
-    # 获取 root_folder_path 下所有的子文件夹
-    subfolders = [
-        d for d in os.listdir(root_folder_path)
-        if os.path.isdir(os.path.join(root_folder_path, d))
-    ]
-    
-    # 遍历每个子文件夹，并将其视作一个独立的知识图谱
-    for subfolder_name in subfolders:
-        subfolder_path = os.path.join(root_folder_path, subfolder_name)
-        
-        # 获取子文件夹下所有的 .txt 和 .md 文件
-        all_files = os.listdir(subfolder_path)
-        text_files = [
-            f for f in all_files
-            if f.endswith(".txt") or f.endswith(".md")
-        ]
-        
-        # 依次读取每个文本文件的内容并写入当前子文件夹的知识图谱
-        for filename in text_files:
-            file_path = os.path.join(subfolder_path, filename)
-            with open(file_path, "r", encoding="utf-8") as file:
-                text = file.read()
-            
-            # 这里的 graph_label 用子文件夹名 subfolder_name 来区分
-            builder.build_graph(text, graph_label=subfolder_name)
-
-    # 测试查询：比如查询所有 Label 中名为 '头痛' 的节点
-    # 这里可以写类似 "MATCH (n) WHERE n.name='头痛' RETURN n"，
-    # 或者给定具体 Label "MATCH (n:某个文件夹名) RETURN n" 之类的灵活查询。
-    query_result = builder.query_graph("MATCH (n) RETURN n LIMIT 50")
-    print("查询结果:", query_result)
\ No newline at end of file
+    # 遍历 ./data/raw_knowledge 下的子文件夹构建知识图谱，子文件夹名作为 graph_label；
+    # 切块、并行抽取和增量跳过见 build_graph.py
+    from rag.knowledge_graph.build_graph import main
+    main()
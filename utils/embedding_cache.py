@@ -0,0 +1,239 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import os
+import re
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from load_config import EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MEMORY_SIZE
+
+
+def normalize_text(text: str) -> str:
+    """统一全半角、去除首尾空白并折叠连续空白，使等价文本得到相同的缓存键"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class SQLiteEmbeddingStore:
+    """磁盘缓存层：以 float32 二进制形式保存向量"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, array]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector
+        return found
+
+    def put_many(self, items: Dict[str, array]):
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache:
+    """
+    两级嵌入缓存：进程内 LRU + 磁盘 sqlite
+
+    缓存键为 sha256(模型名 + 规范化文本)，不同模型的向量互不干扰，
+    因此整个进程可以共享同一个缓存实例。向量以 array('f')（float32）保存，
+    每个分量 4 字节，而 Python float 列表每个分量约 32 字节。
+    """
+
+    def __init__(self, memory_size: int = 10000, disk_path: Optional[str] = None):
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = SQLiteEmbeddingStore(disk_path) if disk_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, array]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self.memory_hits += len(found)
+
+        remaining = [key for key in keys if key not in found]
+        if remaining and self.disk is not None:
+            from_disk = self.disk.get_many(remaining)
+            self._remember(from_disk)
+            with self._lock:
+                self.disk_hits += len(from_disk)
+            found.update(from_disk)
+
+        with self._lock:
+            self.misses += len([key for key in keys if key not in found])
+        return found
+
+    def put_many(self, items: Dict[str, array]):
+        self._remember(items)
+        if self.disk is not None:
+            self.disk.put_many(items)
+
+    def record_upstream_call(self):
+        with self._lock:
+            self.upstream_calls += 1
+
+    def _remember(self, items: Dict[str, array]):
+        with self._lock:
+            for key, vector in items.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "upstream_calls": self.upstream_calls,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    为任意 Embeddings 实例加上缓存的包装器
+
+    只有缓存未命中的文本才会发送给底层模型；同一批次中的重复文本只请求一次。
+    规范化文本只用于生成缓存键，发送给模型的仍是原文。
+    返回的向量统一取自缓存中的 float32 值，命中与未命中时结果一致。
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: Optional[str] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name or _model_name(embeddings)
+
+    def _lookup(self, texts: List[str]):
+        keys = [embedding_key(self.model_name, normalize_text(text)) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        return keys, found, missing
+
+    def _store(self, missing: Dict[str, str], vectors: List[List[float]], found: Dict[str, array]):
+        computed = {key: array("f", vector) for key, vector in zip(missing.keys(), vectors)}
+        self.cache.put_many(computed)
+        self.cache.record_upstream_call()
+        found.update(computed)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(missing, vectors, found)
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found, missing = self._lookup([text])
+        if missing:
+            self._store(missing, [self.embeddings.embed_query(next(iter(missing.values())))], found)
+        return found[keys[0]].tolist()
+
+    # 异步版本中缓存读写（可能访问 sqlite）放到线程中执行，不阻塞事件循环
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._store, missing, vectors, found)
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found, missing = await asyncio.to_thread(self._lookup, [text])
+        if missing:
+            vector = await self.embeddings.aembed_query(next(iter(missing.values())))
+            await asyncio.to_thread(self._store, missing, [vector], found)
+        return found[keys[0]].tolist()
+
+    def stats(self) -> Dict[str, float]:
+        return self.cache.stats()
+
+
+def _model_name(embeddings: Embeddings) -> str:
+    name = type(embeddings).__name__
+    for attr in ("model", "model_name", "deployment"):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str) and value:
+            name = f"{name}:{value}"
+            break
+    # 自定义服务地址（如本地伪嵌入服务）的向量不能与官方接口的向量混用
+    base_url = getattr(embeddings, "openai_api_base", None) or getattr(embeddings, "base_url", None)
+    if isinstance(base_url, str) and base_url:
+        name = f"{name}@{base_url}"
+    return name
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """返回进程内共享的嵌入缓存"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache(
+                memory_size=EMBEDDING_CACHE_MEMORY_SIZE,
+                disk_path=EMBEDDING_CACHE_PATH,
+            )
+        return _shared_cache
+
+
+def cached_embeddings(embeddings: Embeddings) -> Embeddings:
+    """用共享缓存包装 Embeddings 实例；配置中关闭缓存时原样返回"""
+    if not EMBEDDING_CACHE_ENABLED or isinstance(embeddings, CachedEmbeddings):
+        return embeddings
+    return CachedEmbeddings(embeddings, get_embedding_cache())
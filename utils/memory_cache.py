@@ -0,0 +1,275 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from load_config import (
+    MEMORY_CACHE_ENABLED,
+    MEMORY_CACHE_MAX_ENTRIES,
+    MEMORY_CACHE_TTL_SECONDS,
+    MEMORY_STORE_DB_NAME,
+    MEMORY_STORE_COLLECTION
+)
+
+logger = logging.getLogger(__name__)
+
+# 未指定类别（读取用户全部类别）时使用的缓存键
+ALL_CATEGORIES = "*"
+
+
+class MemoryCache:
+    """
+    进程内的用户最新记忆读穿缓存
+
+    以 (user_id, category) 为键缓存该类别下全部最新记忆（不做置信度过滤，过滤在读取时进行），
+    空类别同样缓存，避免反复查询没有记忆的类别。容量按 LRU 淘汰，条目超过 TTL 后失效。
+    同进程内的写入由记忆存储调用 invalidate；跨进程的写入由 change stream 监听线程失效。
+
+    失效代数取自全局递增计数；代数表超过容量时清理最久未写入且没有缓存条目的用户，
+    被清理的用户统一返回代数下限（不低于被清理的代数），读库期间发生的写入不会因清理而被漏判。
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[dict]]]" = OrderedDict()
+        # 每个用户的失效代数：读库前记下，写回时代数已变说明期间有写入，丢弃这次结果
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._generation_counter = 0
+        self._generation_floor = 0
+        # 缓存条目中记忆 _id -> (user_id, category)，供没有 fullDocument 的删除事件定位所属用户
+        self._owners: Dict[Any, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, user_id: str) -> int:
+        with self._lock:
+            return self._generations.get(user_id, self._generation_floor)
+
+    def owner(self, memory_id: Any) -> Optional[Tuple[str, str]]:
+        """返回缓存中某条记忆所属的 (user_id, category)，未被缓存时返回 None"""
+        with self._lock:
+            return self._owners.get(memory_id)
+
+    @staticmethod
+    def _iter_memories(key: Tuple[str, str], docs) -> Iterator[Tuple[str, dict]]:
+        # "全部类别"条目的值是 类别->记忆列表，单类别条目的值是记忆列表
+        if key[1] == ALL_CATEGORIES:
+            for category, items in docs.items():
+                for memory in items:
+                    yield category, memory
+        else:
+            for memory in docs:
+                yield key[1], memory
+
+    def _track(self, key: Tuple[str, str], docs):
+        for category, memory in self._iter_memories(key, docs):
+            if "_id" in memory:
+                self._owners[memory["_id"]] = (key[0], category)
+
+    def _drop(self, key: Tuple[str, str]) -> bool:
+        """移除一个缓存条目并清理其记忆归属（同一记忆仍被同用户另一条目缓存时保留）"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for category, memory in self._iter_memories(key, entry[1]):
+            other = (key[0], category) if key[1] == ALL_CATEGORIES else (key[0], ALL_CATEGORIES)
+            if "_id" in memory and other not in self._entries:
+                self._owners.pop(memory["_id"], None)
+        return True
+
+    def _prune_generations(self):
+        """代数表超过容量时，按最久未写入的顺序清理没有缓存条目的用户，直到剩下一半容量"""
+        if len(self._generations) <= self.max_entries:
+            return
+        cached_users = {key[0] for key in self._entries}
+        target = self.max_entries // 2
+        for user_id in list(self._generations):
+            if len(self._generations) <= target:
+                break
+            if user_id not in cached_users:
+                self._generation_floor = max(self._generation_floor, self._generations.pop(user_id))
+
+    def get_many(self, user_id: str, categories: List[str]) -> Tuple[Dict[str, List[dict]], List[str]]:
+        """返回 (命中的 类别->记忆列表, 未命中的类别)"""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for category in categories:
+                key = (user_id, category)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    self._drop(key)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.append(category)
+                    continue
+                self._entries.move_to_end(key)
+                found[category] = entry[1]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, user_id: str, memories: Dict[str, List[dict]], generation: int):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if self._generations.get(user_id, self._generation_floor) != generation:
+                return
+            for category, docs in memories.items():
+                key = (user_id, category)
+                self._drop(key)
+                self._entries[key] = (expires_at, docs)
+                self._track(key, docs)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, user_id: str, category: Optional[str] = None):
+        """失效某用户某类别的缓存（同时失效"全部类别"的缓存）；category 为 None 时失效该用户全部缓存"""
+        with self._lock:
+            self._generation_counter += 1
+            self._generations[user_id] = self._generation_counter
+            self._generations.move_to_end(user_id)
+            if category is None:
+                keys = [key for key in self._entries if key[0] == user_id]
+            else:
+                keys = [(user_id, category), (user_id, ALL_CATEGORIES)]
+            for key in keys:
+                if self._drop(key):
+                    self.invalidations += 1
+            self._prune_generations()
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._owners.clear()
+            # 所有用户的代数同时推进：清空代数表并把下限抬到新的计数值
+            self._generation_counter += 1
+            self._generation_floor = self._generation_counter
+            self._generations.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": MEMORY_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "tracked_users": len(self._generations),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class ChangeStreamInvalidator:
+    """
+    监听记忆集合的 change stream，使其他进程写入的记忆在本进程缓存中失效
+
+    change stream 需要副本集或分片集群；单机 MongoDB 上启动失败时只记录警告，
+    此时跨进程一致性由缓存 TTL 兜底。
+    """
+
+    def __init__(self, cache: MemoryCache, collection, retry_interval: float = 5.0):
+        self.cache = cache
+        self.collection = collection
+        self.retry_interval = retry_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._resume_token = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="memory-cache-change-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from pymongo.errors import OperationFailure, PyMongoError
+
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        while not self._stop.is_set():
+            try:
+                with self.collection.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                    max_await_time_ms=1000
+                ) as stream:
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        self._resume_token = stream.resume_token
+                        self._apply(change)
+            except OperationFailure as e:
+                # 单机部署不支持 change stream，不再重试
+                logger.warning(f"记忆缓存 change stream 不可用，跨进程失效依赖 TTL: {str(e)}")
+                return
+            except PyMongoError as e:
+                logger.warning(f"记忆缓存 change stream 中断，{self.retry_interval}s 后重连: {str(e)}")
+                # 中断期间的变更可能已丢失，清空缓存保证不返回过期数据
+                self.cache.clear()
+                self._stop.wait(self.retry_interval)
+
+    def _apply(self, change: Dict):
+        document = change.get("fullDocument") or {}
+        user_id = document.get("user_id")
+        if user_id is not None:
+            self.cache.invalidate(user_id, document.get("category"))
+            return
+        # 删除事件（或 updateLookup 时文档已被删除）没有 fullDocument：按 _id 找本进程缓存中的归属，
+        # 找不到说明该文档不在任何缓存条目中（如压缩任务删除的非最新版本），无需失效
+        owner = self.cache.owner((change.get("documentKey") or {}).get("_id"))
+        if owner is not None:
+            self.cache.invalidate(*owner)
+
+
+_memory_cache = MemoryCache(MEMORY_CACHE_MAX_ENTRIES, MEMORY_CACHE_TTL_SECONDS)
+_invalidator: Optional[ChangeStreamInvalidator] = None
+
+
+def get_memory_cache() -> Optional[MemoryCache]:
+    """返回进程内共享的记忆缓存，未启用时返回 None"""
+    return _memory_cache if MEMORY_CACHE_ENABLED else None
+
+
+def invalidate_memory_cache(user_id: str, category: Optional[str] = None):
+    # 缓存关闭时没有条目可删，但仍推进失效代数，供语义索引等判断用户记忆是否变化
+    _memory_cache.invalidate(user_id, category)
+
+
+def memory_generation(user_id: str) -> int:
+    """用户记忆的失效代数，每次写入后递增"""
+    return _memory_cache.generation(user_id)
+
+
+def memory_cache_stats() -> Dict[str, float]:
+    return _memory_cache.stats()
+
+
+def start_change_stream_invalidation():
+    """启动跨进程失效监听（仅单集合存储布局可用）"""
+    global _invalidator
+    if not MEMORY_CACHE_ENABLED or _invalidator is not None:
+        return
+    from utils.mongo_pool import get_mongo_client
+
+    collection = get_mongo_client()[MEMORY_STORE_DB_NAME][MEMORY_STORE_COLLECTION]
+    _invalidator = ChangeStreamInvalidator(_memory_cache, collection)
+    _invalidator.start()
@@ -0,0 +1,212 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from pymongo import MongoClient, monitoring
+
+from load_config import (
+    MONGODB_HOST,
+    MONGODB_PORT,
+    MONGODB_MAX_POOL_SIZE,
+    MONGODB_MIN_POOL_SIZE,
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    MONGODB_POOL_PREWARM
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MONGODB_URI = f"mongodb://{MONGODB_HOST}:{MONGODB_PORT}/"
+
+# 等待超过该时长的借出视为一次"等待"（连接池没有空闲连接）
+WAIT_THRESHOLD_SECONDS = 0.001
+
+
+class PoolStats(monitoring.ConnectionPoolListener, monitoring.CommandListener):
+    """通过 pymongo 监控事件统计单个连接池的借出、等待和命令延迟"""
+
+    def __init__(self, latency_window: int = 1000):
+        self._lock = threading.Lock()
+        self._checkout_started = threading.local()
+        self._latencies = deque(maxlen=latency_window)
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.in_use = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.commands = 0
+        self.command_failures = 0
+
+    # 连接池事件
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.value = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, "duration", None)
+        if wait is None:
+            started = getattr(self._checkout_started, "value", None)
+            wait = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if wait > WAIT_THRESHOLD_SECONDS:
+                self.waits += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    # 命令事件
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with self._lock:
+            self.commands += 1
+            self._latencies.append(event.duration_micros / 1000.0)
+
+    def failed(self, event):
+        with self._lock:
+            self.commands += 1
+            self.command_failures += 1
+            self._latencies.append(event.duration_micros / 1000.0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "in_use": self.in_use,
+                "open_connections": self.connections_created - self.connections_closed,
+                "connections_created": self.connections_created,
+                "waits": self.waits,
+                "wait_mean_ms": self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+                "commands": self.commands,
+                "command_failures": self.command_failures,
+                "latency_mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+                "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+            }
+
+
+class MongoClientRegistry:
+    """
+    进程内的 MongoDB 客户端注册表
+
+    同一 URI（及连接选项）只创建一个 MongoClient，所有模块共享其连接池；
+    调用方不应自行 close 从注册表取得的客户端。
+    """
+
+    def __init__(
+        self,
+        max_pool_size: int = MONGODB_MAX_POOL_SIZE,
+        min_pool_size: int = MONGODB_MIN_POOL_SIZE,
+        wait_queue_timeout_ms: int = MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        prewarm: bool = MONGODB_POOL_PREWARM,
+    ):
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.prewarm = prewarm
+        self._clients: Dict[str, MongoClient] = {}
+        self._stats: Dict[str, PoolStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(uri: str, options: Dict) -> str:
+        if not options:
+            return uri
+        return uri + "|" + ",".join(f"{k}={options[k]}" for k in sorted(options))
+
+    def get_client(self, uri: Optional[str] = None, **options) -> MongoClient:
+        uri = uri or DEFAULT_MONGODB_URI
+        key = self._key(uri, options)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            stats = PoolStats()
+            client = MongoClient(
+                uri,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                waitQueueTimeoutMS=self.wait_queue_timeout_ms,
+                event_listeners=[stats],
+                **options
+            )
+            self._clients[key] = client
+            self._stats[key] = stats
+        if self.prewarm:
+            threading.Thread(target=self._prewarm, args=(key, client), daemon=True).start()
+        return client
+
+    def _prewarm(self, key: str, client: MongoClient):
+        """在后台建立第一条连接并完成服务器发现，minPoolSize 之内的其余连接由驱动补齐"""
+        try:
+            client.admin.command("ping")
+        except Exception as e:
+            logger.warning(f"MongoDB 连接池预热失败 ({key}): {str(e)}")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {key: stats.snapshot() for key, stats in self._stats.items()}
+
+    def close_all(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._stats.clear()
+
+
+_registry = MongoClientRegistry()
+
+
+def get_mongo_client(uri: Optional[str] = None, **options) -> MongoClient:
+    """返回共享的 MongoClient，默认连接配置中的 MONGODB_HOST:MONGODB_PORT"""
+    return _registry.get_client(uri, **options)
+
+
+def mongo_pool_stats() -> Dict[str, Dict[str, float]]:
+    return _registry.stats()
+
+
+def close_mongo_clients():
+    _registry.close_all()
@@ -1,9 +1,145 @@
-from pymongo import MongoClient
-from typing import Dict, List, Any
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Union
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne
+
+from utils.mongo_pool import get_mongo_client
+from utils.memory_cache import invalidate_memory_cache
+from utils.embedding_cache import normalize_text
+from load_config import (
+    MONGODB_HOST,
+    MONGODB_PORT,
+    MEMORY_STORE_LAYOUT,
+    MEMORY_STORE_DB_NAME,
+    MEMORY_STORE_COLLECTION,
+    MEMORY_WRITE_TRANSACTION,
+    MEMORY_ARCHIVE_COLLECTION
+)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 单集合存储中，一个用户一个类别的"当前记忆"查询条件（与旧布局的 get_memories 语义一致）
+CURRENT_MEMORY_QUERY = {
+    "$or": [
+        {"action": "创建"},
+        {"$and": [{"action": "更新"}, {"is_latest": True}]}
+    ]
+}
+
+
+# 记忆文档中的向量只供语义检索使用，常规读取不返回
+EMBEDDING_PROJECTION = {"embedding": 0}
+
+
+def parse_timestamp(value: Union[str, datetime, None]) -> datetime:
+    """把旧数据中的字符串时间统一转换为 datetime"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value, TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    return datetime.now()
+
+
+def to_object_id(value: Any) -> Any:
+    """记忆 id 统一使用 ObjectId；接口层传入的字符串 id 在这里转换，无法转换的原样返回"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def knowledge_hash(knowledge: Optional[str]) -> str:
+    """规范化后记忆内容的哈希，用于按内容定位待更新的记忆"""
+    return hashlib.sha256(normalize_text(knowledge).encode("utf-8")).hexdigest()
+
+
+def format_timestamp(value: Union[str, datetime, None]) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+
+@dataclass
+class MemoryWrite:
+    """一次记忆写入：previous_id 为空时创建新记忆，否则写入为该记忆的新版本"""
+    category: str
+    memory: Dict[str, Any]
+    previous_id: Any = None
+
+
+@dataclass
+class MemoryWriteResult:
+    inserted_ids: List[Any] = field(default_factory=list)
+    latency_ms: float = 0.0
+    transaction: bool = False
+
+
+class MemoryWriteStats:
+    """记忆批量写入的批次数、条数和每批延迟"""
+
+    def __init__(self, latency_window: int = 1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.batches = 0
+        self.writes = 0
+        self.operations = 0
+        self.failures = 0
+        self.last_batch_ms = 0.0
+
+    def record(self, writes: int, operations: int, latency_ms: float):
+        with self._lock:
+            self.batches += 1
+            self.writes += writes
+            self.operations += operations
+            self.last_batch_ms = latency_ms
+            self._latencies.append(latency_ms)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "batches": self.batches,
+                "writes": self.writes,
+                "operations": self.operations,
+                "failures": self.failures,
+                "writes_per_batch": self.writes / self.batches if self.batches else 0.0,
+                "last_batch_ms": self.last_batch_ms,
+                "batch_p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+                "batch_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+            }
+
+
+_write_stats = MemoryWriteStats()
+
+
+def memory_write_stats() -> Dict[str, float]:
+    return _write_stats.snapshot()
+
+
+class PerUserPatientInfoSystem:
+    """
+    旧存储布局：每个 user_id 一个数据库，每个类别一个集合
+
+    仅用于迁移前的兼容读写和迁移工具读取旧数据。
+    """
 
-class MongoDBPatientInfoSystem:
     def __init__(self, connection_string: str):
-        self.client = MongoClient(connection_string)
+        self.client = get_mongo_client(connection_string)
 
     def get_user_db(self, user_id: str):
         return self.client[user_id]
@@ -14,38 +150,492 @@ class MongoDBPatientInfoSystem:
 
     def add_memory(self, user_id: str, category: str, memory: Dict[str, Any]):
         collection = self.get_category_collection(user_id, category)
+        memory['timestamp'] = datetime.now().strftime(TIMESTAMP_FORMAT)
+        memory['knowledge_hash'] = knowledge_hash(memory.get('knowledge'))
+        memory['is_latest'] = True
         result = collection.insert_one(memory)
+        invalidate_memory_cache(user_id, category)
         return result.inserted_id
 
     def update_memory(self, user_id: str, category: str, memory_id: str, updated_memory: Dict[str, Any]):
         collection = self.get_category_collection(user_id, category)
-        result = collection.update_one({"_id": memory_id}, {"$set": updated_memory})
-        return result.modified_count
+        memory_id = to_object_id(memory_id)
+        original_memory = collection.find_one({"_id": memory_id})
+        if not original_memory:
+            return None
+
+        collection.update_one(
+            {"_id": memory_id},
+            {"$set": {"is_latest": False}}
+        )
+
+        updated_memory['timestamp'] = datetime.now().strftime(TIMESTAMP_FORMAT)
+        updated_memory['previous_version_id'] = memory_id
+        updated_memory['knowledge_hash'] = knowledge_hash(updated_memory.get('knowledge'))
+        updated_memory['is_latest'] = True
+
+        result = collection.insert_one(updated_memory)
+        invalidate_memory_cache(user_id, category)
+        return result.inserted_id
 
     def delete_memory(self, user_id: str, category: str, memory_id: str):
         collection = self.get_category_collection(user_id, category)
-        result = collection.delete_one({"_id": memory_id})
+        result = collection.delete_one({"_id": to_object_id(memory_id)})
+        invalidate_memory_cache(user_id, category)
         return result.deleted_count
 
-    def get_memories(self, user_id: str, category: str) -> List[Dict[str, Any]]:
+    def write_memories(self, user_id: str, writes: List[MemoryWrite]) -> MemoryWriteResult:
+        """旧布局按类别分散在多个集合中，无法合并为一次 bulk_write，逐条写入"""
+        start = time.perf_counter()
+        inserted_ids = []
+        for write in writes:
+            memory = dict(write.memory)
+            inserted_id = None
+            if write.previous_id is not None:
+                inserted_id = self.update_memory(user_id, write.category, write.previous_id, memory)
+            if inserted_id is None:
+                inserted_id = self.add_memory(user_id, write.category, memory)
+            inserted_ids.append(inserted_id)
+        latency_ms = (time.perf_counter() - start) * 1000
+        _write_stats.record(len(writes), len(writes), latency_ms)
+        return MemoryWriteResult(inserted_ids, latency_ms)
+
+    def set_memory_embeddings(self, user_id: str, embeddings: List[tuple]):
+        """补写记忆向量，embeddings 为 (类别, 记忆ID, 向量) 列表"""
+        for category, memory_id, vector in embeddings:
+            self.get_category_collection(user_id, category).update_one(
+                {"_id": memory_id}, {"$set": {"embedding": vector}}
+            )
+
+    def get_memories(self, user_id: str, category: str, include_history: bool = False):
+        collection = self.get_category_collection(user_id, category)
+        if include_history:
+            return list(collection.find({}, EMBEDDING_PROJECTION).sort("timestamp", -1))
+        return list(collection.find(CURRENT_MEMORY_QUERY, EMBEDDING_PROJECTION))
+
+    def find_latest_by_knowledge(self, user_id: str, category: str, knowledge: str) -> Optional[Dict[str, Any]]:
+        """按内容查找当前最新的记忆（兼容没有 knowledge_hash 的旧数据）"""
+        collection = self.get_category_collection(user_id, category)
+        return collection.find_one(
+            {"$or": [{"knowledge_hash": knowledge_hash(knowledge)}, {"knowledge": knowledge}], "is_latest": True},
+            EMBEDDING_PROJECTION,
+            sort=[("timestamp", DESCENDING)]
+        )
+
+    def find_latest_by_id(self, user_id: str, category: str, memory_id: Any) -> Optional[Dict[str, Any]]:
+        return self.get_category_collection(user_id, category).find_one(
+            {"_id": to_object_id(memory_id), "is_latest": True}, EMBEDDING_PROJECTION
+        )
+
+    def get_latest_memories(
+        self,
+        user_id: str,
+        categories: Optional[List[str]] = None,
+        confidence_threshold: Optional[float] = None,
+        include_embeddings: bool = False
+    ) -> Dict[str, List[dict]]:
+        """按类别逐个集合查询最新记忆"""
+        db = self.get_user_db(user_id)
+        if categories is None:
+            categories = db.list_collection_names()
+
+        query = {"is_latest": True}
+        if confidence_threshold is not None:
+            query["confidence"] = {"$gte": confidence_threshold}
+
+        result = {}
+        for category in categories:
+            memories = list(db[category].find(query, None if include_embeddings else EMBEDDING_PROJECTION))
+            if memories:
+                result[category] = memories
+        return result
+
+    def get_memory_history(
+        self,
+        user_id: str,
+        category: str,
+        memory_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_archived: bool = False
+    ) -> List[Dict[str, Any]]:
+        """获取某条记忆的所有历史版本（逐个版本查询，仅用于迁移前兼容；旧布局没有归档集合）"""
         collection = self.get_category_collection(user_id, category)
-        return list(collection.find())
+        history = []
+        current_id = to_object_id(memory_id)
+
+        while current_id:
+            memory = collection.find_one({"_id": current_id})
+            if memory:
+                history.append(memory)
+                # 旧数据的 previous_version_id 是字符串，需转换后才能匹配 _id
+                current_id = to_object_id(memory.get('previous_version_id'))
+            else:
+                break
+
+        if since is not None:
+            history = [memory for memory in history if parse_timestamp(memory.get('timestamp')) >= since]
+        if until is not None:
+            history = [memory for memory in history if parse_timestamp(memory.get('timestamp')) <= until]
+        return history
+
+    def get_memory_history_page(
+        self,
+        user_id: str,
+        category: str,
+        memory_id: str,
+        skip: int = 0,
+        limit: int = 20,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_archived: bool = False
+    ) -> Dict[str, Any]:
+        history = self.get_memory_history(user_id, category, memory_id, since, until)
+        return {"items": history[skip:skip + limit], "total": len(history), "skip": skip, "limit": limit}
+
+
+class MongoDBPatientInfoSystem:
+    """
+    多租户记忆存储：所有用户、所有类别的记忆保存在同一个集合中
+
+    文档以 user_id、category 区分，timestamp 保存为 datetime；
+    (user_id, category, is_latest) 复合索引支撑按类别读取最新记忆，
+    多个类别通过一次 $in 查询取回。
+    """
+
+    # 已确认建好索引的集合，避免每次实例化都发送 createIndexes
+    _indexed_collections = set()
+
+    def __init__(
+        self,
+        connection_string: Optional[str] = None,
+        db_name: str = MEMORY_STORE_DB_NAME,
+        collection_name: str = MEMORY_STORE_COLLECTION
+    ):
+        self.client = get_mongo_client(connection_string)
+        self.collection = self.client[db_name][collection_name]
+        # 压缩任务把较早的非最新版本移到冷集合，审计时可一并查询
+        self.archive = self.client[db_name][MEMORY_ARCHIVE_COLLECTION]
+        if (db_name, collection_name) not in self._indexed_collections:
+            self.ensure_indexes()
+            self._indexed_collections.add((db_name, collection_name))
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            [("user_id", ASCENDING), ("category", ASCENDING), ("is_latest", ASCENDING)],
+            name="user_category_latest"
+        )
+        self.collection.create_index(
+            [("user_id", ASCENDING), ("timestamp", DESCENDING)],
+            name="user_timestamp"
+        )
+        self.collection.create_index(
+            [("user_id", ASCENDING), ("category", ASCENDING), ("knowledge_hash", ASCENDING), ("is_latest", ASCENDING)],
+            name="user_category_knowledge_hash"
+        )
+        self.archive.create_index(
+            [("user_id", ASCENDING), ("timestamp", DESCENDING)],
+            name="user_timestamp"
+        )
+
+    def add_memory(self, user_id: str, category: str, memory: Dict[str, Any]):
+        document = dict(memory)
+        if document.get('previous_version_id'):
+            document['previous_version_id'] = to_object_id(document['previous_version_id'])
+        document['user_id'] = user_id
+        document['category'] = category
+        document['timestamp'] = datetime.now()
+        document['knowledge_hash'] = knowledge_hash(document.get('knowledge'))
+        document['is_latest'] = True
+        result = self.collection.insert_one(document)
+        invalidate_memory_cache(user_id, category)
+        return result.inserted_id
+
+    def update_memory(self, user_id: str, category: str, memory_id: str, updated_memory: Dict[str, Any]):
+        # 将原记忆标记为非最新版本；原记忆不存在（或不属于该用户）时不做更新
+        memory_id = to_object_id(memory_id)
+        result = self.collection.update_one(
+            {"_id": memory_id, "user_id": user_id},
+            {"$set": {"is_latest": False}}
+        )
+        if result.matched_count == 0:
+            return None
+
+        document = dict(updated_memory)
+        document.pop('_id', None)
+        document['user_id'] = user_id
+        document['category'] = category
+        document['timestamp'] = datetime.now()
+        document['previous_version_id'] = memory_id
+        document['knowledge_hash'] = knowledge_hash(document.get('knowledge'))
+        document['is_latest'] = True
+        result = self.collection.insert_one(document)
+        invalidate_memory_cache(user_id, category)
+        return result.inserted_id
+
+    def delete_memory(self, user_id: str, category: str, memory_id: str):
+        result = self.collection.delete_one({"_id": to_object_id(memory_id), "user_id": user_id, "category": category})
+        invalidate_memory_cache(user_id, category)
+        return result.deleted_count
+
+    def write_memories(self, user_id: str, writes: List[MemoryWrite], transaction: bool = MEMORY_WRITE_TRANSACTION) -> MemoryWriteResult:
+        """
+        把一轮抽取出的所有创建和更新合并为一次有序 bulk_write
+
+        新版本先插入、再清除旧版本的 is_latest，批次中途失败时最多出现两条最新记忆，
+        而不会出现没有最新记忆的情况；transaction 为 True 时整批在事务中执行（需要副本集）。
+        同一批中多次更新同一条记忆时，后一次更新接在前一次的新版本之后。
+        """
+        if not writes:
+            return MemoryWriteResult(transaction=transaction)
+
+        now = datetime.now()
+        operations = []
+        inserted_ids = []
+        superseded = {}
+        for write in writes:
+            document = dict(write.memory)
+            document['_id'] = ObjectId()
+            document['user_id'] = user_id
+            document['category'] = write.category
+            document['timestamp'] = now
+            document['knowledge_hash'] = knowledge_hash(document.get('knowledge'))
+            document['is_latest'] = True
+            if write.previous_id is None:
+                document.pop('previous_version_id', None)
+                operations.append(InsertOne(document))
+            else:
+                original_id = to_object_id(write.previous_id)
+                previous_id = superseded.get(original_id, original_id)
+                superseded[original_id] = document['_id']
+                document['previous_version_id'] = previous_id
+                operations.append(InsertOne(document))
+                operations.append(UpdateOne({"_id": previous_id, "user_id": user_id}, {"$set": {"is_latest": False}}))
+            inserted_ids.append(document['_id'])
+
+        start = time.perf_counter()
+        try:
+            if transaction:
+                with self.client.start_session() as session:
+                    session.with_transaction(
+                        lambda s: self.collection.bulk_write(operations, ordered=True, session=s)
+                    )
+            else:
+                self.collection.bulk_write(operations, ordered=True)
+        except Exception:
+            _write_stats.record_failure()
+            raise
+        finally:
+            for category in {write.category for write in writes}:
+                invalidate_memory_cache(user_id, category)
+        latency_ms = (time.perf_counter() - start) * 1000
+        _write_stats.record(len(writes), len(operations), latency_ms)
+        return MemoryWriteResult(inserted_ids, latency_ms, transaction)
+
+    def get_memories(self, user_id: str, category: str, include_history: bool = False):
+        query = {"user_id": user_id, "category": category}
+        if include_history:
+            return list(self.collection.find(query, EMBEDDING_PROJECTION).sort("timestamp", DESCENDING))
+        return list(self.collection.find({**query, **CURRENT_MEMORY_QUERY}, EMBEDDING_PROJECTION))
+
+    def find_latest_by_knowledge(self, user_id: str, category: str, knowledge: str) -> Optional[Dict[str, Any]]:
+        """按规范化内容哈希查找当前最新的记忆，一次索引查询，与该类别已有记忆的数量无关"""
+        return self.collection.find_one(
+            {
+                "user_id": user_id,
+                "category": category,
+                "knowledge_hash": knowledge_hash(knowledge),
+                "is_latest": True
+            },
+            EMBEDDING_PROJECTION,
+            sort=[("timestamp", DESCENDING)]
+        )
+
+    def find_latest_by_id(self, user_id: str, category: str, memory_id: Any) -> Optional[Dict[str, Any]]:
+        """按记忆 ID 查找该类别中仍为最新版本的记忆（knowledge master 从提示词中引用的 ID）"""
+        return self.collection.find_one(
+            {"_id": to_object_id(memory_id), "user_id": user_id, "category": category, "is_latest": True},
+            EMBEDDING_PROJECTION
+        )
+
+    def backfill_knowledge_hashes(self, batch_size: int = 1000) -> int:
+        """为迁移来的、缺少 knowledge_hash 的记忆补写哈希，返回更新条数"""
+        updated = 0
+        ops = []
+        for doc in self.collection.find({"knowledge_hash": {"$exists": False}}, {"knowledge": 1}):
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"knowledge_hash": knowledge_hash(doc.get("knowledge"))}}))
+            if len(ops) >= batch_size:
+                updated += self.collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            updated += self.collection.bulk_write(ops, ordered=False).modified_count
+        return updated
+
+    def get_latest_memories(
+        self,
+        user_id: str,
+        categories: Optional[List[str]] = None,
+        confidence_threshold: Optional[float] = None,
+        include_embeddings: bool = False
+    ) -> Dict[str, List[dict]]:
+        """一次查询取回多个类别的最新记忆，按类别分组"""
+        query = {"user_id": user_id, "is_latest": True}
+        if categories is not None:
+            query["category"] = {"$in": list(categories)}
+        if confidence_threshold is not None:
+            query["confidence"] = {"$gte": confidence_threshold}
+
+        result = {}
+        projection = None if include_embeddings else EMBEDDING_PROJECTION
+        for memory in self.collection.find(query, projection).sort("timestamp", ASCENDING):
+            result.setdefault(memory["category"], []).append(memory)
+        return result
+
+    def _history_pipeline(
+        self,
+        user_id: str,
+        memory_id: Any,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        collection=None
+    ) -> List[Dict[str, Any]]:
+        """
+        以 memory_id 为起点沿 previous_version_id 向前追溯的聚合管道
+
+        $graphLookup 从文档自身的 _id 开始匹配，因此当前版本（depth 0）也在结果中，
+        按 depth 升序即为从新到旧；restrictSearchWithMatch 保证不会跨用户追溯。
+        """
+        graph_lookup = {
+            "from": (collection if collection is not None else self.collection).name,
+            "startWith": "$_id",
+            "connectFromField": "previous_version_id",
+            "connectToField": "_id",
+            "as": "versions",
+            "depthField": "depth",
+            "restrictSearchWithMatch": {"user_id": user_id}
+        }
+        pipeline = [
+            {"$match": {"_id": to_object_id(memory_id), "user_id": user_id}},
+            {"$graphLookup": graph_lookup},
+            {"$unwind": "$versions"},
+            {"$replaceRoot": {"newRoot": "$versions"}},
+            {"$project": EMBEDDING_PROJECTION},
+        ]
+        time_range = {}
+        if since is not None:
+            time_range["$gte"] = since
+        if until is not None:
+            time_range["$lte"] = until
+        if time_range:
+            pipeline.append({"$match": {"timestamp": time_range}})
+        pipeline.append({"$sort": {"depth": ASCENDING}})
+        return pipeline
+
+    def get_memory_history(
+        self,
+        user_id: str,
+        category: str,
+        memory_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_archived: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        一次聚合获取某条记忆的所有历史版本（从新到旧），可按时间范围截取
+
+        include_archived 为 True 时，若版本链延伸到已归档的旧版本，再对归档集合做一次聚合接上（标记 archived）。
+        """
+        if not include_archived:
+            return list(self.collection.aggregate(self._history_pipeline(user_id, memory_id, since, until)))
+
+        history = list(self.collection.aggregate(self._history_pipeline(user_id, memory_id)))
+        if history and history[-1].get('previous_version_id'):
+            offset = history[-1]['depth'] + 1
+            archived = self.archive.aggregate(
+                self._history_pipeline(user_id, history[-1]['previous_version_id'], collection=self.archive)
+            )
+            for memory in archived:
+                memory['depth'] += offset
+                memory['archived'] = True
+                history.append(memory)
+        if since is not None:
+            history = [memory for memory in history if memory['timestamp'] >= since]
+        if until is not None:
+            history = [memory for memory in history if memory['timestamp'] <= until]
+        return history
+
+    def get_memory_history_page(
+        self,
+        user_id: str,
+        category: str,
+        memory_id: str,
+        skip: int = 0,
+        limit: int = 20,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_archived: bool = False
+    ) -> Dict[str, Any]:
+        """分页获取历史版本，同一次聚合中返回总版本数，供审计界面翻页"""
+        if include_archived:
+            history = self.get_memory_history(user_id, category, memory_id, since, until, include_archived=True)
+            return {"items": history[skip:skip + limit], "total": len(history), "skip": skip, "limit": limit}
+        pipeline = self._history_pipeline(user_id, memory_id, since, until)
+        pipeline.append({"$facet": {
+            "items": [{"$skip": skip}, {"$limit": limit}],
+            "total": [{"$count": "count"}]
+        }})
+        result = next(self.collection.aggregate(pipeline), {"items": [], "total": []})
+        total = result["total"][0]["count"] if result["total"] else 0
+        return {"items": result["items"], "total": total, "skip": skip, "limit": limit}
+
+    def normalize_version_ids(self, batch_size: int = 1000) -> int:
+        """把旧数据中字符串形式的 previous_version_id 转换为 ObjectId，返回更新条数"""
+        updated = 0
+        ops = []
+        for doc in self.collection.find({"previous_version_id": {"$type": "string"}}, {"previous_version_id": 1}):
+            previous_id = to_object_id(doc["previous_version_id"])
+            if not isinstance(previous_id, ObjectId):
+                continue
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"previous_version_id": previous_id}}))
+            if len(ops) >= batch_size:
+                updated += self.collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            updated += self.collection.bulk_write(ops, ordered=False).modified_count
+        return updated
+
+    def set_memory_embeddings(self, user_id: str, embeddings: List[tuple]):
+        """补写记忆向量，embeddings 为 (类别, 记忆ID, 向量) 列表"""
+        if not embeddings:
+            return
+        self.collection.bulk_write([
+            UpdateOne({"_id": memory_id, "user_id": user_id}, {"$set": {"embedding": vector}})
+            for _, memory_id, vector in embeddings
+        ], ordered=False)
+
+
+def get_patient_info_system(connection_string: Optional[str] = None):
+    """根据配置的存储布局返回记忆存储（collection: 单集合多租户 / per_user: 旧的每用户一个数据库）"""
+    connection_string = connection_string or f"mongodb://{MONGODB_HOST}:{MONGODB_PORT}/"
+    if MEMORY_STORE_LAYOUT == "per_user":
+        return PerUserPatientInfoSystem(connection_string)
+    return MongoDBPatientInfoSystem(connection_string)
 
-# 可以添加更多的方法，比如批量操作、聚合查询等，根据需求扩展
 
 if __name__ == "__main__":
-    # 这里可以添加一些测试代码
-    db_system = MongoDBPatientInfoSystem("mongodb://localhost:27017/")
-    
+    db_system = get_patient_info_system()
+
     # 测试添加记忆
-    memory_id = db_system.add_memory("test_user", "CHIEF_COMPLAINT", {"content": "Patient reported severe headache"})
-    
+    memory_id = db_system.add_memory("test_user", "主诉", {"knowledge": "患者自述严重头痛", "action": "创建"})
+
     # 测试获取记忆
-    memories = db_system.get_memories("test_user", "CHIEF_COMPLAINT")
+    memories = db_system.get_memories("test_user", "主诉")
     print("Retrieved memories:", memories)
-    
+
     # 测试更新记忆
-    db_system.update_memory("test_user", "CHIEF_COMPLAINT", memory_id, {"content": "Patient reported severe headache and nausea"})
-    
+    new_memory_id = db_system.update_memory("test_user", "主诉", memory_id, {"knowledge": "患者自述严重头痛伴恶心", "action": "更新"})
+    print("Latest memories:", db_system.get_latest_memories("test_user", ["主诉"]))
+
     # 测试删除记忆
-    db_system.delete_memory("test_user", "CHIEF_COMPLAINT", memory_id)
\ No newline at end of file
+    db_system.delete_memory("test_user", "主诉", new_memory_id)
+    db_system.delete_memory("test_user", "主诉", memory_id)
@@ -0,0 +1,188 @@
+import rootutils
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+import time
+import asyncio
+import logging
+import threading
+from contextvars import ContextVar
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import faiss
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+from langchain.memory import VectorStoreRetrieverMemory
+
+from load_config import (
+    SESSION_TTL_SECONDS,
+    SESSION_MAX_SESSIONS,
+    SESSION_MAX_BYTES,
+    SESSION_MAX_MEMORY_ENTRIES,
+    SESSION_SWEEP_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# 当前正在处理的会话，工具（如记忆检索）通过它获取所属用户，而不是读取全局变量
+current_session_id: ContextVar[Optional[str]] = ContextVar("current_session_id", default=None)
+# 当前轮次的用户输入，记忆检索工具在语义检索模式下以它作为默认检索语句
+current_user_input: ContextVar[Optional[str]] = ContextVar("current_user_input", default=None)
+
+
+@dataclass
+class Session:
+    session_id: str
+    user_id: str
+    state: Dict
+    memory: VectorStoreRetrieverMemory
+    vectorstore: FAISS
+    created_at: float = field(default_factory=time.monotonic)
+    last_active: float = field(default_factory=time.monotonic)
+    # 同一会话的多轮对话按顺序处理：app 在每轮对话期间持有该锁，sweep 不会回收持有锁的会话
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def memory_entries(self) -> int:
+        return self.vectorstore.index.ntotal
+
+
+class SessionManager:
+    """
+    会话管理器
+
+    每个会话拥有独立的对话状态和独立的短期向量记忆（FAISS），
+    空闲超过 TTL 的会话会被回收；会话数或占用内存超过上限时按最近最少使用顺序淘汰。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        dimension: int,
+        ttl_seconds: int = SESSION_TTL_SECONDS,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        max_bytes: int = SESSION_MAX_BYTES,
+        max_memory_entries: int = SESSION_MAX_MEMORY_ENTRIES,
+    ):
+        # 传入 Embeddings 实例而不是 embed_query 函数：会话记忆的 aload/asave 需要 aembed_query/aembed_documents
+        self.embeddings = embeddings
+        self.dimension = dimension
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_memory_entries = max_memory_entries
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created_total = 0
+        self.expired_total = 0
+        self.evicted_total = 0
+
+    def _new_memory(self):
+        vectorstore = FAISS(
+            embedding_function=self.embeddings,
+            index=faiss.IndexFlatL2(self.dimension),
+            docstore=InMemoryDocstore({}),
+            index_to_docstore_id={}
+        )
+        retriever = vectorstore.as_retriever(search_kwargs=dict(k=3))
+        return vectorstore, VectorStoreRetrieverMemory(retriever=retriever)
+
+    def create(self, state: Dict) -> Session:
+        """以初始化好的对话状态创建会话（state 中需包含 session_id 和 user_id）"""
+        vectorstore, memory = self._new_memory()
+        session = Session(
+            session_id=state["session_id"],
+            user_id=state["user_id"],
+            state=state,
+            memory=memory,
+            vectorstore=vectorstore
+        )
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self.created_total += 1
+        self.sweep()
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        if session_id is None:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def current(self) -> Optional[Session]:
+        return self.get(current_session_id.get())
+
+    def close(self, session_id: Optional[str]):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def prune_memory(self, session: Session):
+        """单个会话的短期记忆只保留最近 max_memory_entries 条"""
+        ids = list(session.vectorstore.index_to_docstore_id.values())
+        overflow = len(ids) - self.max_memory_entries
+        if overflow > 0:
+            session.vectorstore.delete(ids[:overflow])
+
+    @staticmethod
+    def session_bytes(session: Session) -> int:
+        """估算会话占用的内存：向量索引 + 记忆文本 + 对话消息"""
+        index = session.vectorstore.index
+        size = index.ntotal * index.d * 4
+        for doc in session.vectorstore.docstore._dict.values():
+            size += len(doc.page_content.encode("utf-8"))
+        for message in session.state.get("messages", []):
+            content = message.content if isinstance(message.content, str) else str(message.content)
+            size += len(content.encode("utf-8"))
+        return size
+
+    def sweep(self) -> Dict[str, int]:
+        """回收过期会话，并在超过会话数或内存上限时淘汰最久未使用的会话；正在处理轮次的会话跳过"""
+        now = time.monotonic()
+        expired = evicted = 0
+        with self._lock:
+            # 正在处理对话轮次（持有 lock）的会话不回收，避免轮次中途找不到会话
+            for session_id in [sid for sid, s in self._sessions.items()
+                               if not s.lock.locked() and now - s.last_active > self.ttl_seconds]:
+                del self._sessions[session_id]
+                expired += 1
+
+            sizes = {sid: self.session_bytes(s) for sid, s in self._sessions.items()}
+            total = sum(sizes.values())
+            for session_id in [sid for sid, s in self._sessions.items() if not s.lock.locked()]:
+                if len(self._sessions) <= self.max_sessions and total <= self.max_bytes:
+                    break
+                del self._sessions[session_id]
+                total -= sizes.pop(session_id)
+                evicted += 1
+
+            self.expired_total += expired
+            self.evicted_total += evicted
+        if expired or evicted:
+            logger.info(f"会话回收 - 过期: {expired}, 淘汰: {evicted}")
+        return {"expired": expired, "evicted": evicted}
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            return {
+                "live_sessions": len(sessions),
+                "live_users": len({s.user_id for s in sessions}),
+                "bytes_held": sum(self.session_bytes(s) for s in sessions),
+                "memory_entries": sum(s.memory_entries for s in sessions),
+                "created_total": self.created_total,
+                "expired_total": self.expired_total,
+                "evicted_total": self.evicted_total,
+            }
+
+    async def run_sweeper(self, interval: int = SESSION_SWEEP_INTERVAL):
+        """后台定期回收会话并记录指标"""
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+            logger.info(f"会话指标 - {self.metrics()}")
@@ -3,6 +3,10 @@ import websockets
 import aioconsole
 import json
 import sys
+import argparse
+
+# 流式协议版本，与服务端 app.STREAM_PROTOCOL_VERSION 保持一致
+STREAM_PROTOCOL_VERSION = 2
 
 async def async_print(*args, **kwargs):
     loop = asyncio.get_event_loop()
@@ -18,7 +22,26 @@ async def safe_print(*args, **kwargs):
             await asyncio.sleep(0.1)
     print("警告：无法打印输出", file=sys.stderr)
 
-async def client():
+async def receive_stream(websocket):
+    """接收流式响应帧，直到收到 done 帧"""
+    await safe_print("\nEi: ", end="", flush=True)
+    while True:
+        frame = json.loads(await asyncio.wait_for(websocket.recv(), timeout=30))
+        if 'error' in frame:
+            await safe_print(f"\n错误: {frame['error']}")
+            return
+        event = frame.get('event')
+        if event == 'token':
+            await safe_print(frame['delta'], end="", flush=True)
+        elif event == 'tool_data' and frame.get('tool_data'):
+            await safe_print(f"\n[工具调用: {frame['tool_data'].get('tool_name')}]")
+        elif event == 'memory_data':
+            await safe_print(f"\n[记忆抽取: {frame['memory_data']}]")
+        elif event == 'done':
+            await safe_print()
+            return
+
+async def client(stream: bool = False):
     uri = "ws://localhost:8763"
     while True:
         try:
@@ -40,9 +63,19 @@ async def client():
                         "type": consultation_type,
                         "question": user_input
                     }
+                    if stream:
+                        message["protocol_version"] = STREAM_PROTOCOL_VERSION
 
                     await websocket.send(json.dumps(message))
 
+                    if stream:
+                        try:
+                            await receive_stream(websocket)
+                        except asyncio.TimeoutError:
+                            await safe_print("等待服务器响应超时，正在重新连接...")
+                            break
+                        continue
+
                     try:
                         response = await asyncio.wait_for(websocket.recv(), timeout=30)
                         try:
@@ -60,8 +93,7 @@ async def client():
                                         await safe_print(f"工具输出: {response_data['tool_data']['tool_output']}")
                                     
                                     if response_data.get('memory_data'):
-                                        await safe_print(f"\n隐式记忆: {response_data['memory_data']['implicit_memory']}")
-                                        await safe_print(f"显式记忆: {response_data['memory_data']['explicit_memory']}")
+                                        await safe_print(f"\n记忆抽取: {response_data['memory_data']}")
                             else:
                                 await safe_print(f"\nEi: {response_data}")
                         except json.JSONDecodeError:
@@ -108,4 +140,7 @@ async def client():
             await asyncio.sleep(5)
 
 if __name__ == "__main__":
-    asyncio.get_event_loop().run_until_complete(client())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="WebSocket 对话客户端")
+    parser.add_argument("--stream", action="store_true", help="使用流式响应协议，逐字显示回复")
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(client(stream=args.stream))
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+WebSocket 对话服务压测
+
+先测量单个会话的单轮延迟，再同时发起 N 个会话，比较并发下的总耗时与单轮延迟：
+异步流水线下，N 个会话的总耗时应接近单个会话的耗时，而不是 N 倍。
+
+用法:
+    python app.py --mode websocket
+    python websocket_load_test.py --sessions 20 --turns 3
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from typing import List
+
+import websockets
+
+from load_config import WEB_SOCKET_PORT
+
+
+async def run_session(uri: str, session_index: int, turns: int, question: str, timeout: float) -> List[float]:
+    """单个会话：依次发送 turns 轮问题，返回每轮的延迟（秒）"""
+    latencies = []
+    async with websockets.connect(uri) as websocket:
+        for turn in range(turns):
+            message = {
+                "user_id": f"load_test_{session_index}",
+                "type": 0,
+                "question": f"{question}（第{turn + 1}轮）",
+            }
+            start = time.perf_counter()
+            await websocket.send(json.dumps(message, ensure_ascii=False))
+            response = json.loads(await asyncio.wait_for(websocket.recv(), timeout=timeout))
+            latencies.append(time.perf_counter() - start)
+            if isinstance(response, dict) and "error" in response:
+                print(f"会话 {session_index} 第 {turn + 1} 轮出错: {response['error']}")
+    return latencies
+
+
+def describe(latencies: List[float]) -> str:
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"mean={statistics.mean(ordered):.2f}s p50={statistics.median(ordered):.2f}s "
+        f"p95={p95:.2f}s max={ordered[-1]:.2f}s"
+    )
+
+
+async def main(args):
+    uri = f"ws://{args.host}:{args.port}"
+
+    print(f"单会话基线: {args.turns} 轮")
+    start = time.perf_counter()
+    baseline = await run_session(uri, 0, args.turns, args.question, args.timeout)
+    baseline_elapsed = time.perf_counter() - start
+    print(f"  总耗时 {baseline_elapsed:.2f}s, 单轮 {describe(baseline)}")
+
+    print(f"并发会话: {args.sessions} 个 x {args.turns} 轮")
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(run_session(uri, i + 1, args.turns, args.question, args.timeout) for i in range(args.sessions)),
+        return_exceptions=True,
+    )
+    concurrent_elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in results if isinstance(result, list) for latency in result]
+    failures = [result for result in results if isinstance(result, Exception)]
+    if latencies:
+        print(f"  总耗时 {concurrent_elapsed:.2f}s, 单轮 {describe(latencies)}")
+        print(f"  总耗时 / 单会话耗时 = {concurrent_elapsed / baseline_elapsed:.2f}（串行处理约为 {args.sessions}）")
+    if failures:
+        print(f"  失败会话 {len(failures)} 个，例如: {failures[0]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket 对话服务压测")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=WEB_SOCKET_PORT)
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的对话轮数")
+    parser.add_argument("--question", default="最近总是睡不好，白天也没有精神")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单轮等待回复的超时（秒）")
+    asyncio.run(main(parser.parse_args()))